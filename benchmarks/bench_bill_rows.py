@@ -0,0 +1,74 @@
+"""
+Compare bill rows formatted per second by CallRecordSerializer and by the compiled row formatter. Calls are priced
+with the tariffs of a migrated test database, created and destroyed around the benchmark.
+
+Usage: python benchmarks/bench_bill_rows.py [--rows 100] [--repeat 200]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telecom.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from records.formatters import format_bill_rows  # noqa: E402
+from records.serializers import CallRecordSerializer  # noqa: E402
+from records.utils import calculate_call_rate  # noqa: E402
+
+
+def build_rows(count: int) -> list:
+    rows = []
+    for _ in range(count):
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=random.randint(0, 31 * 86400))
+        end = start + timedelta(seconds=random.randint(0, 7200))
+        rows.append({
+            'start': start,
+            'end': end,
+            'call_id': str(uuid.uuid4()),
+            'destination': '9993468278',
+            'duration': end - start,
+            'price': calculate_call_rate(start, end)
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100, help='Rows per page.')
+    parser.add_argument('--repeat', type=int, default=200, help='Pages formatted per measure.')
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        rows = build_rows(args.rows)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    renderer = JSONRenderer()
+    assert renderer.render(format_bill_rows(rows)) == renderer.render(CallRecordSerializer(rows, many=True).data)
+
+    candidates = [
+        ('serializer', lambda: CallRecordSerializer(rows, many=True).data),
+        ('formatter', lambda: format_bill_rows(rows)),
+    ]
+    results = {}
+    for name, function in candidates:
+        elapsed = min(timeit.repeat(function, number=args.repeat, repeat=5))
+        results[name] = args.rows * args.repeat / elapsed
+        print(f'{name:>10}: {results[name]:>12,.0f} rows/sec')
+    print(f'   speedup: {results["formatter"] / results["serializer"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure the latency of /started/ requests served by the WSGI handler with a connection per request, with persistent
+connections and, in PostgreSQL, with the connection pool. Records are stored in the database of your .env file and
+deleted at the end.
+
+Usage: python benchmarks/bench_connections.py [--requests 500] [--pool-size 4]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telecom.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from records.models import CallStartRecord  # noqa: E402
+
+
+def measure(handler, count: int, call_ids: list) -> list:
+    factory = RequestFactory()
+    url = reverse('call_start_record_create')
+    latencies = []
+    for _ in range(count):
+        call_ids.append(str(uuid.uuid4()))
+        data = json.dumps({
+            'call_id': call_ids[-1],
+            'timestamp': '2020-01-01T12:00:00Z',
+            'source': '9998852642',
+            'destination': '9993468278',
+        })
+        environ = factory.post(url, data, content_type='application/json').environ
+        started = time.perf_counter()
+        response = handler(environ, lambda status, headers: None)
+        response.close()
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.content
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500, help='Requests per measure.')
+    parser.add_argument('--pool-size', type=int, default=4, help='Size of the connection pool, in PostgreSQL.')
+    args = parser.parse_args()
+
+    settings.RECORDS_INGEST_MODE = 'sync'
+    database = connection.settings_dict
+    candidates = [
+        ('per request', {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False}),
+        ('persistent', {'CONN_MAX_AGE': None, 'CONN_HEALTH_CHECKS': False}),
+    ]
+    if database['ENGINE'] == 'records.backends.postgresql':
+        candidates += [
+            ('health check', {'CONN_MAX_AGE': None, 'CONN_HEALTH_CHECKS': True}),
+            ('pool', {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False,
+                      'OPTIONS': {**database['OPTIONS'], 'pool': {'max_size': args.pool_size}}}),
+        ]
+    options = database['OPTIONS']
+    handler = WSGIHandler()
+    call_ids = []
+    try:
+        for name, overrides in candidates:
+            connection.close()
+            database.update({'OPTIONS': options, **overrides})
+            # Warm up the URL resolver, the serializers and the pool
+            measure(handler, 10, call_ids)
+            latencies = np.array(measure(handler, args.requests, call_ids)) * 1000
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f'{name:>12}: p50 {p50:>7.2f} ms   p99 {p99:>7.2f} ms')
+    finally:
+        connection.close()
+        database['OPTIONS'] = options
+        for index in range(0, len(call_ids), 500):
+            CallStartRecord.objects.filter(call_id__in=call_ids[index:index + 500]).delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Generate synthetic call detail records. Records are generated from a seed, so runs with the same options get the same
+records. Printed as NDJSON in delivery order, shaped like the API payloads with a type, so they can be loaded with
+load_cdrs.
+
+Usage: python benchmarks/cdrs.py [--subscribers 100] [--calls-per-month 30] [--period 2020-01] > cdrs.ndjson
+"""
+import argparse
+import calendar
+import json
+import random
+import sys
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+Call = namedtuple('Call', ['call_id', 'source', 'destination', 'start', 'end'])
+
+# Mean duration of calls that don't last several days, in seconds
+MEAN_DURATION = 180
+
+
+def generate_phone_number(rng: random.Random) -> str:
+    return f'{rng.randint(11, 99)}9{rng.randint(0, 99999999):08d}'
+
+
+def generate_calls(subscribers: int = 100, calls_per_month: int = 30, period: datetime = None,
+                   multi_day_ratio: float = 0.01, seed: int = 0) -> list:
+    """
+    Calls of the given number of subscribers started in the period, sorted by start. Durations are exponentially
+    distributed, except for the ratio of calls lasting from one to three days.
+    """
+    rng = random.Random(seed)
+    period = period or datetime(2020, 1, 1, tzinfo=timezone.utc)
+    _, days = calendar.monthrange(period.year, period.month)
+    sources = [generate_phone_number(rng) for _ in range(subscribers)]
+    calls = []
+    for source in sources:
+        for _ in range(calls_per_month):
+            start = period + timedelta(seconds=rng.randrange(days * 24 * 60 * 60))
+            if rng.random() < multi_day_ratio:
+                duration = rng.randint(24 * 60 * 60, 3 * 24 * 60 * 60)
+            else:
+                duration = int(rng.expovariate(1 / MEAN_DURATION))
+            call_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            calls.append(Call(call_id, source, generate_phone_number(rng), start, start + timedelta(seconds=duration)))
+    calls.sort(key=lambda call: call.start)
+    return calls
+
+
+def format_timestamp(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def generate_records(calls: list, out_of_order_ratio: float = 0.05, seed: int = 0) -> list:
+    """
+    (type, payload) records of the given calls in delivery order, which follows their timestamps except for the
+    ratio of calls whose start record is delivered right after their end record.
+    """
+    rng = random.Random(seed)
+    events = []
+    for call in calls:
+        start = ('start', {'call_id': call.call_id, 'timestamp': format_timestamp(call.start), 'source': call.source,
+                           'destination': call.destination})
+        end = ('end', {'call_id': call.call_id, 'timestamp': format_timestamp(call.end)})
+        if rng.random() < out_of_order_ratio:
+            events.append((call.end, len(events), end))
+            events.append((call.end, len(events), start))
+        else:
+            events.append((call.start, len(events), start))
+            events.append((call.end, len(events), end))
+    events.sort(key=lambda event: event[:2])
+    return [record for _, _, record in events]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--subscribers', type=int, default=100, help='Number of sources.')
+    parser.add_argument('--calls-per-month', type=int, default=30, help='Calls of each source in the period.')
+    parser.add_argument('--period', default='2020-01', help='Period of the calls, in YYYY-MM format.')
+    parser.add_argument('--out-of-order-ratio', type=float, default=0.05,
+                        help='Ratio of calls whose end record is delivered before their start record.')
+    parser.add_argument('--multi-day-ratio', type=float, default=0.01, help='Ratio of calls lasting several days.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated records.')
+
+
+def generate_from_options(options) -> tuple:
+    period = datetime.strptime(options.period, '%Y-%m').replace(tzinfo=timezone.utc)
+    calls = generate_calls(options.subscribers, options.calls_per_month, period, options.multi_day_ratio,
+                           options.seed)
+    return calls, generate_records(calls, options.out_of_order_ratio, options.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    _, records = generate_from_options(parser.parse_args())
+    for record_type, payload in records:
+        sys.stdout.write(json.dumps({'type': record_type, **payload}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
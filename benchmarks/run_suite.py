@@ -0,0 +1,191 @@
+"""
+Run the benchmark suite on synthetic CDRs and write the results as JSON. Microbenchmarks measure pricing and
+formatting in operations per second; macro benchmarks post the records to /started/ and /finished/ and read bill
+pages with the Django test client, in a test database created for the run, and measure p50/p99 latencies.
+
+Usage: python benchmarks/run_suite.py [--output results.json] [--compare baseline.json] [--threshold 0.1]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+from datetime import datetime, timezone as dt_timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telecom.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from benchmarks.cdrs import add_arguments, generate_from_options  # noqa: E402
+from records.cache import get_bill_cache  # noqa: E402
+from records.formatters import format_bill_rows, format_duration  # noqa: E402
+from records.utils import calculate_call_rate, price_calls, to_datetime64  # noqa: E402
+
+# Whether a greater value of each compared metric is better
+COMPARED_METRICS = {'ops_per_sec': True, 'p50_ms': False, 'p99_ms': False}
+
+
+def measure_operations(function, operations: int, repeat: int = 5) -> dict:
+    """
+    Operations per second of the function, which runs the given number of operations, in the best of the repeats.
+    Each repeat runs the function for at least 0.2 seconds.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    elapsed = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {'ops_per_sec': operations / elapsed}
+
+
+def measure_latencies(latencies: list) -> dict:
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    return {'p50_ms': p50, 'p99_ms': p99, 'count': len(latencies)}
+
+
+def run_microbenchmarks(calls: list) -> dict:
+    starts, ends = [call.start for call in calls], [call.end for call in calls]
+    start_array, end_array = to_datetime64(starts), to_datetime64(ends)
+    durations = [call.end - call.start for call in calls]
+    rows = [{'start': call.start, 'end': call.end, 'call_id': call.call_id, 'destination': call.destination,
+             'duration': call.end - call.start, 'price': price}
+            for call, price in zip(calls, price_calls(start_array, end_array))]
+    return {
+        'calculate_call_rate': measure_operations(
+            lambda: [calculate_call_rate(start, end) for start, end in zip(starts, ends)], len(calls)
+        ),
+        'price_calls': measure_operations(lambda: price_calls(start_array, end_array), len(calls)),
+        'format_duration': measure_operations(lambda: [format_duration(duration) for duration in durations],
+                                              len(calls)),
+        'format_bill_rows': measure_operations(lambda: format_bill_rows(rows), len(rows)),
+    }
+
+
+def request(latencies: list, function, *args, **kwargs):
+    started = time.perf_counter()
+    response = function(*args, **kwargs)
+    latencies.append(time.perf_counter() - started)
+    assert response.status_code < 300, response.content
+    return response
+
+
+def run_ingest(client: Client, records: list) -> dict:
+    urls = {'start': reverse('call_start_record_create'), 'end': reverse('call_end_record_create')}
+    latencies = {'start': [], 'end': []}
+    for record_type, payload in records:
+        request(latencies[record_type], client.post, urls[record_type], json.dumps(payload),
+                content_type='application/json')
+    return {'started': measure_latencies(latencies['start']), 'finished': measure_latencies(latencies['end'])}
+
+
+def run_bills(client: Client, calls: list, period: str, requests: int, seed: int) -> dict:
+    """
+    Read pages of the bills of random sources: the first page, which generates the bill snapshot, other pages
+    without the bill cache, and the same pages from the bill cache.
+    """
+    url = reverse('bills-list')
+    sources = random.Random(seed).sample(sorted({call.source for call in calls}), requests)
+    latencies = {'first_page': [], 'page': [], 'cached_page': []}
+    for source in sources:
+        get_bill_cache().clear()
+        response = request(latencies['first_page'], client.get, url, {'source': source, 'period': period})
+        pages = -(-response.json()['count'] // 10)
+        for page in range(2, pages + 1):
+            get_bill_cache().clear()
+            params = {'source': source, 'period': period, 'page': page}
+            request(latencies['page'], client.get, url, params)
+            request(latencies['cached_page'], client.get, url, params)
+    return {f'bills_{name}': measure_latencies(values) for name, values in latencies.items() if values}
+
+
+def run_suite(options) -> dict:
+    calls, records = generate_from_options(options)
+    settings.RECORDS_INGEST_MODE = 'sync'
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run_microbenchmarks(calls)
+        if not options.micro_only:
+            client = Client()
+            ingest = run_ingest(client, records)
+            results['ingest_started'], results['ingest_finished'] = ingest['started'], ingest['finished']
+            results.update(run_bills(client, calls, options.period, min(options.bill_requests, options.subscribers),
+                                     options.seed))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Return the (benchmark, metric, baseline value, value, change) of the compared metrics that got worse than the
+    baseline by more than the threshold, as a ratio.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            baseline_value = baseline.get(name, {}).get(metric)
+            if metric not in COMPARED_METRICS or not baseline_value:
+                continue
+            change = value / baseline_value - 1
+            worse = -change if COMPARED_METRICS[metric] else change
+            if worse > threshold:
+                regressions.append((name, metric, baseline_value, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--bill-requests', type=int, default=20, help='Sources whose bill pages are read.')
+    parser.add_argument('--micro-only', action='store_true', help='Skip the benchmarks that make requests.')
+    parser.add_argument('--output', help='Path of the JSON file the results are written to.')
+    parser.add_argument('--compare', help='Path of the JSON results of a previous run to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Change of a metric, as a ratio of the previous run, flagged as a regression.')
+    options = parser.parse_args()
+
+    results = run_suite(options)
+    for name, metrics in results.items():
+        print(f'{name:>22}: ' + '   '.join(
+            f'{metric} {value:,.2f}' if isinstance(value, float) else f'{metric} {value:,}'
+            for metric, value in metrics.items()
+        ))
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump({
+                'created_at': datetime.now(dt_timezone.utc).isoformat(),
+                'environment': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'numpy': np.__version__,
+                    'database': connection.vendor,
+                    'machine': platform.platform(),
+                },
+                'options': {key: value for key, value in vars(options).items()
+                            if key not in ('output', 'compare', 'threshold')},
+                'results': results,
+            }, file, indent=2)
+    if options.compare:
+        with open(options.compare) as file:
+            regressions = compare(results, json.load(file)['results'], options.threshold)
+        for name, metric, baseline_value, value, change in regressions:
+            print(f'Regression in {name} {metric}: {baseline_value:,.2f} -> {value:,.2f} ({change:+.0%})')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
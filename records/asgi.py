@@ -0,0 +1,148 @@
+"""
+ASGI handler that serves a WSGI application, like Django 2.2's, from an event loop. The loop holds the connections,
+reading request bodies and sending responses, and each request runs in a thread of a bounded pool, so connections
+waiting on the network don't take a worker. The number of requests running at once is bounded by a semaphore, and
+requests that wait longer than queue_timeout for their turn are answered with 503.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Bytes of a response body buffered in the request thread before they are sent
+FLUSH_SIZE = 64 * 1024
+
+SERVICE_UNAVAILABLE = (503, [(b'content-type', b'text/plain; charset=utf-8'), (b'retry-after', b'1')],
+                       b'Service unavailable.')
+
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    """
+    WSGI environ of an ASGI HTTP request.
+    """
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI strings are bytes decoded as latin-1
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class ThreadedASGIHandler:
+
+    def __init__(self, wsgi_application, max_concurrency: int = 32, queue_timeout: float = 30):
+        self.wsgi_application = wsgi_application
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='asgi')
+        # Created in the event loop, as semaphores are bound to the loop of their creation in Python 3.7
+        self._semaphore = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported scope type {scope["type"]}.')
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return await self.send_response(send, *SERVICE_UNAVAILABLE)
+        try:
+            loop = asyncio.get_event_loop()
+            started, status, headers, body = await loop.run_in_executor(
+                self.executor, self.run_request, loop, build_environ(scope, body), send
+            )
+        finally:
+            self._semaphore.release()
+        if not started:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def read_body(self, receive):
+        """
+        Return the body of the request, or None if the client disconnected.
+        """
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    async def send_response(self, send, status: int, headers: list, body: bytes):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def run_request(self, loop, environ: dict, send) -> tuple:
+        """
+        Run the WSGI application in this thread, closing its response here too, so Django releases the database
+        connections of the thread. Large bodies are sent as they are produced; the rest is returned to be sent from
+        the event loop, with whether the response was started, its status and its headers.
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        result = self.wsgi_application(environ, start_response)
+        started, chunks, size = False, [], 0
+        try:
+            for chunk in result:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= FLUSH_SIZE:
+                    if not started:
+                        send_from_thread({'type': 'http.response.start', 'status': response['status'],
+                                          'headers': response['headers']})
+                        started = True
+                    send_from_thread({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': True})
+                    chunks, size = [], 0
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started, response['status'], response['headers'], b''.join(chunks)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
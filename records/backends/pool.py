@@ -0,0 +1,72 @@
+"""
+Connection pool shared by the threads of a process. It doesn't depend on a database driver, so the backends using it
+only have to open connections and tell whether they are still usable.
+"""
+import threading
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Pool of at most max_size open connections. Threads wait up to timeout seconds for a connection to be released when
+    all of them are in use, and idle connections are reused from the most recently released one.
+    """
+
+    def __init__(self, connect, max_size: int, timeout: float = 30):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    def acquire(self, check=None):
+        """
+        Return an idle connection, or a new one if there are none. Idle connections for which check returns False
+        are closed and replaced. Raises PoolTimeout if no connection is released in time.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection was released in {self.timeout} seconds.')
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    return self.connect()
+                if check is None or check(connection):
+                    return connection
+                self._discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, discard: bool = False):
+        try:
+            if discard:
+                self._discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+        finally:
+            self._slots.release()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Close the idle connections. Connections in use are closed when they are released with discard.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
+
+    def get_stats(self) -> dict:
+        return {'idle': len(self._idle), 'max_size': self.max_size}
@@ -0,0 +1,115 @@
+"""
+PostgreSQL backend with health checks of persistent connections and an optional pool of connections per process.
+
+Set CONN_HEALTH_CHECKS in the database settings to check that a persistent connection still works before its first
+query in each request, so connections dropped by the server or a proxy are replaced instead of failing the request.
+Set OPTIONS['pool'] to {'max_size': N, 'timeout': seconds} to share up to N connections between the threads of each
+process; connections are released to the pool at the end of each request, so CONN_MAX_AGE should be 0.
+"""
+import threading
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+from ..pool import ConnectionPool, PoolTimeout
+
+Database = base.Database
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, conn_params: dict, options: dict) -> ConnectionPool:
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(
+                lambda: Database.connect(**conn_params), options['max_size'], options.get('timeout', 30)
+            )
+    return pool
+
+
+def is_usable(connection) -> bool:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Database.Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def pool_options(self):
+        return self.settings_dict['OPTIONS'].get('pool')
+
+    @property
+    def health_check_enabled(self) -> bool:
+        return bool(self.settings_dict.get('CONN_HEALTH_CHECKS'))
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        if not self.pool_options:
+            return super().get_new_connection(conn_params)
+        pool = get_pool(self.alias, conn_params, self.pool_options)
+        try:
+            connection = pool.acquire(check=is_usable if self.health_check_enabled else None)
+        except PoolTimeout as error:
+            raise Database.OperationalError(str(error))
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def connect(self):
+        super().connect()
+        # New connections don't need to be checked
+        self.health_check_done = True
+
+    def ensure_connection(self):
+        self.close_if_health_check_failed()
+        super().ensure_connection()
+
+    def close_if_health_check_failed(self):
+        if self.connection is None or not self.health_check_enabled or self.health_check_done:
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Persistent connections are checked again in the next request
+        self.health_check_done = False
+
+    def reset_connection(self) -> bool:
+        """
+        Roll back the transaction left open in the connection, if any. Returns False if the connection can't be reused.
+        """
+        if self.connection.closed:
+            return False
+        status = self.connection.info.transaction_status
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                self.connection.rollback()
+            except Database.Error:
+                return False
+        return True
+
+    def _close(self):
+        if self.connection is None or not self.pool_options:
+            return super()._close()
+        # Django keeps the connections closed in a transaction until the rollback, so they are not reused
+        discard = self.in_atomic_block or not self.reset_connection()
+        with self.wrap_database_errors:
+            _pools[self.alias].release(self.connection, discard=discard)
@@ -0,0 +1,274 @@
+import calendar
+from datetime import datetime, timedelta
+from itertools import islice
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .cache import get_bill_cache
+from .models import BillLine, CompletedCall, DetachedPeriod, MonthlyBill, MonthlyUsage
+from .tariffs import MICROSECONDS_PER_SECOND
+from .utils import count_billable_minutes, measure_standard_time, to_datetime64
+
+BILL_LINE_FIELDS = ['start', 'end', 'call_id', 'destination', 'duration', 'price']
+INVALIDATION_CHUNK_SIZE = 500
+BILL_LINE_CHUNK_SIZE = 2000
+USAGE_FIELDS = ['call_count', 'total', 'billable_minutes', 'standard_seconds', 'reduced_seconds']
+
+
+def get_period_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_period_range(period: datetime) -> tuple:
+    """
+    Return the first moment of the period and the first moment of the next one.
+    """
+    start = get_period_start(period)
+    _, last_day_of_month = calendar.monthrange(start.year, start.month)
+    end = start.replace(day=last_day_of_month) + timedelta(days=1)
+    return start, end
+
+
+def generate_bill(source: str, from_date: datetime, to_date: datetime,
+                  chunk_size: int = BILL_LINE_CHUNK_SIZE) -> MonthlyBill:
+    """
+    Create or refresh the bill snapshot of a source in the given period from its completed calls. Sources without
+    calls in the period get an empty bill that is not stored, so requests for any number don't add snapshots. It has
+    version 0, so its responses are not taken for those of a bill generated once a late call is completed. Bills of
+    detached periods are kept as they are.
+    """
+    period = from_date.date()
+    calls = CompletedCall.objects.get_calls(from_date, to_date, source=source)
+    if not calls.exists() and not MonthlyBill.objects.filter(source=source, period=period).exists():
+        return MonthlyBill(source=source, period=period, total=0, call_count=0, version=0)
+    with transaction.atomic():
+        bill, created = MonthlyBill.objects.select_for_update().get_or_create(
+            source=source,
+            period=period,
+            defaults={'total': 0, 'call_count': 0}
+        )
+        if not created and DetachedPeriod.objects.filter(period=period).exists():
+            # Calls of detached periods are gone, so late calls are left out of their bills instead of the others
+            bill.is_stale = False
+            bill.save()
+            return bill
+        if not created:
+            bill.lines.all().delete()
+        bill.total = 0
+        bill.call_count = 0
+        # Lines are copied a chunk at a time, so the calls of large bills are not loaded in memory at once
+        lines = (
+            BillLine(bill=bill, **{field: call[field] for field in BILL_LINE_FIELDS})
+            for call in calls.iterator(chunk_size=chunk_size)
+        )
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                break
+            BillLine.objects.bulk_create(chunk)
+            bill.total += sum(line.price for line in chunk)
+            bill.call_count += len(chunk)
+        bill.is_stale = False
+        bill.save()
+    return bill
+
+
+def get_bill(source: str, from_date: datetime, to_date: datetime) -> MonthlyBill:
+    """
+    Return the bill snapshot of a source in a closed period, generating it if it does not exist yet or is stale.
+    Up to date bills are read from RECORDS_BILL_DATABASE, and bills are generated in the default database.
+    """
+    bill = MonthlyBill.objects.using(settings.RECORDS_BILL_DATABASE).filter(
+        source=source, period=from_date.date()
+    ).first()
+    if bill is not None and not bill.is_stale:
+        return bill
+    if settings.RECORDS_BILL_DATABASE != DEFAULT_DB_ALIAS:
+        # A replica lagging behind may miss the bill generated by a previous request, which isn't generated again
+        bill = MonthlyBill.objects.filter(source=source, period=from_date.date(), is_stale=False).first()
+        if bill is not None:
+            return bill
+    try:
+        return generate_bill(source, from_date, to_date)
+    except IntegrityError:
+        # Bill generated by a concurrent request
+        return MonthlyBill.objects.get(source=source, period=from_date.date())
+
+
+def get_bill_version(source: str, from_date: datetime):
+    """
+    Return the version of the up to date bill of a source in a period, or None if it has to be generated. Only reads
+    the bill snapshot, through its unique index, so it is cheap enough to validate cached responses.
+    """
+    return MonthlyBill.objects.using(settings.RECORDS_BILL_DATABASE).filter(
+        source=source, period=from_date.date(), is_stale=False
+    ).values_list('version', flat=True).first()
+
+
+def generate_bills(from_date: datetime, to_date: datetime, first_source: str, last_source: str) -> int:
+    """
+    Generate the bills of every source from first_source to last_source with calls in the period, loading their calls
+    with a single range query. Sources whose bill is up to date are skipped, so the same range can be generated again
+    after an interruption. Returns the number of generated bills.
+    """
+    period = from_date.date()
+    sources = (first_source, last_source)
+    for attempt in range(2):
+        generated_sources = set(
+            MonthlyBill.objects.filter(period=period, source__range=sources, is_stale=False)
+            .values_list('source', flat=True)
+        )
+        calls = CompletedCall.objects.get_calls(from_date, to_date).filter(source__range=sources)
+        calls_by_source = {}
+        for call in calls.order_by('source', 'end'):
+            if call['source'] not in generated_sources:
+                calls_by_source.setdefault(call['source'], []).append(call)
+        if not calls_by_source:
+            return 0
+        try:
+            with transaction.atomic():
+                stale_bills = MonthlyBill.objects.filter(period=period, source__range=sources, is_stale=True)
+                # Regenerated bills keep their version, which identifies cached responses of the previous data
+                versions = dict(stale_bills.values_list('source', 'version'))
+                stale_bills.delete()
+                MonthlyBill.objects.bulk_create(
+                    MonthlyBill(source=source, period=period, total=sum((call['price'] for call in calls), 0),
+                                call_count=len(calls), version=versions.get(source, 1))
+                    for source, calls in calls_by_source.items()
+                )
+                bills = dict(
+                    MonthlyBill.objects.filter(period=period, source__range=sources).values_list('source', 'pk')
+                )
+                BillLine.objects.bulk_create(
+                    BillLine(bill_id=bills[source], **{field: call[field] for field in BILL_LINE_FIELDS})
+                    for source, calls in calls_by_source.items() for call in calls
+                )
+        except IntegrityError:
+            # Some bill of the range was generated by a concurrent request
+            if attempt:
+                raise
+        else:
+            return len(calls_by_source)
+    return 0
+
+
+def invalidate_bills(completed_calls: list) -> int:
+    """
+    Mark the bills of closed periods that miss some of the given completed calls as stale, which changes their version,
+    and evict their cached responses. Calls of the current period are skipped, as bills are only generated after the
+    period has ended.
+    """
+    return invalidate_bill_keys(get_usage_key(call) for call in completed_calls)
+
+
+def invalidate_bill_keys(keys) -> int:
+    """
+    invalidate_bills for the bills of the given (period, source) keys, e.g. after their usage was recalculated.
+    """
+    current_period = get_period_start(timezone.now()).date()
+    sources_by_period = {}
+    for period, source in keys:
+        if period < current_period:
+            sources_by_period.setdefault(period, set()).add(source)
+    invalidated = 0
+    for period, sources in sources_by_period.items():
+        sources = sorted(sources)
+        # Sources are filtered in chunks that fit in one query, as batches can complete calls of many sources
+        for index in range(0, len(sources), INVALIDATION_CHUNK_SIZE):
+            invalidated += MonthlyBill.objects.filter(
+                period=period, source__in=sources[index:index + INVALIDATION_CHUNK_SIZE]
+            ).update(is_stale=True, version=F('version') + 1)
+    get_bill_cache().invalidate((source, period) for period, sources in sources_by_period.items() for source in sources)
+    return invalidated
+
+
+def get_usage(source: str, from_date: datetime) -> MonthlyUsage:
+    """
+    Return the usage of a source in a period, or an empty one if the source has no completed calls in the period.
+    """
+    usage = MonthlyUsage.objects.using(settings.RECORDS_BILL_DATABASE).filter(
+        source=source, period=from_date.date()
+    ).first()
+    return usage or MonthlyUsage(source=source, period=from_date.date())
+
+
+def get_usage_key(call) -> tuple:
+    return get_period_start(call.end).date(), call.source
+
+
+def _select_usage_for_update(keys: list) -> dict:
+    sources_by_period = {}
+    for period, source in keys:
+        sources_by_period.setdefault(period, []).append(source)
+    usage = {}
+    for period, sources in sorted(sources_by_period.items()):
+        for index in range(0, len(sources), INVALIDATION_CHUNK_SIZE):
+            rows = MonthlyUsage.objects.select_for_update().filter(
+                period=period, source__in=sources[index:index + INVALIDATION_CHUNK_SIZE]
+            ).order_by('source')
+            usage.update(((row.period, row.source), row) for row in rows)
+    return usage
+
+
+def lock_usage(keys) -> dict:
+    """
+    Lock the usage rows of the given (period, source) keys until the end of the transaction, creating the missing
+    ones, and return them by key. Transactions completing calls of the same source and period wait for each other, so
+    a call completed by both is only added once.
+    """
+    keys = sorted(set(keys))
+    usage = _select_usage_for_update(keys)
+    missing = [key for key in keys if key not in usage]
+    if missing:
+        MonthlyUsage.objects.bulk_create(
+            (MonthlyUsage(period=period, source=source) for period, source in missing), ignore_conflicts=True
+        )
+        usage.update(_select_usage_for_update(missing))
+    return usage
+
+
+def add_usage(usage: dict, calls: list):
+    """
+    Add completed calls to the usage rows locked by lock_usage. Calls must be added only once.
+    """
+    if not calls:
+        return
+    starts = to_datetime64(call.start for call in calls)
+    ends = to_datetime64(call.end for call in calls)
+    billable_minutes = count_billable_minutes(starts, ends).tolist()
+    standard_times = measure_standard_time(starts, ends).tolist()
+    durations = (ends - starts).astype('int64').tolist()
+    changed = {}
+    for call, minutes, standard_time, duration in zip(calls, billable_minutes, standard_times, durations):
+        key = get_usage_key(call)
+        row = changed[key] = usage[key]
+        row.call_count += 1
+        row.total += call.price
+        row.billable_minutes += minutes
+        row.standard_seconds += standard_time // MICROSECONDS_PER_SECOND
+        row.reduced_seconds += (duration - standard_time) // MICROSECONDS_PER_SECOND
+    MonthlyUsage.objects.bulk_update(changed.values(), USAGE_FIELDS)
+
+
+def rebuild_usage(keys) -> dict:
+    """
+    Recalculate the usage rows of the given (period, source) keys from their completed calls, e.g. after the calls
+    were repriced, and return them by key. Like lock_usage, must run in a transaction.
+    """
+    usage = lock_usage(keys)
+    for row in usage.values():
+        for field in USAGE_FIELDS:
+            setattr(row, field, 0)
+    MonthlyUsage.objects.bulk_update(usage.values(), USAGE_FIELDS)
+    sources_by_period = {}
+    for period, source in usage:
+        sources_by_period.setdefault(period, []).append(source)
+    for period, sources in sources_by_period.items():
+        from_date, to_date = get_period_range(datetime(period.year, period.month, 1, tzinfo=timezone.utc))
+        for index in range(0, len(sources), INVALIDATION_CHUNK_SIZE):
+            calls = CompletedCall.objects.filter(
+                source__in=sources[index:index + INVALIDATION_CHUNK_SIZE], end__gte=from_date, end__lt=to_date
+            )
+            add_usage(usage, list(calls.only('source', 'start', 'end', 'price')))
+    return usage
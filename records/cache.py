@@ -0,0 +1,98 @@
+"""
+Cache of bill responses. Entries are kept in a bounded in-process LRU and, optionally, in a cache backend shared
+between processes. Keys include the version of the bill, so entries of a bill are never served once a late call
+changes it; the in-process entries of invalidated bills are also evicted right away to free their space.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'records:bill'
+
+
+class BillCache:
+    """
+    Two tier cache of bill responses keyed by (source, period, version, params), where params identify the page.
+    """
+
+    def __init__(self, max_entries: int = 1024, backend=None, timeout: int = None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get_backend_key(self, key: tuple) -> str:
+        source, period, version, params = key
+        digest = hashlib.sha1(params.encode('utf-8')).hexdigest()
+        return f'{KEY_PREFIX}:{source}:{period:%Y-%m}:{version}:{digest}'
+
+    def _set_local(self, key: tuple, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: tuple):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                return value
+        if self.backend is not None:
+            value = self.backend.get(self.get_backend_key(key))
+            if value is not None:
+                self.shared_hits += 1
+                self._set_local(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key: tuple, value):
+        if self.max_entries > 0:
+            self._set_local(key, value)
+        if self.backend is not None:
+            self.backend.set(self.get_backend_key(key), value, timeout=self.timeout)
+
+    def invalidate(self, bills) -> int:
+        """
+        Evict the in-process entries of the given (source, period) bills. Returns the number of evicted entries.
+        """
+        bills = set(bills)
+        with self._lock:
+            keys = [key for key in self._entries if (key[0], key[1]) in bills]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.local_hits = self.shared_hits = self.misses = 0
+
+    def get_stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+        }
+
+
+@lru_cache(maxsize=None)
+def _get_cache(max_entries: int, alias: str, timeout: int) -> BillCache:
+    return BillCache(max_entries=max_entries, backend=caches[alias] if alias else None, timeout=timeout)
+
+
+def get_bill_cache() -> BillCache:
+    return _get_cache(
+        settings.RECORDS_BILL_CACHE_SIZE, settings.RECORDS_BILL_CACHE_ALIAS, settings.RECORDS_BILL_CACHE_MAX_AGE
+    )
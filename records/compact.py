@@ -0,0 +1,326 @@
+"""
+Compact storage of call ids and phone numbers in PostgreSQL, enabled with RECORDS_COMPACT_STORAGE. Call ids are stored
+as uuid instead of varchar(50): UUIDs as they are, numbers packed in the key and other call ids as a hash of their
+text, which is kept in the call id text table. Phone numbers are stored as bigint, with their digits padded to 16
+followed by their count, so they keep the order of the text. Fields return the strings they take in both storages,
+but phone numbers must then be numbers of up to 16 digits, which the API validates. Other databases always store text.
+"""
+import hashlib
+import re
+import uuid
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+CALL_ID_TEXT_TABLE = 'records_callidtext'
+
+# Canonical UUIDs of the RFC 4122 variant, stored as they are. Numbers without leading zeros that fit in a bigint, and
+# hashes of the other call ids, are stored with a variant reserved by RFC 4122, told apart by the tag that follows it
+UUID_PATTERN = '[0-9a-f]{8}-[0-9a-f]{4}-[1-8][0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}'
+NUMBER_PATTERN = '[1-9][0-9]{0,17}'
+NUMBER_TAG = 'e'
+TEXT_TAG = 'f'
+PHONE_NUMBER_PATTERN = '[0-9]{0,16}'
+PHONE_NUMBER_WIDTH = 16
+
+UUID_RE = re.compile(UUID_PATTERN)
+NUMBER_RE = re.compile(NUMBER_PATTERN)
+PHONE_NUMBER_RE = re.compile(PHONE_NUMBER_PATTERN)
+
+# Columns of the record tables, with their kind and text type. Django adds a pattern index to the unique call ids of
+# the record tables, which is dropped in the compact storage
+CALL_ID, PHONE_NUMBER = 'call_id', 'phone_number'
+COMPACT_COLUMNS = {
+    'records_callstartrecord': [('call_id', CALL_ID, 'varchar(50)'), ('source', PHONE_NUMBER, 'varchar(30)'),
+                                ('destination', PHONE_NUMBER, 'varchar(11)')],
+    'records_callendrecord': [('call_id', CALL_ID, 'varchar(50)')],
+    'records_completedcall': [('call_id', CALL_ID, 'varchar(50)'), ('source', PHONE_NUMBER, 'varchar(30)'),
+                              ('destination', PHONE_NUMBER, 'varchar(11)')],
+}
+PATTERN_INDEXED_TABLES = ('records_callstartrecord', 'records_callendrecord')
+COMPACT_TYPES = {CALL_ID: 'uuid', PHONE_NUMBER: 'bigint'}
+
+# SQL versions of encode_call_id, decode_call_id (but for the text of hashed call ids), encode_phone_number and
+# decode_phone_number, on the {column} given by get_sql
+ENCODE_SQL = {
+    CALL_ID: (
+        "CASE WHEN {column} ~ '^" + UUID_PATTERN + "$' THEN {column}::uuid "
+        "WHEN {column} ~ '^" + NUMBER_PATTERN + "$' "
+        "THEN (lpad(to_hex({column}::bigint), 16, '0') || '" + NUMBER_TAG + '0' * 15 + "')::uuid "
+        "ELSE (left(md5({column}), 16) || '" + TEXT_TAG + "' || right(md5({column}), 15))::uuid END"
+    ),
+    PHONE_NUMBER: f"rpad({{column}}, {PHONE_NUMBER_WIDTH}, '0')::bigint * 100 + length({{column}})",
+}
+DECODE_SQL = {
+    CALL_ID: (
+        "CASE substr({column}::text, 20, 1) WHEN '" + NUMBER_TAG + "' "
+        "THEN ('x' || left(replace({column}::text, '-', ''), 16))::bit(64)::bigint::text ELSE {column}::text END"
+    ),
+    PHONE_NUMBER: f"left(lpad(({{column}} / 100)::text, {PHONE_NUMBER_WIDTH}, '0'), mod({{column}}, 100)::int)",
+}
+# decode_call_id for the call ids selected by queries, reading the text of hashed call ids in the same query
+SELECT_CALL_ID_SQL = (
+    "CASE substr({column}::text, 20, 1) WHEN '" + NUMBER_TAG + "' "
+    "THEN ('x' || left(replace({column}::text, '-', ''), 16))::bit(64)::bigint::text "
+    "WHEN '" + TEXT_TAG + "' THEN (SELECT texts.call_id FROM " + CALL_ID_TEXT_TABLE + " texts "
+    "WHERE texts.key = {column}) ELSE {column}::text END"
+)
+
+# Text of hashed call ids by key, read or stored by this process
+MAX_CACHED_CALL_ID_TEXTS = 100000
+_call_id_texts = {}
+
+
+def is_compact_storage(connection) -> bool:
+    return settings.RECORDS_COMPACT_STORAGE and connection.vendor == 'postgresql'
+
+
+def encode_call_id(call_id: str) -> uuid.UUID:
+    if UUID_RE.fullmatch(call_id):
+        return uuid.UUID(call_id)
+    if NUMBER_RE.fullmatch(call_id):
+        return uuid.UUID(f'{int(call_id):016x}{NUMBER_TAG}{0:015x}')
+    digest = hashlib.md5(call_id.encode()).hexdigest()
+    return uuid.UUID(f'{digest[:16]}{TEXT_TAG}{digest[17:]}')
+
+
+def is_hashed_call_id(key: uuid.UUID) -> bool:
+    return key.hex[16] == TEXT_TAG
+
+
+def decode_call_id(key: uuid.UUID, connection) -> str:
+    tag = key.hex[16]
+    if tag == NUMBER_TAG:
+        return str(int(key.hex[:16], 16))
+    if tag == TEXT_TAG:
+        return get_call_id_text(key, connection)
+    return str(key)
+
+
+def _cache_call_id_texts(texts: dict):
+    if len(_call_id_texts) + len(texts) > MAX_CACHED_CALL_ID_TEXTS:
+        _call_id_texts.clear()
+    _call_id_texts.update(texts)
+
+
+def get_call_id_text(key: uuid.UUID, connection) -> str:
+    call_id = _call_id_texts.get(key)
+    if call_id is None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT call_id FROM {CALL_ID_TEXT_TABLE} WHERE key = %s', [key])
+            row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f'Text of the call id stored as {key} not found.')
+        call_id, = row
+        _cache_call_id_texts({key: call_id})
+    return call_id
+
+
+def decode_call_ids(keys, connection) -> list:
+    """
+    decode_call_id for many keys, reading the text of the hashed call ids that aren't cached with a single query.
+    """
+    keys = list(keys)
+    missing = {
+        key for key in keys if isinstance(key, uuid.UUID) and is_hashed_call_id(key) and key not in _call_id_texts
+    }
+    if missing:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT key, call_id FROM {CALL_ID_TEXT_TABLE} WHERE key = ANY(%s)', [list(missing)])
+            _cache_call_id_texts(dict(cursor.fetchall()))
+    return [decode_call_id(key, connection) if isinstance(key, uuid.UUID) else key for key in keys]
+
+
+def register_call_ids(call_ids, connection):
+    """
+    Store the text of the given call ids that are stored as a hash in the compact storage, with a single query for a
+    batch. Must run before their records are stored, as fields don't store it.
+    """
+    if not is_compact_storage(connection):
+        return
+    texts = {}
+    for call_id in call_ids:
+        key = encode_call_id(call_id)
+        if is_hashed_call_id(key) and key not in _call_id_texts:
+            texts[key] = call_id
+    if not texts:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {CALL_ID_TEXT_TABLE} (key, call_id) SELECT * FROM unnest(%s::uuid[], %s::varchar[]) '
+            'ON CONFLICT DO NOTHING',
+            [list(texts), list(texts.values())]
+        )
+    # Texts of a rolled back transaction aren't cached
+    transaction.on_commit(lambda: _cache_call_id_texts(texts), using=connection.alias)
+
+
+def encode_phone_number(number: str) -> int:
+    return int(number.ljust(PHONE_NUMBER_WIDTH, '0')) * 100 + len(number)
+
+
+def decode_phone_number(value: int) -> str:
+    return f'{value // 100:0{PHONE_NUMBER_WIDTH}d}'[:value % 100]
+
+
+def validate_compact_phone_number(value: str):
+    if settings.RECORDS_COMPACT_STORAGE and not PHONE_NUMBER_RE.fullmatch(value):
+        raise ValidationError('Phone numbers must contain only numbers, up to 16.', code='invalid')
+
+
+class CallIdField(models.CharField):
+    """
+    Call id, stored as uuid in the compact storage.
+    """
+
+    def db_type(self, connection):
+        return COMPACT_TYPES[CALL_ID] if is_compact_storage(connection) else super().db_type(connection)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is None or not is_compact_storage(connection):
+            return value
+        return encode_call_id(value)
+
+    def select_format(self, compiler, sql, params):
+        # Selected call ids are decoded by the query, so a result set doesn't read their texts one by one
+        if is_compact_storage(compiler.connection):
+            sql = get_sql({CALL_ID: SELECT_CALL_ID_SQL}, CALL_ID, sql)
+        return sql, params
+
+    def from_db_value(self, value, expression, connection):
+        return decode_call_id(value, connection) if isinstance(value, uuid.UUID) else value
+
+
+class PhoneNumberField(models.CharField):
+    """
+    Phone number, stored as bigint in the compact storage, which only takes numbers of up to 16 digits.
+    """
+    default_validators = [validate_compact_phone_number]
+
+    def db_type(self, connection):
+        return COMPACT_TYPES[PHONE_NUMBER] if is_compact_storage(connection) else super().db_type(connection)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is None or not is_compact_storage(connection):
+            return value
+        # Numbers that can't be stored match no row
+        return encode_phone_number(value) if PHONE_NUMBER_RE.fullmatch(value) else -1
+
+    def get_db_prep_save(self, value, connection):
+        value = self.get_prep_value(value)
+        if value is not None and is_compact_storage(connection) and not PHONE_NUMBER_RE.fullmatch(value):
+            raise ValueError(f'Phone number {value!r} cannot be stored compactly.')
+        return self.get_db_prep_value(value, connection, prepared=True)
+
+    def from_db_value(self, value, expression, connection):
+        return decode_phone_number(value) if isinstance(value, int) else value
+
+
+def get_sql(templates: dict, kind: str, column: str) -> str:
+    # Templates are not formatted with str.format, as patterns have braces
+    return templates[kind].replace('{column}', column)
+
+
+def get_column_types(connection, table: str) -> dict:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT column_name, data_type FROM information_schema.columns '
+            'WHERE table_schema = current_schema() AND table_name = %s',
+            [table]
+        )
+        return dict(cursor.fetchall())
+
+
+def _get_pattern_indexes(connection, table: str, column: str) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s',
+            [table]
+        )
+        rows = cursor.fetchall()
+    pattern = re.compile(rf'\("?{column}"? \w+_pattern_ops\)')
+    return [name for name, definition in rows if pattern.search(definition)]
+
+
+def to_compact_storage(schema_editor) -> int:
+    """
+    Convert the call id and phone number columns of the record tables stored as text to the compact storage, rewriting
+    each table once. Returns the number of converted columns.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return 0
+    quote = schema_editor.quote_name
+    converted = 0
+    for table, columns in COMPACT_COLUMNS.items():
+        types = get_column_types(connection, table)
+        columns = [(column, kind) for column, kind, _ in columns if types[column] == 'character varying']
+        if not columns:
+            continue
+        for column, kind in columns:
+            if kind == PHONE_NUMBER:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"SELECT COUNT(*) FROM {quote(table)} WHERE {quote(column)} !~ '^{PHONE_NUMBER_PATTERN}$'"
+                    )
+                    invalid, = cursor.fetchone()
+                if invalid:
+                    raise ValueError(f'{invalid} rows of {table} have a {column} that is not a number of up to '
+                                     f'{PHONE_NUMBER_WIDTH} digits.')
+            elif kind == CALL_ID:
+                quoted = quote(column)
+                schema_editor.execute(
+                    f'INSERT INTO {CALL_ID_TEXT_TABLE} (key, call_id) '
+                    f'SELECT DISTINCT {get_sql(ENCODE_SQL, kind, quoted)}, {quoted} FROM {quote(table)} '
+                    f"WHERE {quoted} !~ '^{UUID_PATTERN}$' AND {quoted} !~ '^{NUMBER_PATTERN}$' "
+                    'ON CONFLICT DO NOTHING'
+                )
+        for column, _ in columns:
+            for name in _get_pattern_indexes(connection, table, column):
+                schema_editor.execute(f'DROP INDEX {quote(name)}')
+        schema_editor.execute(f'ALTER TABLE {quote(table)} ' + ', '.join(
+            f'ALTER COLUMN {quote(column)} TYPE {COMPACT_TYPES[kind]} '
+            f'USING {get_sql(ENCODE_SQL, kind, quote(column))}'
+            for column, kind in columns
+        ))
+        converted += len(columns)
+    return converted
+
+
+def to_text_storage(schema_editor) -> int:
+    """
+    Convert the call id and phone number columns of the record tables in the compact storage back to text. Returns
+    the number of converted columns.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return 0
+    quote = schema_editor.quote_name
+    converted = 0
+    for table, columns in COMPACT_COLUMNS.items():
+        types = get_column_types(connection, table)
+        columns = [(column, kind, text_type) for column, kind, text_type in columns
+                   if types[column] == COMPACT_TYPES[kind]]
+        if not columns:
+            continue
+        # Hashed call ids are decoded to the text of their key first, as USING can't read other tables
+        schema_editor.execute(f'ALTER TABLE {quote(table)} ' + ', '.join(
+            f'ALTER COLUMN {quote(column)} TYPE {text_type} USING {get_sql(DECODE_SQL, kind, quote(column))}'
+            for column, kind, text_type in columns
+        ))
+        for column, kind, _ in columns:
+            if kind != CALL_ID:
+                continue
+            schema_editor.execute(
+                f'UPDATE {quote(table)} SET {quote(column)} = texts.call_id FROM {CALL_ID_TEXT_TABLE} texts '
+                f'WHERE {quote(table)}.{quote(column)} = texts.key::text'
+            )
+            if table in PATTERN_INDEXED_TABLES:
+                name = schema_editor._create_index_name(table, [column], suffix='_like')
+                schema_editor.execute(
+                    f'CREATE INDEX {quote(name)} ON {quote(table)} ({quote(column)} varchar_pattern_ops)'
+                )
+        converted += len(columns)
+    return converted
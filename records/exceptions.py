@@ -1,11 +1,15 @@
 from rest_framework.exceptions import APIException
-from rest_framework.status import HTTP_422_UNPROCESSABLE_ENTITY
+from rest_framework.status import HTTP_409_CONFLICT, HTTP_422_UNPROCESSABLE_ENTITY
 
 
 class UnprocessableEntityError(APIException):
     status_code = HTTP_422_UNPROCESSABLE_ENTITY
 
 
+class ConflictError(APIException):
+    status_code = HTTP_409_CONFLICT
+
+
 class InvalidDatePeriodException(BaseException):
     """
     Exception raised when input dates are invalid, either None or starting date later than ending date.
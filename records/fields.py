@@ -1,5 +1,6 @@
 from rest_framework.fields import Field
 from datetime import timedelta
+from .formatters import format_duration
 
 
 class DurationField(Field):
@@ -8,11 +9,7 @@ class DurationField(Field):
     """
 
     def to_representation(self, value: timedelta):
-        duration = int(value.total_seconds())
-        hours, duration = divmod(duration, 60 * 60)
-        minutes, duration = divmod(duration, 60)
-        seconds = duration
-        return f'{hours}h{minutes}m{seconds}s'
+        return format_duration(value)
 
     def to_internal_value(self, value):
         return value
@@ -0,0 +1,101 @@
+"""
+Plain functions that format bill rows the same way CallRecordSerializer does, without building DRF fields per row.
+"""
+import csv
+import json
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from django.utils import timezone
+from .billing import BILL_LINE_FIELDS
+
+PRICE_QUANTUM = Decimal('0.01')
+
+
+@lru_cache(maxsize=8192)
+def _format_seconds(duration: int) -> str:
+    hours, duration = divmod(duration, 60 * 60)
+    minutes, seconds = divmod(duration, 60)
+    return f'{hours}h{minutes}m{seconds}s'
+
+
+def format_duration(value: timedelta) -> str:
+    # Most calls last a few minutes, so their formatted durations are cached by number of seconds
+    return _format_seconds(int(value.total_seconds()))
+
+
+def compile_bill_row_formatter():
+    """
+    Build a function that formats one bill row. The current time zone is looked up once, when the function is built,
+    instead of once per value.
+    """
+    current_timezone = timezone.get_current_timezone()
+    quantum = PRICE_QUANTUM
+
+    def format_moment(value):
+        if value.tzinfo is None:
+            value = timezone.make_aware(value, current_timezone)
+        value = value.astimezone(current_timezone).isoformat()
+        if value.endswith('+00:00'):
+            return value[:-6] + 'Z'
+        return value
+
+    def format_row(row):
+        return {
+            'start': format_moment(row['start']),
+            'end': format_moment(row['end']),
+            'call_id': row['call_id'],
+            'destination': row['destination'],
+            'duration': _format_seconds(int(row['duration'].total_seconds())),
+            'price': '{:f}'.format(row['price'].quantize(quantum))
+        }
+
+    return format_row
+
+
+def format_usage(usage) -> dict:
+    return {
+        'call_count': usage.call_count,
+        'total': '{:f}'.format(Decimal(usage.total).quantize(PRICE_QUANTUM)),
+        'billable_minutes': usage.billable_minutes,
+        'standard_seconds': usage.standard_seconds,
+        'reduced_seconds': usage.reduced_seconds
+    }
+
+
+def format_bill_rows(rows) -> list:
+    """
+    Format rows given by bill line values() querysets. Output is the same as CallRecordSerializer(rows, many=True).data.
+    """
+    format_row = compile_bill_row_formatter()
+    return [format_row(row) for row in rows]
+
+
+def stream_ndjson(rows):
+    """
+    Yield one JSON document per row, each one in a line.
+    """
+    format_row = compile_bill_row_formatter()
+    for row in rows:
+        yield json.dumps(format_row(row), separators=(',', ':')) + '\n'
+
+
+class _Line:
+    """
+    File-like object whose write returns the line written, so csv.writer output can be yielded.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """
+    Yield a CSV header followed by one line per row.
+    """
+    writer = csv.writer(_Line())
+    format_row = compile_bill_row_formatter()
+    yield writer.writerow(BILL_LINE_FIELDS)
+    for row in rows:
+        row = format_row(row)
+        yield writer.writerow([row[field] for field in BILL_LINE_FIELDS])
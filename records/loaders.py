@@ -0,0 +1,417 @@
+"""
+Bulk loading of call records from CDR files. Rows are validated with the fields of the batch serializers, so they
+follow the same rules as the API, optionally in worker processes, and merged into the record tables in chunks:
+PostgreSQL loads them with COPY into staging tables, other databases fall back to bulk inserts. Calls are then
+completed and priced a chunk at a time.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import re
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from itertools import islice
+from operator import itemgetter
+import django
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import CharField, DateTimeField, empty
+from rest_framework.settings import api_settings
+from .billing import add_usage, invalidate_bills, lock_usage
+from .compact import decode_call_ids, register_call_ids
+from .models import CallEndRecord, CallStartRecord, CompletedCall
+from .queue import CALL_END, CALL_START
+from .serializers import CallEndRecordBatchSerializer, CallStartRecordBatchSerializer
+from .services import (
+    complete_calls, complete_pairs, get_call_start_records, get_existing_call_ids, get_records_by_call_id
+)
+from .utils import price_calls, to_datetime64
+
+# Fields of a completed call that its usage and the invalidation of its bill take
+BilledCall = namedtuple('BilledCall', ['source', 'start', 'end', 'price'])
+
+UTC_TIMESTAMP = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d{3}(?:\d{3})?)?Z$')
+
+
+def parse_ndjson(lines: list, fieldnames=None):
+    """
+    Yield (line number, row) pairs of (line number, line) pairs with one JSON object per line. Rows that can't be
+    decoded are None.
+    """
+    for line_number, line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def parse_csv(lines: list, fieldnames: list):
+    """
+    Yield (line number, row) pairs of (line number, line) pairs of a CSV file with the given header. Empty columns are
+    left out of the row.
+    """
+    rows = csv.DictReader((line for _, line in lines), fieldnames=fieldnames)
+    for (line_number, _), row in zip(lines, rows):
+        yield line_number, {key: value for key, value in row.items() if key and value not in ('', None)}
+
+
+PARSERS = {
+    'ndjson': parse_ndjson,
+    'csv': parse_csv
+}
+
+
+class RowValidator:
+    """
+    Validates rows with the writable fields of a serializer. Strings that need no conversion are checked with the
+    validators of the field alone and UTC timestamps in ISO 8601 format are parsed directly, other values and invalid
+    ones go through the serializer field. Values of cached_fields, such as phone numbers, are validated once.
+    """
+    max_cache_size = 100000
+
+    def __init__(self, serializer, cached_fields=()):
+        self.cleaners = []
+        for name, field in serializer.fields.items():
+            if field.read_only:
+                continue
+            if isinstance(field, DateTimeField):
+                cleaner = self.get_timestamp_cleaner(field)
+            elif isinstance(field, CharField):
+                cleaner = self.get_string_cleaner(field)
+            else:
+                cleaner = field.run_validation
+            if name in cached_fields:
+                cleaner = self.get_cached_cleaner(cleaner)
+            self.cleaners.append((name, cleaner))
+
+    @staticmethod
+    def get_timestamp_cleaner(field):
+        def clean(value):
+            if isinstance(value, str) and UTC_TIMESTAMP.match(value):
+                try:
+                    return datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc)
+                except ValueError:
+                    pass
+            return field.run_validation(value)
+        return clean
+
+    @staticmethod
+    def get_string_cleaner(field):
+        validators = field.validators
+
+        def clean(value):
+            if type(value) is str and value and (not field.trim_whitespace or value == value.strip()):
+                try:
+                    for validator in validators:
+                        validator(value)
+                    return value
+                except DjangoValidationError:
+                    pass
+            return field.run_validation(value)
+        return clean
+
+    def get_cached_cleaner(self, cleaner):
+        cache = {}
+
+        def clean(value):
+            if not isinstance(value, str):
+                return cleaner(value)
+            if value not in cache:
+                if len(cache) >= self.max_cache_size:
+                    cache.clear()
+                try:
+                    cache[value] = (cleaner(value), None)
+                except ValidationError as exc:
+                    cache[value] = (None, exc)
+            value, exc = cache[value]
+            if exc is not None:
+                raise exc
+            return value
+        return clean
+
+    def __call__(self, row: dict) -> dict:
+        attrs, errors = {}, {}
+        for name, clean in self.cleaners:
+            try:
+                attrs[name] = clean(row.get(name, empty))
+            except ValidationError as exc:
+                errors[name] = exc.detail
+        if errors:
+            raise ValidationError(errors)
+        return attrs
+
+
+def get_record_type(row: dict) -> str:
+    """
+    Records are told apart by their type, or by the presence of a source if they have none.
+    """
+    record_type = row.get('type')
+    if record_type is None:
+        return CALL_START if 'source' in row else CALL_END
+    if record_type not in (CALL_START, CALL_END):
+        raise ValidationError({'type': [f'"{record_type}" is not a valid choice.']})
+    return record_type
+
+
+def check_call_start_records(starts: list, errors: list) -> list:
+    """
+    Reject the (line number, attrs) call start records later than their stored call end record, as the API does, as
+    their calls could never be completed. Returns the attrs of the accepted ones.
+    """
+    stored_call_end_records = get_records_by_call_id(CallEndRecord, {attrs['call_id'] for _, attrs in starts})
+    accepted = []
+    for line_number, attrs in starts:
+        call_end_record = stored_call_end_records.get(attrs['call_id'])
+        if call_end_record is not None and call_end_record.timestamp < attrs['timestamp']:
+            errors.append((line_number, {
+                'timestamp': ['Call start record timestamp cannot be later than call end record timestamp.']
+            }))
+            continue
+        accepted.append(attrs)
+    return accepted
+
+
+def price_call_end_records(starts: list, ends: list, errors: list) -> list:
+    """
+    Price the (line number, attrs) call end records whose call start record is stored or loaded in the same chunk, at
+    once with the vectorized pricer. Call end records earlier than their start are rejected as the API does, others
+    are left unpriced to be completed when their start arrives. Returns the attrs of the accepted ones.
+    """
+    start_timestamps = {attrs['call_id']: attrs['timestamp'] for attrs in starts}
+    stored_call_start_records = get_call_start_records({attrs['call_id'] for _, attrs in ends})
+    start_timestamps.update((call_id, record.timestamp) for call_id, record in stored_call_start_records.items())
+    accepted, paired = [], []
+    for line_number, attrs in ends:
+        start = start_timestamps.get(attrs['call_id'])
+        if start is not None and attrs['timestamp'] < start:
+            errors.append((line_number, {
+                'timestamp': ['Call end record timestamp cannot be earlier than call start record timestamp.']
+            }))
+            continue
+        attrs['price'] = None
+        if start is not None:
+            paired.append((start, attrs))
+        accepted.append(attrs)
+    if paired:
+        prices = price_calls(to_datetime64(start for start, _ in paired),
+                             to_datetime64(attrs['timestamp'] for _, attrs in paired))
+        for (_, attrs), price in zip(paired, prices):
+            attrs['price'] = price
+    return accepted
+
+
+def _create_staging_table(cursor, name: str, fields: list):
+    # Columns have the types of the record tables, e.g. uuid call ids in the compact storage
+    columns = ', '.join(f'{connection.ops.quote_name(field.column)} {field.db_type(connection)}' for field in fields)
+    # Within an outer transaction the atomic block of a chunk is a savepoint, so the staging tables of the previous
+    # chunk are only dropped at the outer commit
+    cursor.execute(f'DROP TABLE IF EXISTS {name}')
+    cursor.execute(f'CREATE TEMPORARY TABLE {name} ({columns}) ON COMMIT DROP')
+
+
+def _copy_rows(cursor, table: str, fields: list, records: list):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        [field.get_db_prep_value(attrs[field.name], connection) for field in fields] for attrs in records
+    )
+    buffer.seek(0)
+    quoted_columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    cursor.copy_expert(f'COPY {table} ({quoted_columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def merge_with_copy(starts: list, ends: list) -> tuple:
+    """
+    Copy records into temporary staging tables and merge them into the record tables, skipping the call ids already
+    stored, then complete the priced calls with a single statement. Returns the stored call ids of each type and the
+    number of completed calls.
+    """
+    quote = connection.ops.quote_name
+    start_table, end_table = quote(CallStartRecord._meta.db_table), quote(CallEndRecord._meta.db_table)
+    completed_table = quote(CompletedCall._meta.db_table)
+    start_fields = [CallStartRecord._meta.get_field(name) for name in ('call_id', 'timestamp', 'source', 'destination')]
+    end_fields = [CallEndRecord._meta.get_field(name) for name in ('call_id', 'timestamp', 'price')]
+    call_id_field, source_field = start_fields[0], start_fields[2]
+    with transaction.atomic(), connection.cursor() as cursor:
+        register_call_ids({attrs['call_id'] for attrs in starts} | {attrs['call_id'] for attrs in ends}, connection)
+        _create_staging_table(cursor, 'load_callstartrecord', start_fields)
+        _create_staging_table(cursor, 'load_callendrecord', end_fields)
+        _copy_rows(cursor, 'load_callstartrecord', start_fields, starts)
+        _copy_rows(cursor, 'load_callendrecord', end_fields, ends)
+        cursor.execute(
+            f'INSERT INTO {start_table} (call_id, "timestamp", source, destination) '
+            'SELECT call_id, "timestamp", source, destination FROM load_callstartrecord '
+            'ON CONFLICT (call_id) DO NOTHING RETURNING call_id'
+        )
+        start_call_ids = set(decode_call_ids((call_id for call_id, in cursor.fetchall()), connection))
+        cursor.execute(
+            f'INSERT INTO {end_table} (call_id, "timestamp", price) '
+            'SELECT call_id, "timestamp", price FROM load_callendrecord '
+            'ON CONFLICT (call_id) DO NOTHING RETURNING call_id'
+        )
+        end_call_ids = set(decode_call_ids((call_id for call_id, in cursor.fetchall()), connection))
+        call_ids = [call_id_field.get_db_prep_value(call_id, connection) for call_id in start_call_ids | end_call_ids]
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', ended.\"timestamp\")::date, started.source "
+            f'FROM {start_table} started JOIN {end_table} ended ON ended.call_id = started.call_id '
+            'WHERE started.call_id = ANY(%s) AND ended.price IS NOT NULL',
+            [call_ids]
+        )
+        # Only the calls inserted here are added to the usage, whose rows are locked first like complete_pairs does
+        usage = lock_usage(
+            (period, source_field.from_db_value(source, None, connection)) for period, source in cursor.fetchall()
+        )
+        cursor.execute(
+            f'INSERT INTO {completed_table} (call_id, source, destination, start, "end", duration, price) '
+            'SELECT started.call_id, started.source, started.destination, started."timestamp", ended."timestamp", '
+            'ended."timestamp" - started."timestamp", ended.price '
+            f'FROM {start_table} started JOIN {end_table} ended ON ended.call_id = started.call_id '
+            'WHERE started.call_id = ANY(%s) AND ended.price IS NOT NULL '
+            # Completed calls may be partitioned, with call_id only unique along with the end of the call, so calls
+            # stored with another end are checked here
+            f'AND NOT EXISTS (SELECT 1 FROM {completed_table} completed WHERE completed.call_id = started.call_id) '
+            'ON CONFLICT DO NOTHING RETURNING source, start, "end", price',
+            [call_ids]
+        )
+        completed_calls = [
+            BilledCall(source_field.from_db_value(source, None, connection), start, end, price)
+            for source, start, end, price in cursor.fetchall()
+        ]
+        add_usage(usage, completed_calls)
+        invalidate_bills(completed_calls)
+    # Call end records stored unpaired before their start arrived in this chunk are still unpriced
+    completed = len(completed_calls)
+    completed += len(complete_calls(start_call_ids - end_call_ids))
+    return start_call_ids, end_call_ids, completed
+
+
+def _exclude_stored(model, records: list) -> list:
+    stored_call_ids = get_existing_call_ids(model, {attrs['call_id'] for attrs in records})
+    remaining = []
+    for attrs in records:
+        if attrs['call_id'] not in stored_call_ids:
+            stored_call_ids.add(attrs['call_id'])
+            remaining.append(attrs)
+    return remaining
+
+
+def merge_with_bulk_create(starts: list, ends: list) -> tuple:
+    """
+    Fallback of merge_with_copy for databases without COPY, with the same results.
+    """
+    with transaction.atomic():
+        call_start_records = {
+            attrs['call_id']: CallStartRecord(**attrs) for attrs in _exclude_stored(CallStartRecord, starts)
+        }
+        CallStartRecord.objects.bulk_create(call_start_records.values())
+        call_end_records = {attrs['call_id']: CallEndRecord(**attrs) for attrs in _exclude_stored(CallEndRecord, ends)}
+        CallEndRecord.objects.bulk_create(call_end_records.values())
+    # Pairs loaded in the same chunk are completed with the records at hand, the others are looked up
+    paired_call_ids = call_start_records.keys() & call_end_records.keys()
+    completed = len(complete_pairs([
+        (call_start_records[call_id], call_end_records[call_id]) for call_id in paired_call_ids
+    ]))
+    completed += len(complete_calls((call_start_records.keys() | call_end_records.keys()) - paired_call_ids))
+    return set(call_start_records), set(call_end_records), completed
+
+
+def get_merge_function():
+    return merge_with_copy if connection.vendor == 'postgresql' else merge_with_bulk_create
+
+
+@lru_cache(maxsize=None)
+def get_validators() -> dict:
+    return {
+        CALL_START: RowValidator(CallStartRecordBatchSerializer(), cached_fields=('source', 'destination')),
+        CALL_END: RowValidator(CallEndRecordBatchSerializer())
+    }
+
+
+def validate_chunk(file_format: str, fieldnames: list, lines: list) -> tuple:
+    """
+    Parse and validate a chunk of (line number, line) pairs. Returns the number of rows, (line number, attrs) pairs of
+    the call start records and of the call end records, and (line number, errors) pairs of the invalid rows.
+    """
+    validators = get_validators()
+    records = {CALL_START: [], CALL_END: []}
+    errors = []
+    rows = 0
+    for line_number, row in PARSERS[file_format](lines, fieldnames):
+        rows += 1
+        if row is None:
+            errors.append((line_number, {api_settings.NON_FIELD_ERRORS_KEY: ['Invalid JSON object.']}))
+            continue
+        try:
+            record_type = get_record_type(row)
+            records[record_type].append((line_number, validators[record_type](row)))
+        except ValidationError as exc:
+            errors.append((line_number, exc.detail))
+    return rows, records[CALL_START], records[CALL_END], errors
+
+
+def read_chunks(file, chunk_size: int, first_line_number: int = 1):
+    """
+    Yield chunks of (line number, line) pairs of a file.
+    """
+    lines = enumerate(file, start=first_line_number)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _validate_in_workers(validate, chunks, workers: int):
+    """
+    Validate chunks in worker processes, yielding results in the order of the file. Only a few chunks per worker are
+    read ahead, so memory does not grow with the size of the file.
+    """
+    # Workers are spawned rather than forked, as this process keeps using its database connection meanwhile
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(validate, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def load_records(file, file_format: str = 'ndjson', chunk_size: int = 50000, workers: int = 1):
+    """
+    Validate and store the records of a file in chunks, completing the calls of each chunk. Chunks are parsed and
+    validated by worker processes if more than one is given, and stored in order by this process. Yields the
+    statistics of every chunk, with the errors of its invalid rows as (line number, errors) pairs.
+    """
+    fieldnames = None
+    first_line_number = 1
+    if file_format == 'csv':
+        fieldnames = next(csv.reader([file.readline()]), [])
+        first_line_number = 2
+    chunks = read_chunks(file, chunk_size, first_line_number)
+    if workers > 1:
+        validated_chunks = _validate_in_workers(partial(validate_chunk, file_format, fieldnames), chunks, workers)
+    else:
+        validated_chunks = (validate_chunk(file_format, fieldnames, chunk) for chunk in chunks)
+    merge = get_merge_function()
+    for rows, starts, ends, errors in validated_chunks:
+        starts = check_call_start_records(starts, errors)
+        ends = price_call_end_records(starts, ends, errors)
+        start_call_ids, end_call_ids, completed = merge(starts, ends)
+        errors.sort(key=itemgetter(0))
+        yield {
+            'rows': rows,
+            'starts': len(start_call_ids),
+            'ends': len(end_call_ids),
+            'skipped': len(starts) + len(ends) - len(start_call_ids) - len(end_call_ids),
+            'completed': completed,
+            'errors': errors
+        }
@@ -0,0 +1,67 @@
+import re
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from records.models import Tariff
+from records.tariffs import create_tariff
+
+BAND = re.compile(r'^(\d\d):(\d\d)-(\d\d):(\d\d)=(\d+(?:\.\d+)?)$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Create a tariff in effect from the given moment. Running processes load it within '
+        'RECORDS_TARIFF_RELOAD_INTERVAL seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('effective_from', help='Moment the tariff is in effect from, in ISO 8601 format.')
+        parser.add_argument('--connection-fee', required=True, help='Fee charged for every call.')
+        parser.add_argument('--band', action='append', default=[], dest='bands',
+                            help='Band of the day, in UTC, and its minute rate, e.g. 06:00-22:00=0.09. '
+                                 'Midnight as end means the end of the day. Can be repeated.')
+
+    def _clean_effective_from(self, value: str) -> datetime:
+        try:
+            effective_from = parse_datetime(value)
+        except ValueError:
+            effective_from = None
+        if effective_from is None or effective_from.tzinfo is None:
+            raise CommandError('Effective from is invalid. Must be an ISO 8601 timestamp with time zone.')
+        if Tariff.objects.filter(effective_from=effective_from).exists():
+            raise CommandError('There is already a tariff in effect from this moment.')
+        return effective_from
+
+    def _clean_decimal(self, value: str) -> Decimal:
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            raise CommandError(f'Rate {value} is invalid.')
+        # Rates are stored with 4 decimal places and 8 digits
+        if not value.is_finite() or value < 0 or value >= 10000 or value.as_tuple().exponent < -4:
+            raise CommandError(f'Rate {value} is invalid.')
+        return value
+
+    def _clean_band(self, value: str) -> tuple:
+        match = BAND.match(value)
+        if match is None:
+            raise CommandError(f'Band {value} is invalid. Must be in HH:MM-HH:MM=RATE format.')
+        start_hour, start_minute, end_hour, end_minute, minute_rate = match.groups()
+        try:
+            return (time(int(start_hour), int(start_minute)), time(int(end_hour), int(end_minute)),
+                    self._clean_decimal(minute_rate))
+        except ValueError:
+            raise CommandError(f'Band {value} is invalid. Must be in HH:MM-HH:MM=RATE format.')
+
+    def handle(self, *args, **options):
+        effective_from = self._clean_effective_from(options['effective_from'])
+        connection_fee = self._clean_decimal(options['connection_fee'])
+        bands = [self._clean_band(band) for band in options['bands']]
+        try:
+            tariff = create_tariff(effective_from, connection_fee, bands)
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Created the tariff in effect from {tariff.effective_from.isoformat()} with {len(bands)} bands.'
+        ))
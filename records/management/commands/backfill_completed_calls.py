@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from records.models import CallEndRecord
+from records.services import complete_calls
+
+
+class Command(BaseCommand):
+    help = 'Store the call records pairs received before completed calls were introduced as completed calls.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Number of call end records per query.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('Chunk size must be a positive number.')
+        queryset = CallEndRecord.objects.order_by('pk')
+        processed = completed = 0
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'call_id')[:chunk_size])
+            if not chunk:
+                break
+            pks, call_ids = zip(*chunk)
+            completed += len(complete_calls(call_ids))
+            processed += len(chunk)
+            last_pk = pks[-1]
+            self.stdout.write(f'Processed {processed} call end records, {completed} calls completed.')
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {completed} completed calls.'))
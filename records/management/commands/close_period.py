@@ -0,0 +1,75 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from records.billing import generate_bills, get_period_range, get_period_start
+from records.models import CompletedCall, DetachedPeriod, MonthlyBill
+
+
+def _generate_bills(from_date: datetime, to_date: datetime, first_source: str, last_source: str) -> int:
+    """
+    Entry point of worker processes, which open their own database connection.
+    """
+    django.setup()
+    return generate_bills(from_date, to_date, first_source, last_source)
+
+
+class Command(BaseCommand):
+    help = 'Generate the bills of every source with calls in a closed period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', required=True, help='Period to close, in YYYY-MM format.')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of sources per chunk.')
+
+    def _clean_period(self, period: str) -> datetime:
+        try:
+            period = datetime.strptime(period, '%Y-%m').replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise CommandError('Period is invalid. Must be in YYYY-MM format.')
+        if period >= get_period_start(timezone.now()):
+            raise CommandError("You can't close the current month or next months.")
+        if DetachedPeriod.objects.filter(period=period.date()).exists():
+            raise CommandError('Calls of the period were detached, so its bills are kept as they are.')
+        return period
+
+    def get_pending_sources(self, from_date: datetime, to_date: datetime) -> list:
+        """
+        Sources with calls in the period whose bill was not generated yet, in order.
+        """
+        sources = CompletedCall.objects.filter(end__gte=from_date, end__lt=to_date).order_by('source')
+        sources = sources.values_list('source', flat=True).distinct()
+        generated_sources = set(
+            MonthlyBill.objects.filter(period=from_date.date(), is_stale=False).values_list('source', flat=True)
+        )
+        return [source for source in sources if source not in generated_sources]
+
+    def report_progress(self, results, total: int) -> int:
+        generated = 0
+        for done, count in enumerate(results, start=1):
+            generated += count
+            self.stdout.write(f'Chunk {done}/{total} done, {generated} bills generated.')
+        return generated
+
+    def handle(self, *args, **options):
+        workers, chunk_size = options['workers'], options['chunk_size']
+        if workers < 1 or chunk_size < 1:
+            raise CommandError('Workers and chunk size must be positive numbers.')
+        from_date, to_date = get_period_range(self._clean_period(options['period']))
+        sources = self.get_pending_sources(from_date, to_date)
+        chunks = [
+            (from_date, to_date, sources[index], sources[min(index + chunk_size, len(sources)) - 1])
+            for index in range(0, len(sources), chunk_size)
+        ]
+        self.stdout.write(f'{len(sources)} bills pending in {len(chunks)} chunks.')
+        if workers == 1:
+            generated = self.report_progress((generate_bills(*chunk) for chunk in chunks), len(chunks))
+        else:
+            # Forked workers must not inherit the connection of this process
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_generate_bills, *chunk) for chunk in chunks]
+                generated = self.report_progress((future.result() for future in as_completed(futures)), len(chunks))
+        self.stdout.write(self.style.SUCCESS(f'Period {options["period"]} closed, {generated} bills generated.'))
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from records.compact import to_compact_storage, to_text_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert the call ids and phone numbers of the record tables to the storage set by RECORDS_COMPACT_STORAGE, '
+        'after it is changed. Tables are rewritten and locked meanwhile, so run it in a maintenance window.'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Call ids and phone numbers are only stored compactly in PostgreSQL.')
+        storage = 'compact' if settings.RECORDS_COMPACT_STORAGE else 'text'
+        convert = to_compact_storage if settings.RECORDS_COMPACT_STORAGE else to_text_storage
+        try:
+            with connection.schema_editor() as schema_editor:
+                converted = convert(schema_editor)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f'Converted {converted} columns to the {storage} storage.'))
@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from records.models import CallEndRecord, CallStartRecord
+from records.queue import CALL_END, CALL_START, get_ingest_queue
+from records.serializers import CallEndRecordBatchSerializer, CallStartRecordBatchSerializer
+from records.services import create_call_end_records, create_call_start_records, drain_queue_batch
+
+# Call start records are drained first, so call end records of the same batch find them and are priced right away
+INGESTERS = (
+    (CALL_START, CallStartRecord, create_call_start_records, CallStartRecordBatchSerializer),
+    (CALL_END, CallEndRecord, create_call_end_records, CallEndRecordBatchSerializer),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Store the call records received in queue ingestion mode. Must run on the same host as the web process, '
+        'which writes the queue to the local filesystem.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of records stored per batch.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before polling again an empty queue.')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+
+    def drain(self, queue, batch_size: int) -> int:
+        drained = 0
+        for kind, model, create_records, serializer_class in INGESTERS:
+            while True:
+                counts = drain_queue_batch(queue, kind, model, create_records, serializer_class(), batch_size)
+                if counts is None:
+                    break
+                stored, failed = counts
+                drained += stored + failed
+                self.stdout.write(f'Stored {stored} {kind} records, {failed} failed.')
+        return drained
+
+    def handle(self, *args, **options):
+        batch_size, poll_interval = options['batch_size'], options['poll_interval']
+        if batch_size < 1 or poll_interval < 0:
+            raise CommandError('Batch size must be a positive number and poll interval cannot be negative.')
+        queue = get_ingest_queue()
+        while True:
+            drained = self.drain(queue, batch_size)
+            if options['once']:
+                break
+            if not drained:
+                time.sleep(poll_interval)
+        stats = queue.get_stats()
+        self.stdout.write(self.style.SUCCESS(f'Queue drained, {stats["failed"]} failed records kept apart.'))
@@ -0,0 +1,75 @@
+import re
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from records.billing import BILL_LINE_FIELDS, get_period_range, get_period_start
+from records.models import BillLine, CallEndRecord, CompletedCall, MonthlyBill
+
+# Plan lines of full table scans of each database
+SEQUENTIAL_SCANS = {
+    'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)$'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Print the query plans of the bill of a source in a period and flag the sequential scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', required=True, help='Source of the bill.')
+        parser.add_argument('--period', help='Period of the bill, in YYYY-MM format. Defaults to the last month.')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Run the queries to show actual times, in PostgreSQL.')
+        parser.add_argument('--fail-on-seq-scan', action='store_true',
+                            help='Exit with an error if any query has a sequential scan.')
+
+    def _clean_period(self, period: str) -> datetime:
+        if not period:
+            return get_period_start(get_period_start(timezone.now()) - timedelta(days=1))
+        try:
+            return datetime.strptime(period, '%Y-%m').replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise CommandError('Period is invalid. Must be in YYYY-MM format.')
+
+    def get_queries(self, source: str, from_date: datetime, to_date: datetime) -> list:
+        """
+        Queries run to serve a bill: the lines of its snapshot, the completed calls the snapshot is generated from,
+        and the call records, which completed calls replace.
+        """
+        queries = []
+        bill = MonthlyBill.objects.filter(source=source, period=from_date.date()).first()
+        if bill is not None:
+            queries.append(('Bill lines', bill.lines.order_by('end', 'call_id').values(*BILL_LINE_FIELDS)))
+        else:
+            # The bill is not generated here, the plan is the same for any bill
+            queries.append(('Bill lines', BillLine.objects.filter(bill_id=0).order_by('end', 'call_id')
+                            .values(*BILL_LINE_FIELDS)))
+        queries.append(('Completed calls', CompletedCall.objects.get_calls(from_date, to_date, source=source)))
+        queries.append(('Call records', CallEndRecord.objects.get_calls(from_date, to_date, source=source)))
+        return queries
+
+    def explain(self, queryset, analyze: bool) -> str:
+        if connection.vendor == 'postgresql':
+            return queryset.explain(analyze=analyze, buffers=analyze)
+        return queryset.explain()
+
+    def find_sequential_scans(self, plan: str) -> list:
+        pattern = SEQUENTIAL_SCANS.get(connection.vendor)
+        if pattern is None:
+            return []
+        return [match.group(1) for match in map(pattern.search, plan.splitlines()) if match is not None]
+
+    def handle(self, *args, **options):
+        from_date, to_date = get_period_range(self._clean_period(options['period']))
+        seq_scans = 0
+        for label, queryset in self.get_queries(options['source'], from_date, to_date):
+            plan = self.explain(queryset, options['analyze'])
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{label}:'))
+            self.stdout.write(plan)
+            for table in self.find_sequential_scans(plan):
+                seq_scans += 1
+                self.stderr.write(self.style.WARNING(f'{label}: sequential scan on {table}.'))
+        if seq_scans and options['fail_on_seq_scan']:
+            raise CommandError(f'{seq_scans} sequential scans found.')
+        self.stdout.write(self.style.SUCCESS(f'{seq_scans} sequential scans found.'))
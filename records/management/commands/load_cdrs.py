@@ -0,0 +1,53 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from records.loaders import PARSERS, load_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Load call start and end records from a CDR file, with one record shaped like the API payloads per row. '
+        'Call ids already stored are skipped, so an interrupted load can be run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Path of the file, or - to read from the standard input.')
+        parser.add_argument('--format', choices=sorted(PARSERS), default='ndjson', help='Format of the file.')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Number of rows stored per transaction.')
+        parser.add_argument('--workers', type=int, default=1, help='Number of processes validating rows.')
+        parser.add_argument('--max-errors', type=int, default=20, help='Number of invalid rows to report.')
+
+    def report_errors(self, errors: list, reported: int, max_errors: int) -> int:
+        for line_number, detail in errors[:max(max_errors - reported, 0)]:
+            self.stderr.write(f'Line {line_number}: {detail}')
+        return reported + len(errors)
+
+    def load(self, file, options) -> dict:
+        totals = {'rows': 0, 'starts': 0, 'ends': 0, 'skipped': 0, 'completed': 0, 'invalid': 0}
+        started_at = time.perf_counter()
+        chunks = load_records(file, options['format'], chunk_size=options['chunk_size'], workers=options['workers'])
+        for chunk in chunks:
+            totals['invalid'] = self.report_errors(chunk.pop('errors'), totals['invalid'], options['max_errors'])
+            for key, value in chunk.items():
+                totals[key] += value
+            rate = totals['rows'] / max(time.perf_counter() - started_at, 1e-9)
+            self.stdout.write(f'Processed {totals["rows"]} rows ({rate:.0f} rows/s).')
+        return totals
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('Chunk size and workers must be positive numbers.')
+        if options['file'] == '-':
+            totals = self.load(sys.stdin, options)
+        else:
+            try:
+                file = open(options['file'], newline='', encoding='utf-8')
+            except OSError as exc:
+                raise CommandError(f'Could not read {options["file"]}: {exc.strerror}.')
+            with file:
+                totals = self.load(file, options)
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {totals["starts"]} call start records and {totals["ends"]} call end records, completed '
+            f'{totals["completed"]} calls. {totals["skipped"]} records already stored and {totals["invalid"]} '
+            'invalid rows were skipped.'
+        ))
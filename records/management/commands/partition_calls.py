@@ -0,0 +1,60 @@
+from datetime import datetime
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from records.billing import get_period_range, get_period_start
+from records.partitions import create_partition, detach_partition, get_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the monthly partitions of completed calls ahead of time and detach the partitions of old periods. '
+        'Meant to run periodically.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Number of months after the current one to create partitions for.')
+        parser.add_argument('--detach-before', help='Detach the partitions of the periods before this one, '
+                                                    'in YYYY-MM format. Their bills are generated first.')
+        parser.add_argument('--drop', action='store_true', help='Drop the detached partitions instead of keeping '
+                                                                'them as standalone tables.')
+
+    def _clean_period(self, period: str) -> datetime:
+        try:
+            period = datetime.strptime(period, '%Y-%m').replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise CommandError('Period is invalid. Must be in YYYY-MM format.')
+        if period > get_period_start(timezone.now()):
+            raise CommandError("You can't detach the partitions of the current month or next months.")
+        return period
+
+    def create_partitions(self, months_ahead: int):
+        period = get_period_start(timezone.now())
+        for _ in range(months_ahead + 1):
+            if create_partition(period):
+                self.stdout.write(f'Created the partition of {period:%Y-%m}.')
+            _, period = get_period_range(period)
+
+    def detach_partitions(self, before: datetime, drop: bool):
+        for period in sorted(get_partitions()):
+            if period >= before.date():
+                break
+            # Bills are kept as snapshots, so they are still served once the calls of the period are detached
+            call_command('close_period', period=f'{period:%Y-%m}', stdout=self.stdout)
+            try:
+                detach_partition(datetime(period.year, period.month, 1, tzinfo=timezone.utc), drop=drop)
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f'{"Dropped" if drop else "Detached"} the partition of {period:%Y-%m}.')
+
+    def handle(self, *args, **options):
+        if options['months_ahead'] < 0:
+            raise CommandError('Months ahead cannot be negative.')
+        before = self._clean_period(options['detach_before']) if options['detach_before'] else None
+        if not is_partitioned():
+            raise CommandError('Completed calls are not partitioned, which requires PostgreSQL 11 or later.')
+        self.create_partitions(options['months_ahead'])
+        if before is not None:
+            self.detach_partitions(before, options['drop'])
+        self.stdout.write(self.style.SUCCESS(f'{len(get_partitions())} monthly partitions attached.'))
@@ -0,0 +1,47 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from records.billing import get_period_range, invalidate_bill_keys, rebuild_usage
+from records.models import CompletedCall
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalculate the usage of the sources with completed calls in a period from their completed calls, e.g. for '
+        'calls completed before usage was kept, and invalidate their bills. Sources are locked a chunk at a time, so '
+        'calls can be completed meanwhile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', required=True, help='Period to recalculate, in YYYY-MM format.')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Number of sources per chunk.')
+
+    def _clean_period(self, period: str) -> datetime:
+        try:
+            return datetime.strptime(period, '%Y-%m').replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise CommandError('Period is invalid. Must be in YYYY-MM format.')
+
+    def rebuild_usage(self, from_date: datetime, sources: list):
+        keys = [(from_date.date(), source) for source in sources]
+        with transaction.atomic():
+            rebuild_usage(keys)
+            # Bill responses include the usage as their summary
+            invalidate_bill_keys(keys)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('Chunk size must be a positive number.')
+        from_date, to_date = get_period_range(self._clean_period(options['period']))
+        sources = list(
+            CompletedCall.objects.filter(end__gte=from_date, end__lt=to_date)
+            .order_by('source').values_list('source', flat=True).distinct()
+        )
+        for index in range(0, len(sources), chunk_size):
+            self.rebuild_usage(from_date, sources[index:index + chunk_size])
+            self.stdout.write(f'Recalculated the usage of {min(index + chunk_size, len(sources))} sources.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Recalculated the usage of {len(sources)} sources in {from_date:%Y-%m}.'
+        ))
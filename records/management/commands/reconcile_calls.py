@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from records.services import get_misordered_call_end_records, get_unpaired_backlog, reconcile_calls
+
+
+class Command(BaseCommand):
+    help = 'Complete the unpaired call end records whose call start record has arrived. Meant to run periodically.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Number of call end records per query.')
+
+    def write_backlog(self, label: str):
+        backlog = get_unpaired_backlog()
+        oldest = backlog['oldest'].isoformat() if backlog['oldest'] else '-'
+        self.stdout.write(f'{label}: {backlog["size"]} unpaired call end records, oldest ended at {oldest}.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('Chunk size must be a positive number.')
+        self.write_backlog('Before')
+        completed = reconcile_calls(chunk_size=options['chunk_size'])
+        self.write_backlog('After')
+        misordered = get_misordered_call_end_records().count()
+        if misordered:
+            self.stdout.write(self.style.WARNING(
+                f'{misordered} unpaired call end records are earlier than their call start record and were skipped.'
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {completed} calls.'))
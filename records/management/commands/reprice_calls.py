@@ -0,0 +1,86 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from records.billing import get_usage_key, invalidate_bills, rebuild_usage
+from records.models import CallEndRecord, CallStartRecord, CompletedCall
+from records.services import chunked
+from records.utils import price_calls, to_datetime64
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalculate the price of call end records whose call start record exists, in chunks. Their completed calls, '
+        'bills and usage are updated too.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_date', help='Only calls that ended from this date on (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='to_date', help='Only calls that ended before this date (YYYY-MM-DD).')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Number of calls priced per query.')
+        parser.add_argument('--dry-run', action='store_true', help='Count changed prices without saving them.')
+
+    def _parse_date(self, value):
+        if value is None:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        except ValueError:
+            raise CommandError(f'Date {value} is invalid. Must be in YYYY-MM-DD format.')
+
+    def get_queryset(self, from_date=None, to_date=None):
+        call_start_records = CallStartRecord.objects.filter(call_id=OuterRef('call_id'))
+        records = CallEndRecord.objects.annotate(start=Subquery(call_start_records.values('timestamp')))
+        records = records.filter(start__isnull=False)
+        if from_date:
+            records = records.filter(timestamp__gte=from_date)
+        if to_date:
+            records = records.filter(timestamp__lt=to_date)
+        return records.order_by('pk')
+
+    def reprice_completed_calls(self, prices: dict):
+        """
+        Set the new prices, by call id, of completed calls, marking their bills as stale and recalculating the usage
+        of their sources.
+        """
+        calls = []
+        for chunk in chunked(list(prices)):
+            calls.extend(CompletedCall.objects.filter(call_id__in=chunk).only('call_id', 'source', 'end', 'price'))
+        calls = [call for call in calls if call.price != prices[call.call_id]]
+        for call in calls:
+            call.price = prices[call.call_id]
+        CompletedCall.objects.bulk_update(calls, ['price'], batch_size=len(prices))
+        rebuild_usage(map(get_usage_key, calls))
+        invalidate_bills(calls)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('Chunk size must be a positive number.')
+        queryset = self.get_queryset(self._parse_date(options['from_date']), self._parse_date(options['to_date']))
+        priced = changed = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination on pk keeps every chunk as cheap as the first one
+            chunk = list(queryset.filter(pk__gt=last_pk).values_list(
+                'pk', 'call_id', 'start', 'timestamp', 'price'
+            )[:chunk_size])
+            if not chunk:
+                break
+            pks, call_ids, starts, ends, prices = zip(*chunk)
+            new_prices = price_calls(to_datetime64(starts), to_datetime64(ends))
+            records = [
+                CallEndRecord(pk=pk, call_id=call_id, price=new_price)
+                for pk, call_id, price, new_price in zip(pks, call_ids, prices, new_prices) if price != new_price
+            ]
+            if records and not options['dry_run']:
+                with transaction.atomic():
+                    CallEndRecord.objects.bulk_update(records, ['price'], batch_size=chunk_size)
+                    self.reprice_completed_calls({record.call_id: record.price for record in records})
+            priced += len(chunk)
+            changed += len(records)
+            last_pk = pks[-1]
+            self.stdout.write(f'Priced {priced} calls, {changed} prices changed.')
+        action = 'would change' if options['dry_run'] else 'changed'
+        self.stdout.write(self.style.SUCCESS(f'Repriced {priced} calls, {changed} prices {action}.'))
@@ -0,0 +1,214 @@
+"""
+In-process metrics of the requests served by this process, exposed in the Prometheus text format. The time of each
+request is split into phases (db, serialize, render, pricing) measured with timed blocks, which only cost a couple of
+perf_counter calls per block, so instrumentation can be left on in production. Phases may overlap, e.g. queries run
+while serializing are counted in db and serialize.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+PHASES = ('db', 'serialize', 'render', 'pricing')
+
+_current = ContextVar('records_request_metrics', default=None)
+
+
+def _format_labels(labelnames: tuple, labels: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, buckets: tuple, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames
+        # Count of each bucket, not cumulative, plus the count of values over the last bucket, and the sum
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            labels = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """
+    Gauge whose values are collected when metrics are rendered, by a function returning (labels, value) pairs.
+    """
+
+    def __init__(self, name: str, documentation: str, collect, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = labelnames
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for labels, value in self.collect():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+REQUESTS = Counter('records_requests_total', 'Requests served.', ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('records_request_seconds', 'Wall time of requests.', SECONDS_BUCKETS,
+                            ('endpoint', 'method'))
+PHASE_SECONDS = Histogram('records_request_phase_seconds', 'Time of requests spent in each phase.', SECONDS_BUCKETS,
+                          ('endpoint', 'phase'))
+QUERIES = Histogram('records_request_queries', 'SQL queries run by requests.', COUNT_BUCKETS, ('endpoint',))
+ROWS = Histogram('records_request_rows', 'Rows fetched by requests, as reported by the database driver.',
+                 COUNT_BUCKETS, ('endpoint',))
+
+_metrics = [REQUESTS, REQUEST_SECONDS, PHASE_SECONDS, QUERIES, ROWS]
+
+
+def register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+class RequestMetrics:
+    __slots__ = ('timings', 'queries', 'rows')
+
+    def __init__(self):
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.rows = 0
+
+    def get_server_timing(self, duration: float) -> str:
+        timings = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.timings.items() if seconds]
+        timings.append(f'total;dur={duration * 1000:.2f};desc="{self.queries} queries"')
+        return ', '.join(timings)
+
+
+def start_request() -> tuple:
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def suspend_request(token):
+    """
+    Stop measuring the current request until resume_request, e.g. while its streamed response waits to be sent.
+    """
+    _current.reset(token)
+
+
+def finish_request(token, metrics: RequestMetrics, endpoint: str, method: str, status: int, duration: float):
+    # Suspended requests have no token
+    if token is not None:
+        _current.reset(token)
+    REQUESTS.inc(endpoint, method, status)
+    REQUEST_SECONDS.observe(duration, endpoint, method)
+    for phase, seconds in metrics.timings.items():
+        if seconds:
+            PHASE_SECONDS.observe(seconds, endpoint, phase)
+    QUERIES.observe(metrics.queries, endpoint)
+    ROWS.observe(metrics.rows, endpoint)
+
+
+@contextmanager
+def resume_request(metrics: RequestMetrics):
+    """
+    Make a started request current again in the block, e.g. while its response is streamed after the view returned.
+    """
+    token = _current.set(metrics)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    Add the time spent in the block to the given phase of the current request, if any.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[phase] += time.perf_counter() - started
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper that adds queries of the current request to its db phase.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.timings['db'] += time.perf_counter() - started
+        metrics.queries += 1
+        rowcount = context['cursor'].rowcount
+        # Drivers report the rows of selects at execution, except SQLite, which reports -1
+        if rowcount > 0 and not many and sql.lstrip()[:6].upper() == 'SELECT':
+            metrics.rows += rowcount
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
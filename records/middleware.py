@@ -0,0 +1,81 @@
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from .metrics import finish_request, record_query, resume_request, start_request, suspend_request
+
+
+class MeasuredStream:
+    """
+    Streamed content of a response, whose queries are added to the request that returned it. on_close finishes the
+    request when the response is closed.
+    """
+
+    def __init__(self, content, metrics, on_close):
+        self.content = iter(content)
+        self.metrics = metrics
+        self.on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with resume_request(self.metrics):
+            return next(self.content)
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+
+class InstrumentationMiddleware:
+    """
+    Measure each request, aggregating its timings, queries and rows fetched by endpoint, and describe them in a
+    Server-Timing header. Disabled with RECORDS_METRICS_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        if not settings.RECORDS_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def get_endpoint(self, request) -> str:
+        # URL names keep the number of label values bounded, unlike paths
+        match = request.resolver_match
+        return match.view_name if match is not None else 'unmatched'
+
+    def finish(self, request, token, metrics, status: int, started: float) -> float:
+        duration = time.perf_counter() - started
+        finish_request(token, metrics, self.get_endpoint(request), request.method, status, duration)
+        return duration
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        metrics, token = start_request()
+        stack = ExitStack()
+        try:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(record_query))
+            response = self.get_response(request)
+        except BaseException:
+            stack.close()
+            self.finish(request, token, metrics, 500, started)
+            raise
+        if not response.streaming:
+            stack.close()
+            duration = self.finish(request, token, metrics, response.status_code, started)
+            response['Server-Timing'] = metrics.get_server_timing(duration)
+            return response
+        # Streamed content, e.g. bill exports, is queried after the view returns, so the request is measured until the
+        # response is closed. Server-Timing, sent before the content, only covers the view
+        suspend_request(token)
+        response['Server-Timing'] = metrics.get_server_timing(time.perf_counter() - started)
+
+        def close():
+            stack.close()
+            self.finish(request, None, metrics, response.status_code, started)
+
+        response.streaming_content = MeasuredStream(response.streaming_content, metrics, close)
+        return response
@@ -0,0 +1,61 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:55
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0004_auto_20200323_1332'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletedCall',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('call_id', models.CharField(help_text='Unique Call ID', max_length=50, unique=True, verbose_name='Call Unique ID')),
+                ('source', models.CharField(help_text='Source', max_length=30, verbose_name='Source')),
+                ('destination', models.CharField(help_text='Destination', max_length=11, verbose_name='Destination')),
+                ('start', models.DateTimeField(help_text='Call start record timestamp', verbose_name='Start')),
+                ('end', models.DateTimeField(help_text='Call end record timestamp', verbose_name='End')),
+                ('duration', models.DurationField(help_text='Call duration', verbose_name='Duration')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=5, verbose_name='Price')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='callendrecord',
+            name='call_id',
+            field=models.CharField(help_text='Unique Call ID', max_length=50, unique=True, verbose_name='Call Unique ID'),
+        ),
+        migrations.AlterField(
+            model_name='callendrecord',
+            name='timestamp',
+            field=models.DateTimeField(help_text='Record Timestamp', verbose_name='Timestamp'),
+        ),
+        migrations.AlterField(
+            model_name='callstartrecord',
+            name='call_id',
+            field=models.CharField(help_text='Unique Call ID', max_length=50, unique=True, verbose_name='Call Unique ID'),
+        ),
+        migrations.AlterField(
+            model_name='callstartrecord',
+            name='destination',
+            field=models.CharField(help_text='Destination', max_length=11, validators=[django.core.validators.MinLengthValidator(10), django.core.validators.MaxLengthValidator(11), django.core.validators.RegexValidator(message='Destination must contain only numbers.', regex='^\\d+$')], verbose_name='Destination'),
+        ),
+        migrations.AlterField(
+            model_name='callstartrecord',
+            name='source',
+            field=models.CharField(help_text='Source', max_length=30, verbose_name='Source'),
+        ),
+        migrations.AlterField(
+            model_name='callstartrecord',
+            name='timestamp',
+            field=models.DateTimeField(help_text='Record Timestamp', verbose_name='Timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='completedcall',
+            index=models.Index(fields=['source', 'end'], name='idx_completedcall_source_end'),
+        ),
+    ]
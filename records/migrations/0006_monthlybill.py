@@ -0,0 +1,52 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0005_completedcall'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillLine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('call_id', models.CharField(help_text='Unique Call ID', max_length=50, verbose_name='Call Unique ID')),
+                ('destination', models.CharField(help_text='Destination', max_length=11, verbose_name='Destination')),
+                ('start', models.DateTimeField(help_text='Call start record timestamp', verbose_name='Start')),
+                ('end', models.DateTimeField(help_text='Call end record timestamp', verbose_name='End')),
+                ('duration', models.DurationField(help_text='Call duration', verbose_name='Duration')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=5, verbose_name='Price')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MonthlyBill',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='Source', max_length=30, verbose_name='Source')),
+                ('period', models.DateField(help_text='First day of the bill month', verbose_name='Period')),
+                ('total', models.DecimalField(decimal_places=2, help_text='Sum of call prices', max_digits=12, verbose_name='Total')),
+                ('call_count', models.PositiveIntegerField(help_text='Number of calls in the bill', verbose_name='Call Count')),
+                ('version', models.PositiveIntegerField(default=1, help_text='Incremented every time the bill data changes', verbose_name='Version')),
+                ('is_stale', models.BooleanField(default=False, help_text='Whether a late call was completed since the bill was generated', verbose_name='Is Stale')),
+                ('generated_at', models.DateTimeField(auto_now=True, help_text='Generation timestamp', verbose_name='Generated At')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlybill',
+            constraint=models.UniqueConstraint(fields=('source', 'period'), name='monthlybill_unique_source_period'),
+        ),
+        migrations.AddField(
+            model_name='billline',
+            name='bill',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='records.MonthlyBill', verbose_name='Bill'),
+        ),
+        migrations.AddIndex(
+            model_name='billline',
+            index=models.Index(fields=['bill', 'end'], name='idx_billline_bill_end'),
+        ),
+    ]
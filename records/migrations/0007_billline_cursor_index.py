@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0006_monthlybill'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='billline',
+            name='idx_billline_bill_end',
+        ),
+        migrations.AddIndex(
+            model_name='billline',
+            index=models.Index(fields=['bill', 'end', 'call_id'], name='idx_billline_bill_end_callid'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0007_billline_cursor_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='callendrecord',
+            index=models.Index(condition=models.Q(price__isnull=True), fields=['timestamp'], name='idx_callendrecord_unpaired'),
+        ),
+    ]
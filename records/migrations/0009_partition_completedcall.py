@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+from django.db import migrations
+
+TABLE = 'records_completedcall'
+UNPARTITIONED_TABLE = 'records_completedcall_unpartitioned'
+DEFAULT_PARTITION = 'records_completedcall_default'
+MONTHS_AHEAD = 3
+
+
+def supports_partitioning(connection) -> bool:
+    # Primary keys and unique constraints on partitioned tables require PostgreSQL 11
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def next_month(period: datetime) -> datetime:
+    return period.replace(year=period.year + period.month // 12, month=period.month % 12 + 1)
+
+
+def partition_completed_calls(apps, schema_editor):
+    """
+    Turn completed calls into a table partitioned by month on the end of the call, with one partition per month from
+    the oldest call to a few months ahead and a default partition for the rest. The primary key and the unique
+    constraint of call_id have to include the partition key. The end of a call comes from its call end record, which
+    is unique and never changes, and calls are only inserted after checking their call_id isn't stored, so call_id
+    stays unique.
+    """
+    connection = schema_editor.connection
+    if not supports_partitioning(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {UNPARTITIONED_TABLE}')
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [UNPARTITIONED_TABLE])
+        sequence, = cursor.fetchone()
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {UNPARTITIONED_TABLE} INCLUDING DEFAULTS) PARTITION BY RANGE ("end")'
+        )
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id')
+        cursor.execute(f'SELECT MIN("end") FROM {UNPARTITIONED_TABLE}')
+        oldest, = cursor.fetchone()
+        now = datetime.now(timezone.utc)
+        period = min(oldest or now, now).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        last_period = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(MONTHS_AHEAD):
+            last_period = next_month(last_period)
+        while period <= last_period:
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_y{period:%Y}m{period:%m} PARTITION OF {TABLE} '
+                f"FOR VALUES FROM ('{period.isoformat()}') TO ('{next_month(period).isoformat()}')"
+            )
+            period = next_month(period)
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {UNPARTITIONED_TABLE}')
+        cursor.execute(f'DROP TABLE {UNPARTITIONED_TABLE}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, "end")')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_call_id_end_key UNIQUE (call_id, "end")')
+        cursor.execute(f'CREATE INDEX idx_completedcall_source_end ON {TABLE} (source, "end")')
+
+
+def unpartition_completed_calls(apps, schema_editor):
+    connection = schema_editor.connection
+    if not supports_partitioning(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        if cursor.fetchone() is None:
+            return
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence, = cursor.fetchone()
+        cursor.execute(f'CREATE TABLE {UNPARTITIONED_TABLE} (LIKE {TABLE} INCLUDING DEFAULTS)')
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {UNPARTITIONED_TABLE}.id')
+        cursor.execute(f'INSERT INTO {UNPARTITIONED_TABLE} SELECT * FROM {TABLE}')
+        cursor.execute(f'DROP TABLE {TABLE}')
+        cursor.execute(f'ALTER TABLE {UNPARTITIONED_TABLE} RENAME TO {TABLE}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id)')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_call_id_key UNIQUE (call_id)')
+        cursor.execute(f'CREATE INDEX idx_completedcall_source_end ON {TABLE} (source, "end")')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0008_callendrecord_unpaired_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_completed_calls, unpartition_completed_calls),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+# Covering indexes of PostgreSQL, so bill queries are index-only scans. They include the columns read by
+# CompletedCall.objects.get_calls, the bill lines listing and the call start record lookups of
+# CallEndRecord.objects.get_calls. The first two replace the plain index of the model with the same name and key.
+COVERING_INDEXES = [
+    ('idx_completedcall_source_end', 'records_completedcall', ['source', 'end'],
+     ['start', 'call_id', 'destination', 'duration', 'price'], True),
+    ('idx_billline_bill_end_callid', 'records_billline', ['bill_id', 'end', 'call_id'],
+     ['start', 'destination', 'duration', 'price'], True),
+    ('idx_callstartrecord_callid_cov', 'records_callstartrecord', ['call_id'],
+     ['timestamp', 'source', 'destination'], False),
+]
+
+
+def supports_covering_indexes(connection) -> bool:
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def create_covering_indexes(apps, schema_editor):
+    if not supports_covering_indexes(schema_editor.connection):
+        return
+    quote = schema_editor.quote_name
+    for name, table, columns, included_columns, _ in COVERING_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {quote(name)}')
+        schema_editor.execute(
+            f'CREATE INDEX {quote(name)} ON {quote(table)} ({", ".join(map(quote, columns))}) '
+            f'INCLUDE ({", ".join(map(quote, included_columns))})'
+        )
+
+
+def drop_covering_indexes(apps, schema_editor):
+    if not supports_covering_indexes(schema_editor.connection):
+        return
+    quote = schema_editor.quote_name
+    for name, table, columns, _, replaces_model_index in COVERING_INDEXES:
+        schema_editor.execute(f'DROP INDEX {quote(name)}')
+        if replaces_model_index:
+            schema_editor.execute(f'CREATE INDEX {quote(name)} ON {quote(table)} ({", ".join(map(quote, columns))})')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0009_partition_completedcall'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='callstartrecord',
+            index=models.Index(fields=['source', 'timestamp'], name='idx_callstartrecord_source_ts'),
+        ),
+        migrations.RunPython(create_covering_indexes, drop_covering_indexes),
+    ]
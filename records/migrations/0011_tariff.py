@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0010_bill_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tariff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('effective_from', models.DateTimeField(help_text='Moment the tariff is in effect from', unique=True, verbose_name='Effective From')),
+                ('connection_fee', models.DecimalField(decimal_places=4, help_text='Fee charged for every call', max_digits=8, verbose_name='Connection Fee')),
+                ('updated_at', models.DateTimeField(auto_now=True, help_text='Update timestamp', verbose_name='Updated At')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TariffBand',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.TimeField(help_text='Start of the band in the day', verbose_name='Start')),
+                ('end', models.TimeField(help_text='End of the band in the day, midnight being the end of the day', verbose_name='End')),
+                ('minute_rate', models.DecimalField(decimal_places=4, help_text='Charge per completed minute', max_digits=8, verbose_name='Minute Rate')),
+                ('tariff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='records.Tariff', verbose_name='Tariff')),
+            ],
+        ),
+    ]
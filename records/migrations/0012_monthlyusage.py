@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0011_tariff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='Source', max_length=30, verbose_name='Source')),
+                ('period', models.DateField(help_text='First day of the month', verbose_name='Period')),
+                ('call_count', models.PositiveIntegerField(default=0, help_text='Number of calls', verbose_name='Call Count')),
+                ('total', models.DecimalField(decimal_places=2, default=0, help_text='Sum of call prices', max_digits=12, verbose_name='Total')),
+                ('billable_minutes', models.BigIntegerField(default=0, help_text='Minutes charged by the minute rates', verbose_name='Billable Minutes')),
+                ('standard_seconds', models.BigIntegerField(default=0, help_text='Seconds of calls from 06:00 to 22:00', verbose_name='Standard Seconds')),
+                ('reduced_seconds', models.BigIntegerField(default=0, help_text='Seconds of calls from 22:00 to 06:00', verbose_name='Reduced Seconds')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyusage',
+            constraint=models.UniqueConstraint(fields=('source', 'period'), name='monthlyusage_unique_source_period'),
+        ),
+    ]
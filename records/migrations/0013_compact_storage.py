@@ -0,0 +1,72 @@
+import django.core.validators
+from django.db import migrations, models
+import records.compact
+
+
+def to_compact_storage(apps, schema_editor):
+    # Columns are created as text by the previous migrations and converted if the compact storage is enabled
+    if records.compact.is_compact_storage(schema_editor.connection):
+        records.compact.to_compact_storage(schema_editor)
+
+
+def to_text_storage(apps, schema_editor):
+    records.compact.to_text_storage(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0012_monthlyusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallIdText',
+            fields=[
+                ('key', models.UUIDField(help_text='Stored call id', primary_key=True, serialize=False, verbose_name='Key')),
+                ('call_id', models.CharField(help_text='Unique Call ID', max_length=50, verbose_name='Call Unique ID')),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='callendrecord',
+                    name='call_id',
+                    field=records.compact.CallIdField(help_text='Unique Call ID', max_length=50, unique=True, verbose_name='Call Unique ID'),
+                ),
+                migrations.AlterField(
+                    model_name='callstartrecord',
+                    name='call_id',
+                    field=records.compact.CallIdField(help_text='Unique Call ID', max_length=50, unique=True, verbose_name='Call Unique ID'),
+                ),
+                migrations.AlterField(
+                    model_name='callstartrecord',
+                    name='destination',
+                    field=records.compact.PhoneNumberField(help_text='Destination', max_length=11, validators=[django.core.validators.MinLengthValidator(10), django.core.validators.MaxLengthValidator(11), django.core.validators.RegexValidator(message='Destination must contain only numbers.', regex='^\\d+$')], verbose_name='Destination'),
+                ),
+                migrations.AlterField(
+                    model_name='callstartrecord',
+                    name='source',
+                    field=records.compact.PhoneNumberField(help_text='Source', max_length=30, verbose_name='Source'),
+                ),
+                migrations.AlterField(
+                    model_name='completedcall',
+                    name='call_id',
+                    field=records.compact.CallIdField(help_text='Unique Call ID', max_length=50, unique=True, verbose_name='Call Unique ID'),
+                ),
+                migrations.AlterField(
+                    model_name='completedcall',
+                    name='destination',
+                    field=records.compact.PhoneNumberField(help_text='Destination', max_length=11, verbose_name='Destination'),
+                ),
+                migrations.AlterField(
+                    model_name='completedcall',
+                    name='source',
+                    field=records.compact.PhoneNumberField(help_text='Source', max_length=30, verbose_name='Source'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(to_compact_storage, to_text_storage),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0013_compact_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetachedPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='First day of the month', unique=True, verbose_name='Period')),
+                ('detached_at', models.DateTimeField(auto_now_add=True, help_text='Detach timestamp', verbose_name='Detached At')),
+            ],
+        ),
+    ]
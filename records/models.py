@@ -1,10 +1,11 @@
 from django.core.validators import MaxLengthValidator, MinLengthValidator, RegexValidator
 from django.db import models
-from .querysets import CallRecordQuerySet
+from .compact import CallIdField, PhoneNumberField
+from .querysets import CallRecordQuerySet, CompletedCallQuerySet
 
 
 class CallRecord(models.Model):
-    call_id = models.CharField(verbose_name='Call Unique ID', max_length=50, unique=True, help_text='Unique Call ID')
+    call_id = CallIdField(verbose_name='Call Unique ID', max_length=50, unique=True, help_text='Unique Call ID')
     timestamp = models.DateTimeField(verbose_name='Timestamp', help_text='Record Timestamp')
 
     class Meta:
@@ -12,8 +13,8 @@ class CallRecord(models.Model):
 
 
 class CallStartRecord(CallRecord):
-    source = models.CharField(verbose_name='Source', max_length=30, help_text='Source')
-    destination = models.CharField(
+    source = PhoneNumberField(verbose_name='Source', max_length=30, help_text='Source')
+    destination = PhoneNumberField(
         verbose_name='Destination',
         max_length=11,
         validators=[
@@ -24,6 +25,11 @@ class CallStartRecord(CallRecord):
         help_text='Destination'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['source', 'timestamp'], name='idx_callstartrecord_source_ts')
+        ]
+
 
 class CallEndRecord(CallRecord):
     price = models.DecimalField(verbose_name='Price', decimal_places=2, max_digits=5, blank=True, null=True)
@@ -32,5 +38,131 @@ class CallEndRecord(CallRecord):
 
     class Meta:
         indexes = [
-            models.Index(fields=['timestamp'], name='idx_callendrecord_timestamp')
+            models.Index(fields=['timestamp'], name='idx_callendrecord_timestamp'),
+            # Unpriced call end records are the ones waiting for their call start record
+            models.Index(fields=['timestamp'], condition=models.Q(price__isnull=True),
+                         name='idx_callendrecord_unpaired')
+        ]
+
+
+class CompletedCall(models.Model):
+    """
+    Call start and end records pair gathered in a single row, filled when both records of the call are received.
+    In PostgreSQL the table is partitioned by month on the end of the call, see records.partitions.
+    """
+    call_id = CallIdField(verbose_name='Call Unique ID', max_length=50, unique=True, help_text='Unique Call ID')
+    source = PhoneNumberField(verbose_name='Source', max_length=30, help_text='Source')
+    destination = PhoneNumberField(verbose_name='Destination', max_length=11, help_text='Destination')
+    start = models.DateTimeField(verbose_name='Start', help_text='Call start record timestamp')
+    end = models.DateTimeField(verbose_name='End', help_text='Call end record timestamp')
+    duration = models.DurationField(verbose_name='Duration', help_text='Call duration')
+    price = models.DecimalField(verbose_name='Price', decimal_places=2, max_digits=5)
+
+    objects = CompletedCallQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['source', 'end'], name='idx_completedcall_source_end')
+        ]
+
+
+class CallIdText(models.Model):
+    """
+    Text of the call ids stored as a hash in the compact storage of call records, see records.compact.
+    """
+    key = models.UUIDField(verbose_name='Key', primary_key=True, help_text='Stored call id')
+    call_id = models.CharField(verbose_name='Call Unique ID', max_length=50, help_text='Unique Call ID')
+
+
+class MonthlyBill(models.Model):
+    """
+    Snapshot of the bill of a source in a closed period. Lines are copied from completed calls the first time the
+    bill is requested and only rebuilt if a late call of the period is completed afterwards.
+    """
+    source = models.CharField(verbose_name='Source', max_length=30, help_text='Source')
+    period = models.DateField(verbose_name='Period', help_text='First day of the bill month')
+    total = models.DecimalField(verbose_name='Total', decimal_places=2, max_digits=12, help_text='Sum of call prices')
+    call_count = models.PositiveIntegerField(verbose_name='Call Count', help_text='Number of calls in the bill')
+    version = models.PositiveIntegerField(verbose_name='Version', default=1,
+                                          help_text='Incremented every time the bill data changes')
+    is_stale = models.BooleanField(verbose_name='Is Stale', default=False,
+                                   help_text='Whether a late call was completed since the bill was generated')
+    generated_at = models.DateTimeField(verbose_name='Generated At', auto_now=True, help_text='Generation timestamp')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'period'], name='monthlybill_unique_source_period')
+        ]
+
+
+class BillLine(models.Model):
+    bill = models.ForeignKey(MonthlyBill, verbose_name='Bill', related_name='lines', on_delete=models.CASCADE)
+    call_id = models.CharField(verbose_name='Call Unique ID', max_length=50, help_text='Unique Call ID')
+    destination = models.CharField(verbose_name='Destination', max_length=11, help_text='Destination')
+    start = models.DateTimeField(verbose_name='Start', help_text='Call start record timestamp')
+    end = models.DateTimeField(verbose_name='End', help_text='Call end record timestamp')
+    duration = models.DurationField(verbose_name='Duration', help_text='Call duration')
+    price = models.DecimalField(verbose_name='Price', decimal_places=2, max_digits=5)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bill', 'end', 'call_id'], name='idx_billline_bill_end_callid')
         ]
+
+
+class DetachedPeriod(models.Model):
+    """
+    Period whose partition of completed calls was detached, see records.partitions. Its bills can't be generated from
+    its calls anymore, so they are kept as they are.
+    """
+    period = models.DateField(verbose_name='Period', unique=True, help_text='First day of the month')
+    detached_at = models.DateTimeField(verbose_name='Detached At', auto_now_add=True, help_text='Detach timestamp')
+
+
+class MonthlyUsage(models.Model):
+    """
+    Usage of a source in a period, by the end of its calls. Calls are added as they are completed, so the totals of a
+    bill are read from a single row regardless of its number of calls.
+    """
+    source = models.CharField(verbose_name='Source', max_length=30, help_text='Source')
+    period = models.DateField(verbose_name='Period', help_text='First day of the month')
+    call_count = models.PositiveIntegerField(verbose_name='Call Count', default=0, help_text='Number of calls')
+    total = models.DecimalField(verbose_name='Total', decimal_places=2, max_digits=12, default=0,
+                                help_text='Sum of call prices')
+    billable_minutes = models.BigIntegerField(verbose_name='Billable Minutes', default=0,
+                                              help_text='Minutes charged by the minute rates')
+    standard_seconds = models.BigIntegerField(verbose_name='Standard Seconds', default=0,
+                                              help_text='Seconds of calls from 06:00 to 22:00')
+    reduced_seconds = models.BigIntegerField(verbose_name='Reduced Seconds', default=0,
+                                             help_text='Seconds of calls from 22:00 to 06:00')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'period'], name='monthlyusage_unique_source_period')
+        ]
+
+
+class Tariff(models.Model):
+    """
+    Rates of the calls started from effective_from on, until the next tariff. Tariffs are not changed once in effect, a
+    new one is created instead, so the tariff a call was priced with is known from its start. Calls started before the
+    first tariff are priced with the MINUTE_RATE and CONNECTION_FEE settings.
+    """
+    effective_from = models.DateTimeField(verbose_name='Effective From', unique=True,
+                                          help_text='Moment the tariff is in effect from')
+    connection_fee = models.DecimalField(verbose_name='Connection Fee', decimal_places=4, max_digits=8,
+                                         help_text='Fee charged for every call')
+    updated_at = models.DateTimeField(verbose_name='Updated At', auto_now=True, help_text='Update timestamp')
+
+
+class TariffBand(models.Model):
+    """
+    Time of the day, in UTC, in which every completed minute of a call is charged with minute_rate. Time out of the
+    bands of a tariff is free of charge.
+    """
+    tariff = models.ForeignKey(Tariff, verbose_name='Tariff', related_name='bands', on_delete=models.CASCADE)
+    start = models.TimeField(verbose_name='Start', help_text='Start of the band in the day')
+    end = models.TimeField(verbose_name='End',
+                           help_text='End of the band in the day, midnight being the end of the day')
+    minute_rate = models.DecimalField(verbose_name='Minute Rate', decimal_places=4, max_digits=8,
+                                      help_text='Charge per completed minute')
@@ -1,5 +1,27 @@
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from functools import partial
+from urllib import parse
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Cursor = namedtuple('Cursor', ['end', 'call_id', 'reverse'])
+
+
+class CountedPaginator(Paginator):
+    """
+    Paginator that receives the number of objects instead of counting them with a query.
+    """
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            self.count = count
 
 
 class TelephonyBillPagination(PageNumberPagination):
@@ -7,6 +29,12 @@ class TelephonyBillPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+    def paginate_queryset(self, queryset, request, view=None):
+        # Views may know the number of results beforehand, e.g. from a bill snapshot
+        count = getattr(view, 'result_count', None)
+        self.django_paginator_class = partial(CountedPaginator, count=count)
+        return super().paginate_queryset(queryset, request, view=view)
+
     def get_paginated_response(self, data):
         return Response({
             'links': {
@@ -16,3 +44,86 @@ class TelephonyBillPagination(PageNumberPagination):
             'count': self.page.paginator.count,
             'results': data
         })
+
+
+class TelephonyBillCursorPagination(TelephonyBillPagination):
+    """
+    Keyset pagination on (end, call_id). Each page is a range scan starting at the cursor position, so every page
+    costs the same regardless of its depth. The count is only given when the view knows it beforehand.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+        self.count = getattr(view, 'result_count', None)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            queryset = queryset.order_by('end', 'call_id')
+        elif self.cursor.reverse:
+            queryset = queryset.filter(
+                Q(end__lt=self.cursor.end) | Q(end=self.cursor.end, call_id__lt=self.cursor.call_id)
+            ).order_by('-end', '-call_id')
+        else:
+            queryset = queryset.filter(
+                Q(end__gt=self.cursor.end) | Q(end=self.cursor.end, call_id__gt=self.cursor.call_id)
+            ).order_by('end', 'call_id')
+
+        # One extra row tells whether there are more results after this page
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.cursor is not None and self.cursor.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('utf-8')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            end = parse_datetime(tokens['e'][0])
+            call_id = tokens['c'][0]
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if end is None:
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(end=end, call_id=call_id, reverse=reverse)
+
+    def encode_cursor(self, cursor: Cursor) -> str:
+        tokens = {'e': cursor.end.isoformat(), 'c': cursor.call_id}
+        if cursor.reverse:
+            tokens['r'] = '1'
+        querystring = parse.urlencode(tokens)
+        encoded = b64encode(querystring.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor(Cursor(end=last['end'], call_id=last['call_id'], reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        first = self.page[0]
+        return self.encode_cursor(Cursor(end=first['end'], call_id=first['call_id'], reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'links': {
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link()
+            },
+            'count': self.count,
+            'results': data
+        })
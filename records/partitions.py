@@ -0,0 +1,91 @@
+"""
+Monthly range partitions of completed calls on the end of the call, in PostgreSQL 11 or later. A bill reads the calls
+of a single period, so its queries only touch the partition of that period. Calls of periods without a partition are
+stored in a default partition. Other databases keep a plain table. Detached periods are recorded, as their bills are
+kept as they are from then on.
+"""
+from datetime import datetime
+from django.db import connection, transaction
+from .billing import get_period_range
+from .models import CompletedCall, DetachedPeriod, MonthlyBill
+
+TABLE = CompletedCall._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME_FORMAT = f'{TABLE}_y%Ym%m'
+
+
+def supports_partitioning() -> bool:
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+def is_partitioned() -> bool:
+    if not supports_partitioning():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_partition_name(period: datetime) -> str:
+    return period.strftime(PARTITION_NAME_FORMAT)
+
+
+def get_partitions() -> dict:
+    """
+    Map the first day of the period of every monthly partition to its name.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass',
+            [TABLE]
+        )
+        names = [name for name, in cursor.fetchall() if name != DEFAULT_PARTITION]
+    return {datetime.strptime(name, PARTITION_NAME_FORMAT).date(): name for name in names}
+
+
+def create_partition(period: datetime) -> bool:
+    """
+    Create the partition of a period if it does not exist yet. Calls of the period stored in the default partition
+    meanwhile are moved to it. Returns whether the partition was created.
+    """
+    if period.date() in get_partitions():
+        return False
+    start, end = get_period_range(period)
+    table, name, default = (connection.ops.quote_name(name) for name in (TABLE, get_partition_name(period),
+                                                                          DEFAULT_PARTITION))
+    # Partition bounds must be literals in PostgreSQL 11
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {default} WHERE "end" >= %s AND "end" < %s)', [start, end])
+        misplaced, = cursor.fetchone()
+        if not misplaced:
+            cursor.execute(f'CREATE TABLE {name} PARTITION OF {table} {bounds}')
+            return True
+        cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {default}')
+        cursor.execute(f'CREATE TABLE {name} PARTITION OF {table} {bounds}')
+        cursor.execute(f'INSERT INTO {name} SELECT * FROM {default} WHERE "end" >= %s AND "end" < %s', [start, end])
+        cursor.execute(f'DELETE FROM {default} WHERE "end" >= %s AND "end" < %s', [start, end])
+        cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT')
+    return True
+
+
+def detach_partition(period: datetime, drop: bool = False) -> bool:
+    """
+    Detach the partition of a period from completed calls, keeping it as a standalone table unless drop is given.
+    Bills of the period are kept as they are afterwards, so periods with stale bills are refused. Returns whether the
+    partition existed.
+    """
+    name = get_partitions().get(period.date())
+    if name is None:
+        return False
+    table, name = connection.ops.quote_name(TABLE), connection.ops.quote_name(name)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Detaching locks the table, so no late call of the period can make a bill stale after this check
+        cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+        if MonthlyBill.objects.filter(period=period.date(), is_stale=True).exists():
+            raise ValueError(f'Period {period:%Y-%m} has stale bills, which must be generated before detaching it.')
+        DetachedPeriod.objects.get_or_create(period=period.date())
+        if drop:
+            cursor.execute(f'DROP TABLE {name}')
+    return True
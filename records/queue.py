@@ -0,0 +1,128 @@
+"""
+Durable local spool of the call records received in queue ingestion mode. Records are appended to a SQLite database in
+WAL mode, so receiving a record only waits for a local append, and are stored in batches by the drain_ingest_queue
+command. Items are only removed once their batch is stored, so every record is delivered at least once.
+"""
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from django.conf import settings
+
+CALL_START = 'start'
+CALL_END = 'end'
+KINDS = (CALL_START, CALL_END)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    leased_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_items_kind_leased_until ON items (kind, leased_until, id);
+CREATE TABLE IF NOT EXISTS failed_items (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    errors TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class IngestQueue:
+    """
+    Queue of call record payloads. Batches are leased to the worker that reads them, and are read again by any worker
+    once the lease expires without being acknowledged, e.g. after a crash.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300, timeout: float = 30):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # SQLite connections can't be shared between threads, each thread opens its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def put(self, kind: str, payload: dict):
+        self.connection.execute(
+            'INSERT INTO items (kind, payload, received_at) VALUES (?, ?, ?)', (kind, json.dumps(payload), time.time())
+        )
+
+    def get_batch(self, kind: str, size: int) -> list:
+        """
+        Lease and return up to size (id, payload) pairs of the given kind, oldest first.
+        """
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT id, payload FROM items WHERE kind = ? AND leased_until < ? ORDER BY id LIMIT ?',
+                (kind, now, size)
+            ).fetchall()
+            connection.executemany(
+                'UPDATE items SET leased_until = ? WHERE id = ?', ((now + self.lease_seconds, row[0]) for row in rows)
+            )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return [(item_id, json.loads(payload)) for item_id, payload in rows]
+
+    def ack(self, item_ids: list, failed: list = ()):
+        """
+        Remove delivered items. Failed items are given as (id, kind, payload, errors) and kept apart for inspection.
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            connection.executemany(
+                'INSERT OR REPLACE INTO failed_items (id, kind, payload, errors, failed_at) VALUES (?, ?, ?, ?, ?)',
+                ((item_id, kind, json.dumps(payload), json.dumps(errors), now)
+                 for item_id, kind, payload, errors in failed)
+            )
+            connection.executemany('DELETE FROM items WHERE id = ?', ((item_id,) for item_id in item_ids))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def get_stats(self) -> dict:
+        pending = dict(self.connection.execute('SELECT kind, COUNT(*) FROM items GROUP BY kind').fetchall())
+        oldest = self.connection.execute('SELECT MIN(received_at) FROM items').fetchone()[0]
+        failed = self.connection.execute('SELECT COUNT(*) FROM failed_items').fetchone()[0]
+        return {'pending': {kind: pending.get(kind, 0) for kind in KINDS}, 'oldest': oldest, 'failed': failed}
+
+
+@lru_cache(maxsize=None)
+def _get_queue(path: str) -> IngestQueue:
+    return IngestQueue(path)
+
+
+def get_ingest_queue() -> IngestQueue:
+    return _get_queue(settings.RECORDS_INGEST_QUEUE_PATH)
+
+
+def is_queue_mode() -> bool:
+    return settings.RECORDS_INGEST_MODE == 'queue'
@@ -0,0 +1,12 @@
+from rest_framework import renderers
+from .metrics import timed
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer that adds its time to the render phase of the request metrics.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -2,13 +2,38 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import CharField, DateTimeField, DecimalField, ModelSerializer, Serializer
 from .fields import DurationField
 from .models import CallEndRecord, CallStartRecord
+from .services import get_or_create_call_end_record, get_or_create_call_start_record
 
 
 class CallStartRecordSerializer(ModelSerializer):
+    """
+    Serializer for call start records. Records received again are not rejected: create returns the stored one and
+    sets created to False, so the view can tell a retry from a conflicting record.
+    """
+
+    def validate(self, attrs):
+        validated_data = super().validate(attrs)
+        # Call end records received before their start must not be earlier than it, as when they arrive last
+        call_end_record = CallEndRecord.objects.filter(call_id=validated_data['call_id']).first()
+        if call_end_record is not None and call_end_record.timestamp < validated_data['timestamp']:
+            raise ValidationError(
+                {'timestamp': 'Call start record timestamp cannot be later than call end record timestamp.'}
+            )
+        # Kept to complete the call on create, without looking it up again
+        self.call_end_record = call_end_record
+        return attrs
+
+    def create(self, validated_data):
+        call_start_record, self.created = get_or_create_call_start_record(
+            call_end_record=self.call_end_record, **validated_data
+        )
+        return call_start_record
 
     class Meta:
         model = CallStartRecord
         fields = ['id', 'call_id', 'timestamp', 'source', 'destination']
+        # Uniqueness is checked by the insert itself
+        extra_kwargs = {'call_id': {'validators': []}}
 
 
 class CallEndRecordCreateSerializer(ModelSerializer):
@@ -17,18 +42,50 @@ class CallEndRecordCreateSerializer(ModelSerializer):
         validated_data = super().validate(attrs)
         timestamp = validated_data['timestamp']
         call_id = validated_data['call_id']
-        try:
-            call_start_record = CallStartRecord.objects.get(call_id=call_id)
-        except CallStartRecord.DoesNotExist:
-            raise ValidationError({'call_id': 'Given call_id does not exist.'})
-        if timestamp < call_start_record.timestamp:
+        # Records may arrive in any order, call end records without call start record are stored unpaired
+        call_start_record = CallStartRecord.objects.filter(call_id=call_id).first()
+        if call_start_record is not None and timestamp < call_start_record.timestamp:
             raise ValidationError({'timestamp': 'Call end record timestamp cannot be earlier than call start record timestamp.'})
+        # Kept to price the call end record on create, without looking it up again
+        self.call_start_record = call_start_record
         return attrs
 
+    def create(self, validated_data):
+        call_end_record, self.created = get_or_create_call_end_record(
+            call_start_record=self.call_start_record, **validated_data
+        )
+        return call_end_record
+
+    class Meta:
+        model = CallEndRecord
+        fields = ['id', 'call_id', 'timestamp', 'price']
+        read_only_fields = ['price']
+        extra_kwargs = {'call_id': {'validators': []}}
+
+
+class CallStartRecordBatchSerializer(CallStartRecordSerializer):
+    """
+    Serializer for call start records received in batch. Uniqueness of call_id is checked, and call end records are
+    looked up, once for the whole batch.
+    """
+
+    def validate(self, attrs):
+        return attrs
+
+    class Meta(CallStartRecordSerializer.Meta):
+        extra_kwargs = {'call_id': {'validators': []}}
+
+
+class CallEndRecordBatchSerializer(ModelSerializer):
+    """
+    Serializer for call end records received in batch. Call start records are looked up once for the whole batch.
+    """
+
     class Meta:
         model = CallEndRecord
         fields = ['id', 'call_id', 'timestamp', 'price']
         read_only_fields = ['price']
+        extra_kwargs = {'call_id': {'validators': []}}
 
 
 class CallRecordSerializer(Serializer):
@@ -0,0 +1,447 @@
+"""
+Ingestion of call records. Call end records are priced and calls are completed here, with the records each caller
+already loaded, instead of model signals that would look them up again for every saved record.
+"""
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Exists, Min, OuterRef
+from rest_framework.exceptions import ValidationError
+from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
+from .billing import add_usage, get_usage_key, invalidate_bills, lock_usage
+from .compact import register_call_ids
+from .metrics import timed
+from .models import CallEndRecord, CallStartRecord, CompletedCall
+from .utils import calculate_call_rate, price_calls, to_datetime64
+
+# Default of create_call_end_record meaning the call start record was not looked up by the caller
+LOOKUP = object()
+
+
+def chunked(items: list, size: int = None):
+    """
+    Split items in chunks that fit in one query. Defaults to the maximum number of query params of the database.
+    """
+    size = size or connection.features.max_query_params or len(items) or 1
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def get_existing_call_ids(model, call_ids) -> set:
+    existing_call_ids = set()
+    for chunk in chunked(list(call_ids)):
+        existing_call_ids.update(model.objects.filter(call_id__in=chunk).values_list('call_id', flat=True))
+    return existing_call_ids
+
+
+def get_records_by_call_id(model, call_ids) -> dict:
+    records = {}
+    for chunk in chunked(list(call_ids)):
+        records.update((record.call_id, record) for record in model.objects.filter(call_id__in=chunk))
+    return records
+
+
+def get_call_start_records(call_ids) -> dict:
+    return get_records_by_call_id(CallStartRecord, call_ids)
+
+
+def price_call_end_records(pairs: list):
+    """
+    Set the price of the call end records of (call start record, call end record) pairs. Batches are priced at once
+    with the vectorized pricer.
+    """
+    with timed('pricing'):
+        if len(pairs) == 1:
+            call_start_record, call_end_record = pairs[0]
+            call_end_record.price = calculate_call_rate(call_start_record.timestamp, call_end_record.timestamp)
+        elif pairs:
+            prices = price_calls(
+                to_datetime64(call_start_record.timestamp for call_start_record, _ in pairs),
+                to_datetime64(call_end_record.timestamp for _, call_end_record in pairs)
+            )
+            for (_, call_end_record), price in zip(pairs, prices):
+                call_end_record.price = price
+
+
+def complete_pairs(pairs: list) -> list:
+    """
+    Store (call start record, call end record) pairs as completed calls, pricing the call end records that could not
+    be priced when they were received, and add them to the usage of their source. Pairs whose end is earlier than the
+    start, which ingestion rejects, are skipped and stay unpaired, see get_misordered_call_end_records. Returns the
+    calls completed here.
+    """
+    pairs = [pair for pair in pairs if pair[1].timestamp >= pair[0].timestamp]
+    unpriced_pairs = [pair for pair in pairs if pair[1].price is None]
+    price_call_end_records(unpriced_pairs)
+    completed_calls = [
+        CompletedCall(
+            call_id=call_end_record.call_id,
+            source=call_start_record.source,
+            destination=call_start_record.destination,
+            start=call_start_record.timestamp,
+            end=call_end_record.timestamp,
+            duration=call_end_record.timestamp - call_start_record.timestamp,
+            price=call_end_record.price
+        )
+        for call_start_record, call_end_record in pairs
+    ]
+    if not completed_calls:
+        return []
+    with transaction.atomic():
+        if unpriced_pairs:
+            CallEndRecord.objects.bulk_update([call_end_record for _, call_end_record in unpriced_pairs], ['price'])
+        # Calls completed by a concurrent request are looked up once their usage is locked, and kept as they are
+        usage = lock_usage(map(get_usage_key, completed_calls))
+        stored_call_ids = get_existing_call_ids(CompletedCall, [call.call_id for call in completed_calls])
+        completed_calls = [call for call in completed_calls if call.call_id not in stored_call_ids]
+        CompletedCall.objects.bulk_create(completed_calls, ignore_conflicts=True)
+        add_usage(usage, completed_calls)
+        invalidate_bills(completed_calls)
+    return completed_calls
+
+
+def complete_calls(call_ids) -> list:
+    """
+    Look up the records of the given calls and store the ones whose start and end records were both received as
+    completed calls. Calls already completed are skipped.
+    """
+    call_ids = set(call_ids)
+    call_ids -= get_existing_call_ids(CompletedCall, call_ids)
+    if not call_ids:
+        return []
+    call_start_records = get_call_start_records(call_ids)
+    call_end_records = get_records_by_call_id(CallEndRecord, call_start_records.keys())
+    return complete_pairs([
+        (call_start_records[call_id], call_end_record) for call_id, call_end_record in call_end_records.items()
+    ])
+
+
+def insert_or_get_record(record) -> tuple:
+    """
+    Insert a call record unless a record of its type with the same call id is stored. Returns the stored record and
+    whether it was inserted. PostgreSQL does both in one round trip with INSERT ... ON CONFLICT, without raising and
+    rolling back an IntegrityError for retried records; other databases look the record up first.
+    """
+    model = type(record)
+    register_call_ids([record.call_id], connection)
+    if connection.vendor != 'postgresql':
+        stored = model.objects.filter(call_id=record.call_id).first()
+        if stored is not None:
+            return stored, False
+        try:
+            with transaction.atomic():
+                record.save(force_insert=True)
+        except IntegrityError:
+            # Inserted by a concurrent request since the lookup
+            return model.objects.get(call_id=record.call_id), False
+        return record, True
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = model._meta.concrete_fields
+    inserted_fields = [field for field in fields if not field.primary_key]
+    columns = ', '.join(quote(field.column) for field in fields)
+    inserted_columns = ', '.join(quote(field.column) for field in inserted_fields)
+    placeholders = ', '.join(['%s'] * len(inserted_fields))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH inserted AS (INSERT INTO {table} ({inserted_columns}) VALUES ({placeholders}) '
+            f'ON CONFLICT (call_id) DO NOTHING RETURNING {columns}) '
+            f'SELECT true, {columns} FROM inserted '
+            f'UNION ALL SELECT false, {columns} FROM {table} '
+            'WHERE call_id = %s AND NOT EXISTS (SELECT 1 FROM inserted)',
+            [field.get_db_prep_save(field.pre_save(record, True), connection) for field in inserted_fields]
+            + [model._meta.get_field('call_id').get_db_prep_value(record.call_id, connection)]
+        )
+        row = cursor.fetchone()
+    if row is None:
+        # Inserted by a concurrent transaction committed after this statement started
+        return model.objects.get(call_id=record.call_id), False
+    # Values are converted as the ORM does, e.g. call ids and phone numbers of the compact storage
+    values = [field.from_db_value(value, None, connection) if hasattr(field, 'from_db_value') else value
+              for field, value in zip(fields, row[1:])]
+    return model.from_db(connection.alias, [field.attname for field in fields], values), row[0]
+
+
+def is_same_record(record, data: dict) -> bool:
+    """
+    Whether a stored record has the given values, i.e. it was received again.
+    """
+    return all(getattr(record, field) == value for field, value in data.items())
+
+
+def _complete_started_call(call_start_record: CallStartRecord, call_end_record=LOOKUP):
+    if call_end_record is LOOKUP:
+        call_end_record = CallEndRecord.objects.filter(call_id=call_start_record.call_id).first()
+    if call_end_record is not None:
+        complete_pairs([(call_start_record, call_end_record)])
+
+
+def create_call_start_record(**data) -> CallStartRecord:
+    """
+    Store a call start record, completing its call if the call end record was received before.
+    """
+    register_call_ids([data['call_id']], connection)
+    call_start_record = CallStartRecord.objects.create(**data)
+    _complete_started_call(call_start_record)
+    return call_start_record
+
+
+def get_or_create_call_start_record(call_end_record=LOOKUP, **data) -> tuple:
+    """
+    Idempotent version of create_call_start_record, for records that may be received again. Returns the stored call
+    start record and whether it was created. Callers that already looked the call end record up to validate the call
+    start record should give it, even if it is None.
+    """
+    call_start_record, created = insert_or_get_record(CallStartRecord(**data))
+    if created:
+        _complete_started_call(call_start_record, call_end_record)
+    return call_start_record, created
+
+
+def create_call_end_record(call_start_record=LOOKUP, **data) -> CallEndRecord:
+    """
+    Store a call end record, pricing and completing its call if the call start record was received. Callers that
+    already looked the call start record up to validate the call end record should give it, even if it is None.
+    Call end records received before their start are stored unpaired, to be completed by the call start record.
+    """
+    call_end_record = CallEndRecord(**data)
+    register_call_ids([call_end_record.call_id], connection)
+    if call_start_record is LOOKUP:
+        call_start_record = CallStartRecord.objects.filter(call_id=call_end_record.call_id).first()
+    if call_start_record is None:
+        call_end_record.save()
+        return call_end_record
+    price_call_end_records([(call_start_record, call_end_record)])
+    call_end_record.save()
+    complete_pairs([(call_start_record, call_end_record)])
+    return call_end_record
+
+
+def get_or_create_call_end_record(call_start_record=LOOKUP, **data) -> tuple:
+    """
+    Idempotent version of create_call_end_record, for records that may be received again. Returns the stored call
+    end record and whether it was created.
+    """
+    call_end_record = CallEndRecord(**data)
+    if call_start_record is LOOKUP:
+        call_start_record = CallStartRecord.objects.filter(call_id=call_end_record.call_id).first()
+    if call_start_record is not None:
+        price_call_end_records([(call_start_record, call_end_record)])
+    call_end_record, created = insert_or_get_record(call_end_record)
+    if created and call_start_record is not None:
+        complete_pairs([(call_start_record, call_end_record)])
+    return call_end_record, created
+
+
+def get_unpaired_call_end_records():
+    """
+    Call end records waiting for their call start record. They are the only unpriced ones and are covered by a
+    partial index.
+    """
+    return CallEndRecord.objects.filter(price__isnull=True)
+
+
+def get_misordered_call_end_records():
+    """
+    Unpaired call end records earlier than their call start record, e.g. stored before such records were rejected.
+    Their calls can't be completed, so reconcile_calls leaves them out.
+    """
+    later_start = Exists(
+        CallStartRecord.objects.filter(call_id=OuterRef('call_id'), timestamp__gt=OuterRef('timestamp'))
+    )
+    return get_unpaired_call_end_records().annotate(later_start=later_start).filter(later_start=True)
+
+
+def get_unpaired_backlog() -> dict:
+    backlog = get_unpaired_call_end_records().aggregate(size=Count('pk'), oldest=Min('timestamp'))
+    return {'size': backlog['size'], 'oldest': backlog['oldest']}
+
+
+def reconcile_calls(chunk_size: int = 5000) -> int:
+    """
+    Complete the unpaired call end records whose call start record has arrived since, in chunks. Catches the pairs
+    missed when both records of a call are received at the same time. Misordered pairs are left out, as they can't be
+    completed. Returns the number of completed calls.
+    """
+    has_start = Exists(
+        CallStartRecord.objects.filter(call_id=OuterRef('call_id'), timestamp__lte=OuterRef('timestamp'))
+    )
+    queryset = get_unpaired_call_end_records().annotate(has_start=has_start).filter(has_start=True).order_by('pk')
+    completed = 0
+    last_pk = 0
+    while True:
+        call_end_records = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not call_end_records:
+            return completed
+        call_start_records = get_call_start_records(record.call_id for record in call_end_records)
+        completed += len(complete_pairs([
+            (call_start_records[record.call_id], record)
+            for record in call_end_records if record.call_id in call_start_records
+        ]))
+        last_pk = call_end_records[-1].pk
+
+
+def _created_result(data) -> dict:
+    return {'status': HTTP_201_CREATED, 'data': data}
+
+
+def _error_result(errors) -> dict:
+    return {'status': HTTP_400_BAD_REQUEST, 'errors': errors}
+
+
+def _unique_call_id_message(model) -> str:
+    field = model._meta.get_field('call_id')
+    return field.error_messages['unique'] % {
+        'model_name': model._meta.verbose_name,
+        'field_label': field.verbose_name
+    }
+
+
+def _validate_items(serializer, items: list, results: list) -> list:
+    """
+    Run serializer validation on every item, reusing the same serializer instance. Returns (index, attrs) pairs of
+    valid items and stores the errors of invalid ones in results.
+    """
+    validated = []
+    for index, item in enumerate(items):
+        try:
+            validated.append((index, serializer.run_validation(item)))
+        except ValidationError as exc:
+            results[index] = _error_result(exc.detail)
+    return validated
+
+
+def _exclude_duplicates(model, validated: list, results: list) -> list:
+    """
+    Reject items whose call_id is repeated in the batch or already stored, using one lookup for the whole batch.
+    """
+    existing_call_ids = get_existing_call_ids(model, {attrs['call_id'] for _, attrs in validated})
+    message = _unique_call_id_message(model)
+    remaining = []
+    for index, attrs in validated:
+        if attrs['call_id'] in existing_call_ids:
+            results[index] = _error_result({'call_id': [message]})
+            continue
+        existing_call_ids.add(attrs['call_id'])
+        remaining.append((index, attrs))
+    return remaining
+
+
+def _bulk_insert(model, validated: list, results: list, build_records) -> list:
+    """
+    Insert valid items with bulk_create. If a concurrent request inserts one of the call_ids between the duplicate
+    check and the insert, duplicates are checked again and the insert is retried once.
+    """
+    for attempt in range(2):
+        validated = _exclude_duplicates(model, validated, results)
+        validated, records = build_records(validated)
+        try:
+            with transaction.atomic():
+                register_call_ids([record.call_id for record in records], connection)
+                model.objects.bulk_create(records)
+        except IntegrityError:
+            if attempt:
+                raise
+        else:
+            return list(zip((index for index, _ in validated), records))
+    return []
+
+
+def create_call_start_records(items: list, serializer) -> list:
+    """
+    Validate items with the given serializer and store a batch of call start records, completing the calls whose
+    end records were received before. Returns one result per item, in the same order.
+    """
+    results = [None] * len(items)
+    validated = _validate_items(serializer, items, results)
+
+    call_end_records = {}
+
+    def build_records(validated):
+        call_end_records.update(get_records_by_call_id(CallEndRecord, {attrs['call_id'] for _, attrs in validated}))
+        remaining, records = [], []
+        for index, attrs in validated:
+            call_end_record = call_end_records.get(attrs['call_id'])
+            if call_end_record is not None and call_end_record.timestamp < attrs['timestamp']:
+                results[index] = _error_result({
+                    'timestamp': ['Call start record timestamp cannot be later than call end record timestamp.']
+                })
+                continue
+            remaining.append((index, attrs))
+            records.append(CallStartRecord(**attrs))
+        return remaining, records
+
+    created = _bulk_insert(CallStartRecord, validated, results, build_records)
+    # Call end records stored since the lookup are completed too
+    call_end_records.update(get_records_by_call_id(
+        CallEndRecord, [record.call_id for _, record in created if record.call_id not in call_end_records]
+    ))
+    complete_pairs([
+        (record, call_end_records[record.call_id]) for _, record in created if record.call_id in call_end_records
+    ])
+    for index, record in created:
+        results[index] = _created_result(serializer.to_representation(record))
+    return results
+
+
+def create_call_end_records(items: list, serializer) -> list:
+    """
+    Validate items with the given serializer and store a batch of call end records, pricing and completing the calls
+    whose start record was received. Call start records are looked up once for the whole batch. Returns one result
+    per item, in the same order.
+    """
+    results = [None] * len(items)
+    validated = _validate_items(serializer, items, results)
+    call_start_records = {}
+
+    def build_records(validated):
+        call_start_records.update(get_call_start_records({attrs['call_id'] for _, attrs in validated}))
+        remaining, records, pairs = [], [], []
+        for index, attrs in validated:
+            call_end_record = CallEndRecord(**attrs)
+            call_start_record = call_start_records.get(attrs['call_id'])
+            if call_start_record is not None:
+                if attrs['timestamp'] < call_start_record.timestamp:
+                    results[index] = _error_result({
+                        'timestamp': ['Call end record timestamp cannot be earlier than call start record timestamp.']
+                    })
+                    continue
+                pairs.append((call_start_record, call_end_record))
+            remaining.append((index, attrs))
+            records.append(call_end_record)
+        price_call_end_records(pairs)
+        return remaining, records
+
+    created = _bulk_insert(CallEndRecord, validated, results, build_records)
+    complete_pairs([
+        (call_start_records[record.call_id], record) for _, record in created if record.call_id in call_start_records
+    ])
+    for index, record in created:
+        results[index] = _created_result(serializer.to_representation(record))
+    return results
+
+
+def drain_queue_batch(queue, kind: str, model, create_records, serializer, size: int):
+    """
+    Store one batch of queued records of a kind with the given batch function and serializer, then acknowledge it.
+    Records whose call_id is already stored were delivered before and are only acknowledged, as are repeated copies
+    of a record in the batch, so delivering a record more than once is harmless. Records rejected on validation are
+    kept apart as failed. Returns (stored, failed) counts, or None if there is nothing to drain.
+    """
+    batch = queue.get_batch(kind, size)
+    if not batch:
+        return None
+    delivered = get_existing_call_ids(model, {payload.get('call_id') for _, payload in batch})
+    received = {}
+    pending = []
+    for item_id, payload in batch:
+        call_id = payload.get('call_id')
+        if call_id in delivered or received.get(call_id) == payload:
+            continue
+        received.setdefault(call_id, payload)
+        pending.append((item_id, payload))
+    results = create_records([payload for _, payload in pending], serializer) if pending else []
+    failed = [
+        (item_id, kind, payload, result['errors'])
+        for (item_id, payload), result in zip(pending, results) if result['status'] != HTTP_201_CREATED
+    ]
+    queue.ack([item_id for item_id, _ in batch], failed)
+    return len(pending) - len(failed), len(failed)
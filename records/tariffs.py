@@ -0,0 +1,178 @@
+"""
+Tariffs compiled for pricing. Tariffs are compiled into a table sorted by the moment they are in effect from, so the
+tariff of a call is found with a binary search on its start. Each process keeps its table and reloads it when tariffs
+change, which is checked at most once every RECORDS_TARIFF_RELOAD_INTERVAL seconds, so pricing a call doesn't query
+the database.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time as time_of_day, timezone
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from .models import Tariff, TariffBand
+
+MICROSECONDS_PER_SECOND = 1000000
+MICROSECONDS_PER_DAY = 24 * 60 * 60 * MICROSECONDS_PER_SECOND
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_ORDINAL = EPOCH.toordinal()
+# Band of the settings tariff, from 06:00 to 22:00. Calls are free of charge in the rest of the day.
+STANDARD_TIME = (time_of_day(6), time_of_day(22))
+
+Band = namedtuple('Band', ['start', 'length', 'minute_rate', 'scaled_minute_rate'])
+CompiledTariff = namedtuple(
+    'CompiledTariff', ['effective_from', 'connection_fee', 'bands', 'exponent', 'scaled_connection_fee']
+)
+
+
+def split_moment(moment: datetime) -> tuple:
+    """
+    Days from the epoch until the given moment and microseconds elapsed in its day, in UTC. Naive datetimes are taken
+    as UTC.
+    """
+    offset = moment.utcoffset()
+    if offset:
+        moment = moment - offset
+    time_of_day = ((moment.hour * 60 + moment.minute) * 60 + moment.second) * MICROSECONDS_PER_SECOND
+    return moment.toordinal() - EPOCH_ORDINAL, time_of_day + moment.microsecond
+
+
+def to_microseconds(moment: datetime) -> int:
+    """
+    Microseconds from the epoch until the given moment. Naive datetimes are taken as UTC.
+    """
+    days, time_of_day = split_moment(moment)
+    return days * MICROSECONDS_PER_DAY + time_of_day
+
+
+def time_to_microseconds(value: time_of_day) -> int:
+    """
+    Microseconds of the day elapsed until the given time.
+    """
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * MICROSECONDS_PER_SECOND + value.microsecond
+
+
+def compile_tariff(effective_from, connection_fee: Decimal, bands) -> CompiledTariff:
+    """
+    Compile a tariff given its bands as (start, end, minute_rate) tuples. Rates are also scaled to integers with a
+    common exponent, for exact vectorized pricing. Raises ValueError if a band ends before it starts or bands overlap.
+    """
+    compiled_bands = []
+    for start, end, minute_rate in sorted(bands):
+        start = time_to_microseconds(start)
+        end = time_to_microseconds(end) or MICROSECONDS_PER_DAY
+        if start >= end:
+            raise ValueError('Band start must be earlier than its end.')
+        if compiled_bands and start < compiled_bands[-1].start + compiled_bands[-1].length:
+            raise ValueError('Bands must not overlap.')
+        compiled_bands.append(Band(start, end - start, minute_rate, None))
+    exponent = min([connection_fee.as_tuple().exponent, -2] + [band.minute_rate.as_tuple().exponent
+                                                             for band in compiled_bands])
+    return CompiledTariff(
+        effective_from=to_microseconds(effective_from) if effective_from is not None else None,
+        connection_fee=connection_fee,
+        bands=tuple(band._replace(scaled_minute_rate=int(band.minute_rate.scaleb(-exponent)))
+                    for band in compiled_bands),
+        exponent=exponent,
+        scaled_connection_fee=int(connection_fee.scaleb(-exponent))
+    )
+
+
+def get_settings_tariff() -> CompiledTariff:
+    return compile_tariff(None, Decimal(str(settings.CONNECTION_FEE)),
+                          [(*STANDARD_TIME, Decimal(str(settings.MINUTE_RATE)))])
+
+
+class TariffTable:
+    """
+    Tariffs sorted by the moment they are in effect from, after the settings tariff, which applies before them.
+    """
+
+    def __init__(self, tariffs: list):
+        self.tariffs = [get_settings_tariff(), *tariffs]
+        self.effective_froms = [tariff.effective_from for tariff in tariffs]
+        self._effective_froms = np.array(self.effective_froms, dtype=np.int64)
+
+    def get_tariff(self, moment: int) -> CompiledTariff:
+        """
+        Return the tariff in effect at the given moment, in epoch microseconds.
+        """
+        return self.tariffs[bisect_right(self.effective_froms, moment)]
+
+    def get_tariff_indexes(self, moments: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of get_tariff, which returns the index of the tariff of each moment in tariffs.
+        """
+        return np.searchsorted(self._effective_froms, moments, side='right')
+
+
+class TariffTableLoader:
+
+    def __init__(self):
+        self._table = None
+        self._signature = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+
+    def get_signature(self) -> tuple:
+        signature = Tariff.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+        return signature['count'], signature['updated_at']
+
+    def load(self) -> TariffTable:
+        bands = {}
+        for band in TariffBand.objects.all():
+            bands.setdefault(band.tariff_id, []).append((band.start, band.end, band.minute_rate))
+        return TariffTable([
+            compile_tariff(tariff.effective_from, tariff.connection_fee, bands.get(tariff.pk, ()))
+            for tariff in Tariff.objects.order_by('effective_from')
+        ])
+
+    def get(self) -> TariffTable:
+        table = self._table
+        if table is not None and time.monotonic() < self._next_check:
+            return table
+        with self._lock:
+            if self._table is None or time.monotonic() >= self._next_check:
+                signature = self.get_signature()
+                if self._table is None or signature != self._signature:
+                    self._table = self.load()
+                    self._signature = signature
+                self._next_check = time.monotonic() + settings.RECORDS_TARIFF_RELOAD_INTERVAL
+        return self._table
+
+    def reload(self):
+        with self._lock:
+            self._table = None
+
+
+_loader = TariffTableLoader()
+
+
+def get_tariff_table() -> TariffTable:
+    return _loader.get()
+
+
+def reload_tariffs():
+    """
+    Load the tariffs again in this process. Other processes load them in the next check.
+    """
+    _loader.reload()
+
+
+def create_tariff(effective_from: datetime, connection_fee: Decimal, bands) -> Tariff:
+    """
+    Create a tariff in effect from the given moment with its bands, given as (start, end, minute_rate) tuples.
+    """
+    compile_tariff(effective_from, connection_fee, bands)
+    with transaction.atomic():
+        tariff = Tariff.objects.create(effective_from=effective_from, connection_fee=connection_fee)
+        TariffBand.objects.bulk_create(
+            TariffBand(tariff=tariff, start=start, end=end, minute_rate=minute_rate)
+            for start, end, minute_rate in bands
+        )
+    reload_tariffs()
+    return tariff
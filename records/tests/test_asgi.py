@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from django.core.wsgi import get_wsgi_application
+from django.test import SimpleTestCase
+from records.asgi import ThreadedASGIHandler, build_environ
+
+
+def run_request(handler, path='/', method='GET', body=b'', headers=()):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'source=9998852642',
+             'headers': list(headers), 'http_version': '1.1', 'server': ('testserver', 80)}
+    messages = [{'type': 'http.request', 'body': body[:1], 'more_body': True},
+                {'type': 'http.request', 'body': body[1:]}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await handler(scope, receive, send)
+
+    return run(), sent
+
+
+class ThreadedASGIHandlerTestCase(SimpleTestCase):
+
+    def test_build_environ(self):
+        environ = build_environ({
+            'type': 'http', 'method': 'POST', 'path': '/v1/call-records/started/', 'query_string': b'a=1',
+            'headers': [(b'content-type', b'application/json'), (b'x-forwarded-for', b'1.1.1.1'),
+                        (b'x-forwarded-for', b'2.2.2.2')],
+            'client': ('127.0.0.1', 5000)
+        }, b'{}')
+        self.assertEqual(environ['PATH_INFO'], '/v1/call-records/started/')
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['HTTP_X_FORWARDED_FOR'], '1.1.1.1,2.2.2.2')
+        self.assertEqual(environ['REMOTE_ADDR'], '127.0.0.1')
+        self.assertEqual(environ['wsgi.input'].read(), b'{}')
+
+    def test_wsgi_application_runs_in_thread(self):
+        threads = []
+
+        def wsgi_application(environ, start_response):
+            threads.append(threading.current_thread())
+            start_response('201 Created', [('Content-Type', 'text/plain')])
+            return [environ['wsgi.input'].read()]
+
+        coroutine, sent = run_request(ThreadedASGIHandler(wsgi_application), method='POST', body=b'payload')
+        asyncio.run(coroutine)
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertListEqual(sent, [
+            {'type': 'http.response.start', 'status': 201, 'headers': [(b'content-type', b'text/plain')]},
+            {'type': 'http.response.body', 'body': b'payload'},
+        ])
+
+    def test_large_bodies_are_streamed(self):
+        def wsgi_application(environ, start_response):
+            start_response('200 OK', [])
+            return (b'x' * 40000 for _ in range(3))
+
+        coroutine, sent = run_request(ThreadedASGIHandler(wsgi_application))
+        asyncio.run(coroutine)
+        self.assertListEqual([len(message.get('body', b'')) for message in sent], [0, 80000, 40000])
+        self.assertTrue(sent[1]['more_body'])
+
+    def test_concurrency_is_bounded(self):
+        release = threading.Event()
+        running = []
+
+        def wsgi_application(environ, start_response):
+            running.append(environ['PATH_INFO'])
+            release.wait(5)
+            start_response('200 OK', [])
+            return [b'']
+
+        handler = ThreadedASGIHandler(wsgi_application, max_concurrency=1, queue_timeout=0.05)
+        first, first_sent = run_request(handler, '/first')
+        second, second_sent = run_request(handler, '/second')
+
+        async def run():
+            task = asyncio.ensure_future(first)
+            await asyncio.sleep(0.01)
+            await second
+            release.set()
+            await task
+
+        asyncio.run(run())
+        self.assertListEqual(running, ['/first'])
+        self.assertEqual(first_sent[0]['status'], 200)
+        self.assertEqual(second_sent[0]['status'], 503)
+
+    def test_django_application(self):
+        coroutine, sent = run_request(ThreadedASGIHandler(get_wsgi_application()), '/v1/call-records/missing/')
+        asyncio.run(coroutine)
+        self.assertEqual(sent[0]['status'], 404)
@@ -0,0 +1,66 @@
+import threading
+from django.test import SimpleTestCase
+from records.backends.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+
+    def __init__(self, usable=True):
+        self.usable = usable
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.connections = []
+        self.pool = ConnectionPool(self.connect, max_size=2, timeout=0.01)
+
+    def connect(self):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+    def test_released_connections_are_reused(self):
+        connection = self.pool.acquire()
+        self.pool.release(connection)
+        self.assertIs(self.pool.acquire(), connection)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_discarded_connections_are_closed(self):
+        connection = self.pool.acquire()
+        self.pool.release(connection, discard=True)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(self.pool.acquire(), connection)
+
+    def test_unusable_connections_are_replaced(self):
+        connection = self.pool.acquire()
+        connection.usable = False
+        self.pool.release(connection)
+        self.assertIsNot(self.pool.acquire(check=lambda connection: connection.usable), connection)
+        self.assertTrue(connection.closed)
+
+    def test_acquire_waits_for_a_connection(self):
+        connections = [self.pool.acquire(), self.pool.acquire()]
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+        self.pool.timeout = 5
+        threading.Timer(0.01, self.pool.release, [connections[0]]).start()
+        self.assertIs(self.pool.acquire(), connections[0])
+        self.assertEqual(len(self.connections), 2)
+
+    def test_failed_connect_releases_its_slot(self):
+        self.pool.connect = lambda: 1 / 0
+        for _ in range(3):
+            with self.assertRaises(ZeroDivisionError):
+                self.pool.acquire()
+
+    def test_close(self):
+        connection = self.pool.acquire()
+        self.pool.release(connection)
+        self.pool.close()
+        self.assertTrue(connection.closed)
+        self.assertDictEqual(self.pool.get_stats(), {'idle': 0, 'max_size': 2})
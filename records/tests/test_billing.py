@@ -0,0 +1,163 @@
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import skipUnless
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from records.billing import generate_bill, get_bill, get_bill_version, get_usage
+from records.models import BillLine, CallEndRecord, CallStartRecord, DetachedPeriod, MonthlyBill, MonthlyUsage
+from records.services import complete_calls, complete_pairs, create_call_end_record, create_call_start_record
+
+
+@freeze_time('2020-02-01')
+class MonthlyBillTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.source = '9998852642'
+        cls.from_date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        cls.to_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        for day in range(1, 4):
+            cls.create_call(timezone.now().replace(month=1, day=day, hour=12))
+        # Calls of other period and other source are not billed
+        cls.create_call(timezone.now().replace(hour=12) - timedelta(days=40))
+        cls.create_call(timezone.now().replace(month=1, day=5, hour=12), source='1234567890')
+
+    @classmethod
+    def create_call(cls, start, source=None, minutes=5):
+        call_id = str(uuid.uuid4())
+        create_call_start_record(call_id=call_id, timestamp=start, source=source or cls.source,
+                                 destination='9993468278')
+        create_call_end_record(call_id=call_id, timestamp=start + timedelta(minutes=minutes))
+
+    def test_get_bill_generates_snapshot(self):
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        self.assertEqual(bill.period, self.from_date.date())
+        self.assertEqual(bill.call_count, 3)
+        self.assertEqual(bill.total, Decimal('2.43'))
+        self.assertEqual(bill.lines.count(), 3)
+        self.assertFalse(bill.is_stale)
+
+    def test_generate_bill_in_chunks(self):
+        bill = generate_bill(self.source, self.from_date, self.to_date, chunk_size=2)
+        self.assertEqual((bill.call_count, bill.total), (3, Decimal('2.43')))
+        self.assertEqual(bill.lines.count(), 3)
+
+    def test_bill_without_calls_is_not_stored(self):
+        bill = get_bill('1111111111', self.from_date, self.to_date)
+        self.assertEqual((bill.pk, bill.call_count, bill.total, bill.version), (None, 0, 0, 0))
+        self.assertFalse(MonthlyBill.objects.exists())
+
+    def test_get_bill_reuses_snapshot(self):
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_bill(self.source, self.from_date, self.to_date).pk, bill.pk)
+        self.assertEqual(MonthlyBill.objects.count(), 1)
+
+    def test_late_call_refreshes_snapshot(self):
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        self.create_call(timezone.now().replace(month=1, day=20, hour=12), minutes=10)
+        bill.refresh_from_db()
+        self.assertTrue(bill.is_stale)
+        self.assertEqual(bill.version, 2)
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        self.assertFalse(bill.is_stale)
+        self.assertEqual(bill.call_count, 4)
+        self.assertEqual(bill.total, Decimal('3.69'))
+        self.assertEqual(BillLine.objects.count(), 4)
+
+    def test_bill_of_detached_period_is_kept(self):
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        DetachedPeriod.objects.create(period=self.from_date.date())
+        self.create_call(timezone.now().replace(month=1, day=20, hour=12), minutes=10)
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        self.assertEqual((bill.call_count, bill.version, bill.is_stale), (3, 2, False))
+        self.assertEqual(BillLine.objects.count(), 3)
+
+    def test_get_bill_version(self):
+        self.assertIsNone(get_bill_version(self.source, self.from_date))
+        get_bill(self.source, self.from_date, self.to_date)
+        self.assertEqual(get_bill_version(self.source, self.from_date), 1)
+        self.create_call(timezone.now().replace(month=1, day=20, hour=12))
+        # Stale bills have to be generated again
+        self.assertIsNone(get_bill_version(self.source, self.from_date))
+
+    def test_current_period_call_does_not_refresh_snapshot(self):
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        self.create_call(timezone.now().replace(hour=12))
+        bill.refresh_from_db()
+        self.assertFalse(bill.is_stale)
+        self.assertEqual(bill.version, 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SQLite locks the tables written in transactions of other connections.')
+@freeze_time('2020-02-01')
+@override_settings(RECORDS_BILL_DATABASE='replica')
+class ReplicaBillTestCase(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.source = '9998852642'
+        self.from_date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.to_date = datetime(2020, 2, 1, tzinfo=timezone.utc)
+        start = datetime(2020, 1, 10, 12, tzinfo=timezone.utc)
+        call_id = str(uuid.uuid4())
+        create_call_start_record(call_id=call_id, timestamp=start, source=self.source, destination='9993468278')
+        create_call_end_record(call_id=call_id, timestamp=start + timedelta(minutes=5))
+
+    def test_bills_are_read_from_bill_database(self):
+        bill = get_bill(self.source, self.from_date, self.to_date)
+        with self.assertNumQueries(0, using='default'), self.assertNumQueries(1, using='replica'):
+            self.assertEqual(get_bill(self.source, self.from_date, self.to_date).pk, bill.pk)
+        with self.assertNumQueries(0, using='default'), self.assertNumQueries(1, using='replica'):
+            self.assertEqual(get_bill_version(self.source, self.from_date), bill.version)
+
+    def test_bill_is_generated_once_while_replica_lags(self):
+        get_bill(self.source, self.from_date, self.to_date)
+        MonthlyBill.objects.update(is_stale=True)
+        # The replica only sees the bill generated again once its transaction is committed, as if it lagged behind
+        with transaction.atomic():
+            bill = get_bill(self.source, self.from_date, self.to_date)
+            self.assertTrue(MonthlyBill.objects.using('replica').get().is_stale)
+            with self.assertNumQueries(1, using='default'), self.assertNumQueries(1, using='replica'):
+                self.assertEqual(get_bill(self.source, self.from_date, self.to_date).pk, bill.pk)
+        self.assertEqual(BillLine.objects.count(), 1)
+
+
+@freeze_time('2020-02-01')
+class MonthlyUsageTestCase(TestCase):
+
+    def setUp(self):
+        self.source = '9998852642'
+        self.from_date = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def create_call(self, start, minutes):
+        call_id = str(uuid.uuid4())
+        create_call_start_record(call_id=call_id, timestamp=start, source=self.source, destination='9993468278')
+        create_call_end_record(call_id=call_id, timestamp=start + timedelta(minutes=minutes, seconds=30))
+        return call_id
+
+    def test_completed_calls_are_added_to_usage(self):
+        self.create_call(datetime(2020, 1, 10, 12, tzinfo=timezone.utc), minutes=5)
+        # Call from 21:50 to 22:20, of which 10 minutes are in standard time
+        self.create_call(datetime(2020, 1, 10, 21, 50, tzinfo=timezone.utc), minutes=30)
+        usage = get_usage(self.source, self.from_date)
+        self.assertEqual(usage.call_count, 2)
+        self.assertEqual(usage.total, Decimal('2.07'))
+        self.assertEqual(usage.billable_minutes, 15)
+        self.assertEqual(usage.standard_seconds, 5 * 60 + 30 + 10 * 60)
+        self.assertEqual(usage.reduced_seconds, 20 * 60 + 30)
+
+    def test_calls_are_added_to_usage_once(self):
+        call_id = self.create_call(datetime(2020, 1, 10, 12, tzinfo=timezone.utc), minutes=5)
+        self.assertListEqual(complete_calls([call_id]), [])
+        self.assertListEqual(complete_pairs([(CallStartRecord.objects.get(call_id=call_id),
+                                              CallEndRecord.objects.get(call_id=call_id))]), [])
+        self.assertEqual(MonthlyUsage.objects.get(source=self.source).call_count, 1)
+
+    def test_usage_without_calls(self):
+        usage = get_usage(self.source, self.from_date)
+        self.assertIsNone(usage.pk)
+        self.assertEqual(usage.call_count, 0)
@@ -0,0 +1,45 @@
+from datetime import date
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase
+from records.cache import BillCache
+
+
+class BillCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = BillCache(max_entries=2)
+        self.period = date(2020, 1, 1)
+
+    def key(self, source='9998852642', version=1, params='page=1'):
+        return source, self.period, version, params
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get(self.key()))
+        self.cache.set(self.key(), {'count': 1})
+        self.assertDictEqual(self.cache.get(self.key()), {'count': 1})
+        self.assertIsNone(self.cache.get(self.key(version=2)))
+        self.assertDictEqual(self.cache.get_stats(), {'entries': 1, 'local_hits': 1, 'shared_hits': 0, 'misses': 2})
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for page in range(1, 4):
+            self.cache.set(self.key(params=f'page={page}'), page)
+            # The first page is kept by reading it
+            self.cache.get(self.key(params='page=1'))
+        self.assertEqual(self.cache.get(self.key(params='page=1')), 1)
+        self.assertIsNone(self.cache.get(self.key(params='page=2')))
+        self.assertEqual(self.cache.get(self.key(params='page=3')), 3)
+
+    def test_invalidate(self):
+        self.cache.set(self.key(), 1)
+        self.cache.set(self.key(source='1234567890'), 2)
+        self.assertEqual(self.cache.invalidate([('9998852642', self.period)]), 1)
+        self.assertIsNone(self.cache.get(self.key()))
+        self.assertEqual(self.cache.get(self.key(source='1234567890')), 2)
+
+    def test_shared_backend(self):
+        backend = LocMemCache('bills', {})
+        BillCache(backend=backend).set(self.key(), {'count': 1})
+        cache = BillCache(backend=backend)
+        self.assertDictEqual(cache.get(self.key()), {'count': 1})
+        self.assertDictEqual(cache.get(self.key()), {'count': 1})
+        self.assertDictEqual(cache.get_stats(), {'entries': 1, 'local_hits': 1, 'shared_hits': 1, 'misses': 0})
@@ -0,0 +1,350 @@
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from django.core.management import CommandError, call_command
+from unittest import skipIf, skipUnless
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from records.billing import USAGE_FIELDS, get_bill
+from records.models import BillLine, CallEndRecord, CompletedCall, DetachedPeriod, MonthlyBill, MonthlyUsage
+from records.partitions import create_partition, detach_partition, get_partitions
+from records.queue import CALL_END, CALL_START, get_ingest_queue
+from records.services import create_call_end_record, create_call_start_record
+from records.tariffs import reload_tariffs
+from records.utils import calculate_call_rate
+
+
+@freeze_time('2020-02-01')
+class RepriceCallsCommandTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().replace(hour=12)
+        cls.records = []
+        for minutes in (1, 30, 600, 3000):
+            call_id = str(uuid.uuid4())
+            start = create_call_start_record(call_id=call_id, timestamp=today - timedelta(days=minutes % 7),
+                                                   source='9998852642', destination='9993468278')
+            end = create_call_end_record(call_id=call_id, timestamp=start.timestamp + timedelta(minutes=minutes))
+            cls.records.append((start, end))
+        # Call end record without call start record is left untouched
+        create_call_end_record(call_id=str(uuid.uuid4()), timestamp=today)
+
+    def test_reprice_calls(self):
+        CallEndRecord.objects.update(price=Decimal('0.01'))
+        out = StringIO()
+        call_command('reprice_calls', chunk_size=3, stdout=out)
+        self.assertIn('Repriced 4 calls, 4 prices changed.', out.getvalue())
+        for start, end in self.records:
+            end.refresh_from_db()
+            self.assertEqual(end.price, calculate_call_rate(start.timestamp, end.timestamp))
+        self.assertEqual(CallEndRecord.objects.filter(price=Decimal('0.01')).count(), 1)
+
+    def test_reprice_calls_dry_run(self):
+        CallEndRecord.objects.update(price=Decimal('0.01'))
+        out = StringIO()
+        call_command('reprice_calls', dry_run=True, stdout=out)
+        self.assertIn('Repriced 4 calls, 4 prices would change.', out.getvalue())
+        self.assertEqual(CallEndRecord.objects.filter(price=Decimal('0.01')).count(), 5)
+
+    def test_reprice_calls_with_invalid_date(self):
+        with self.assertRaises(CommandError):
+            call_command('reprice_calls', from_date='2020-13-01', stdout=StringIO())
+
+
+@freeze_time('2020-02-01')
+class RepriceBilledCallsCommandTestCase(TestCase):
+
+    def test_reprice_calls_updates_bills_and_usage(self):
+        start = timezone.now().replace(month=1, day=10, hour=12)
+        call_id = str(uuid.uuid4())
+        create_call_start_record(call_id=call_id, timestamp=start, source='9998852642', destination='9993468278')
+        create_call_end_record(call_id=call_id, timestamp=start + timedelta(minutes=5))
+        price = CompletedCall.objects.get().price
+        CallEndRecord.objects.update(price=Decimal('0.01'))
+        CompletedCall.objects.update(price=Decimal('0.01'))
+        MonthlyUsage.objects.update(total=Decimal('0.01'))
+        from_date = timezone.now().replace(month=1)
+        self.assertEqual(get_bill('9998852642', from_date, timezone.now()).total, Decimal('0.01'))
+        call_command('reprice_calls', stdout=StringIO())
+        self.assertEqual(CompletedCall.objects.get().price, price)
+        self.assertEqual(MonthlyUsage.objects.get().total, price)
+        bill = get_bill('9998852642', from_date, timezone.now())
+        self.assertEqual((bill.total, bill.version), (price, 2))
+
+
+@freeze_time('2020-02-01')
+class BackfillCompletedCallsCommandTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().replace(hour=12)
+        for minutes in range(1, 6):
+            call_id = str(uuid.uuid4())
+            create_call_start_record(call_id=call_id, timestamp=today, source='9998852642',
+                                           destination='9993468278')
+            create_call_end_record(call_id=call_id, timestamp=today + timedelta(minutes=minutes))
+        create_call_end_record(call_id=str(uuid.uuid4()), timestamp=today)
+
+    def test_backfill_completed_calls(self):
+        CompletedCall.objects.filter(pk__in=CompletedCall.objects.values('pk')[:3]).delete()
+        out = StringIO()
+        call_command('backfill_completed_calls', chunk_size=2, stdout=out)
+        self.assertIn('Backfilled 3 completed calls.', out.getvalue())
+        self.assertEqual(CompletedCall.objects.count(), 5)
+
+
+@freeze_time('2020-02-01')
+class ClosePeriodCommandTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        last_month = timezone.now().replace(month=1, hour=12)
+        for index in range(7):
+            source = f'999885264{index}'
+            for day in range(1, index + 2):
+                call_id = str(uuid.uuid4())
+                start = last_month.replace(day=day)
+                create_call_start_record(call_id=call_id, timestamp=start, source=source,
+                                               destination='9993468278')
+                create_call_end_record(call_id=call_id, timestamp=start + timedelta(minutes=5))
+        # Call of current period is not billed
+        call_id = str(uuid.uuid4())
+        create_call_start_record(call_id=call_id, timestamp=timezone.now(), source='1234567890',
+                                       destination='9993468278')
+        create_call_end_record(call_id=call_id, timestamp=timezone.now() + timedelta(minutes=5))
+
+    def test_close_period(self):
+        out = StringIO()
+        call_command('close_period', period='2020-01', chunk_size=3, stdout=out)
+        self.assertIn('7 bills pending in 3 chunks.', out.getvalue())
+        self.assertIn('Chunk 3/3 done, 7 bills generated.', out.getvalue())
+        self.assertEqual(MonthlyBill.objects.count(), 7)
+        self.assertEqual(BillLine.objects.count(), 28)
+        for bill in MonthlyBill.objects.all():
+            with self.subTest(source=bill.source):
+                self.assertEqual(bill.call_count, int(bill.source[-1]) + 1)
+                self.assertEqual(bill.total, Decimal('0.81') * bill.call_count)
+                self.assertEqual(bill.lines.count(), bill.call_count)
+
+    def test_close_period_restarts_from_pending_bills(self):
+        from_date = timezone.now().replace(month=1)
+        get_bill('9998852640', from_date, timezone.now())
+        stale_bill = get_bill('9998852643', from_date, timezone.now())
+        MonthlyBill.objects.filter(pk=stale_bill.pk).update(is_stale=True, version=2)
+        out = StringIO()
+        call_command('close_period', period='2020-01', stdout=out)
+        self.assertIn('6 bills pending in 1 chunks.', out.getvalue())
+        self.assertEqual(MonthlyBill.objects.count(), 7)
+        self.assertFalse(MonthlyBill.objects.filter(is_stale=True).exists())
+        self.assertEqual(MonthlyBill.objects.get(source='9998852643').version, 2)
+        self.assertEqual(BillLine.objects.count(), 28)
+
+    def test_close_current_period(self):
+        with self.assertRaises(CommandError):
+            call_command('close_period', period='2020-02', stdout=StringIO())
+
+    def test_close_detached_period(self):
+        DetachedPeriod.objects.create(period=date(2020, 1, 1))
+        with self.assertRaises(CommandError):
+            call_command('close_period', period='2020-01', stdout=StringIO())
+
+
+class DrainIngestQueueCommandTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(RECORDS_INGEST_QUEUE_PATH=os.path.join(directory, 'queue.sqlite3'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(lambda: get_ingest_queue().close())
+
+    def test_drain_ingest_queue(self):
+        queue = get_ingest_queue()
+        call_id = str(uuid.uuid4())
+        queue.put(CALL_END, {'call_id': call_id, 'timestamp': '2020-01-10T12:10:00Z'})
+        queue.put(CALL_START, {'call_id': call_id, 'timestamp': '2020-01-10T12:00:00Z', 'source': '9998852642',
+                               'destination': '9993468278'})
+        out = StringIO()
+        call_command('drain_ingest_queue', once=True, stdout=out)
+        self.assertIn('Stored 1 start records, 0 failed.', out.getvalue())
+        self.assertIn('Stored 1 end records, 0 failed.', out.getvalue())
+        self.assertEqual(CompletedCall.objects.get(call_id=call_id).price, Decimal('1.26'))
+        self.assertDictEqual(queue.get_stats()['pending'], {CALL_START: 0, CALL_END: 0})
+
+    def test_drain_ingest_queue_with_invalid_batch_size(self):
+        with self.assertRaises(CommandError):
+            call_command('drain_ingest_queue', once=True, batch_size=0, stdout=StringIO())
+
+
+class LoadCDRsCommandTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'cdrs.csv')
+        with open(self.path, 'w') as file:
+            file.write(
+                'type,call_id,timestamp,source,destination\n'
+                'start,70,2016-02-29T12:00:00Z,99988526423,9933468278\n'
+                'end,70,2016-02-29T14:00:00Z,,\n'
+                'end,71,2017-12-11T15:14:56Z,,\n'
+                'start,71,2017-12-11T15:07:13Z,99988526423,9933468278\n'
+                'start,72,2017-12-12T22:47:56Z,99988526423,123\n'
+            )
+
+    def test_load_cdrs(self):
+        out, err = StringIO(), StringIO()
+        call_command('load_cdrs', self.path, format='csv', chunk_size=2, stdout=out, stderr=err)
+        self.assertIn('Stored 2 call start records and 2 call end records, completed 2 calls.', out.getvalue())
+        self.assertIn('Line 6:', err.getvalue())
+        self.assertDictEqual(
+            dict(CompletedCall.objects.values_list('call_id', 'price')), {'70': Decimal('11.16'), '71': Decimal('0.99')}
+        )
+
+    def test_load_cdrs_again(self):
+        call_command('load_cdrs', self.path, format='csv', stdout=StringIO(), stderr=StringIO())
+        out = StringIO()
+        call_command('load_cdrs', self.path, format='csv', stdout=out, stderr=StringIO())
+        self.assertIn('Stored 0 call start records and 0 call end records', out.getvalue())
+        self.assertEqual(CompletedCall.objects.count(), 2)
+
+    def test_load_cdrs_with_missing_file(self):
+        with self.assertRaises(CommandError):
+            call_command('load_cdrs', self.path + '.missing', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Partitioning requires PostgreSQL.')
+@freeze_time('2020-02-01')
+class PartitionCallsCommandTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        start = timezone.now().replace(month=1, day=10, hour=12)
+        cls.call_start_record = create_call_start_record(call_id=str(uuid.uuid4()), timestamp=start,
+                                                         source='9998852642', destination='9993468278')
+        create_call_end_record(call_id=cls.call_start_record.call_id, timestamp=start + timedelta(minutes=5))
+
+    def test_partition_calls(self):
+        out = StringIO()
+        call_command('partition_calls', months_ahead=1, stdout=out)
+        self.assertIn('Created the partition of 2020-02.', out.getvalue())
+        self.assertIn('Created the partition of 2020-03.', out.getvalue())
+        self.assertTrue({date(2020, 2, 1), date(2020, 3, 1)} <= get_partitions().keys())
+
+    def test_create_partition_moves_calls_from_default_partition(self):
+        self.assertTrue(create_partition(datetime(2020, 1, 1, tzinfo=dt_timezone.utc)))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT call_id FROM records_completedcall_y2020m01')
+            self.assertListEqual(cursor.fetchall(), [(self.call_start_record.call_id,)])
+            cursor.execute('SELECT COUNT(*) FROM records_completedcall_default')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_detach_partitions(self):
+        create_partition(datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+        out = StringIO()
+        call_command('partition_calls', months_ahead=0, detach_before='2020-02', drop=True, stdout=out)
+        self.assertIn('Dropped the partition of 2020-01.', out.getvalue())
+        self.assertNotIn(date(2020, 1, 1), get_partitions())
+        self.assertFalse(CompletedCall.objects.exists())
+        self.assertEqual(MonthlyBill.objects.get(source='9998852642').call_count, 1)
+        self.assertTrue(DetachedPeriod.objects.filter(period=date(2020, 1, 1)).exists())
+
+    def test_detach_partition_with_stale_bills(self):
+        create_partition(datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+        get_bill('9998852642', datetime(2020, 1, 1, tzinfo=dt_timezone.utc), timezone.now())
+        MonthlyBill.objects.update(is_stale=True)
+        with self.assertRaises(ValueError):
+            detach_partition(datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertIn(date(2020, 1, 1), get_partitions())
+        self.assertFalse(DetachedPeriod.objects.exists())
+
+
+@skipIf(connection.vendor == 'postgresql', 'Completed calls are partitioned in PostgreSQL.')
+class PartitionCallsWithoutPartitioningCommandTestCase(TestCase):
+
+    def test_partition_calls(self):
+        with self.assertRaises(CommandError):
+            call_command('partition_calls', stdout=StringIO())
+
+
+@skipIf(connection.vendor == 'postgresql', 'Call ids and phone numbers are stored compactly in PostgreSQL.')
+class CompactStorageWithoutPostgreSQLCommandTestCase(TestCase):
+
+    def test_compact_storage(self):
+        with self.assertRaises(CommandError):
+            call_command('compact_storage', stdout=StringIO())
+
+
+class ExplainBillsCommandTestCase(TestCase):
+
+    def test_explain_bills(self):
+        out, err = StringIO(), StringIO()
+        call_command('explain_bills', source='9998852642', period='2020-01', stdout=out, stderr=err)
+        self.assertIn('Bill lines:', out.getvalue())
+        self.assertIn('Completed calls:', out.getvalue())
+        self.assertNotIn('sequential scan on records_completedcall', err.getvalue())
+        self.assertNotIn('sequential scan on records_billline', err.getvalue())
+
+    def test_explain_bills_with_invalid_period(self):
+        with self.assertRaises(CommandError):
+            call_command('explain_bills', source='9998852642', period='2020-13', stdout=StringIO())
+
+
+class AddTariffCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.addCleanup(reload_tariffs)
+
+    def test_add_tariff(self):
+        out = StringIO()
+        call_command('add_tariff', '2020-03-01T00:00:00Z', connection_fee='0.40',
+                     bands=['06:00-22:00=0.10', '22:00-00:00=0.05'], stdout=out)
+        self.assertIn('Created the tariff in effect from 2020-03-01T00:00:00+00:00 with 2 bands.', out.getvalue())
+        start = datetime(2020, 3, 1, 23, tzinfo=dt_timezone.utc)
+        self.assertEqual(calculate_call_rate(start, start + timedelta(minutes=2)), Decimal('0.50'))
+
+    def test_add_tariff_with_invalid_input(self):
+        cases = [
+            {'effective_from': '2020-03-01', 'connection_fee': '0.40'},
+            {'effective_from': '2020-03-01T00:00:00Z', 'connection_fee': '-1'},
+            {'effective_from': '2020-03-01T00:00:00Z', 'connection_fee': '0.40', 'bands': ['06:00-22:00']},
+            {'effective_from': '2020-03-01T00:00:00Z', 'connection_fee': '0.40', 'bands': ['22:00-06:00=0.10']},
+        ]
+        for case in cases:
+            with self.subTest(**case):
+                with self.assertRaises(CommandError):
+                    call_command('add_tariff', case.pop('effective_from'), stdout=StringIO(), **case)
+
+
+@freeze_time('2020-02-01')
+class RebuildUsageCommandTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        start = timezone.now().replace(month=1, day=10, hour=12)
+        for minutes in (1, 2):
+            call_id = str(uuid.uuid4())
+            create_call_start_record(call_id=call_id, timestamp=start, source='9998852642', destination='9993468278')
+            create_call_end_record(call_id=call_id, timestamp=start + timedelta(minutes=minutes))
+
+    def test_rebuild_usage(self):
+        expected = MonthlyUsage.objects.values(*USAGE_FIELDS).get()
+        MonthlyUsage.objects.update(call_count=0, total=0)
+        out = StringIO()
+        call_command('rebuild_usage', period='2020-01', stdout=out)
+        self.assertIn('Recalculated the usage of 1 sources in 2020-01.', out.getvalue())
+        self.assertDictEqual(MonthlyUsage.objects.values(*USAGE_FIELDS).get(), expected)
+        self.assertEqual(expected['call_count'], 2)
+
+    def test_rebuild_usage_invalidates_bills(self):
+        get_bill('9998852642', timezone.now().replace(month=1), timezone.now())
+        call_command('rebuild_usage', period='2020-01', stdout=StringIO())
+        self.assertEqual(MonthlyBill.objects.values_list('is_stale', 'version').get(), (True, 2))
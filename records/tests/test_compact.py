@@ -0,0 +1,86 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import skipUnless
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from records import compact
+from records.compact import (
+    decode_call_id, decode_call_ids, decode_phone_number, encode_call_id, encode_phone_number, get_column_types,
+    is_hashed_call_id, to_compact_storage, to_text_storage
+)
+from records.models import CallStartRecord, CompletedCall
+from records.services import create_call_end_record, create_call_start_record
+
+
+class CompactEncodingTestCase(SimpleTestCase):
+
+    def test_uuid_call_ids_are_kept(self):
+        call_id = str(uuid.uuid4())
+        self.assertEqual(encode_call_id(call_id), uuid.UUID(call_id))
+        self.assertEqual(decode_call_id(encode_call_id(call_id), connection), call_id)
+
+    def test_numeric_call_ids_are_packed(self):
+        for call_id in ('1', '70', '999999999999999999'):
+            with self.subTest(call_id=call_id):
+                key = encode_call_id(call_id)
+                self.assertFalse(is_hashed_call_id(key))
+                self.assertEqual(decode_call_id(key, connection), call_id)
+
+    def test_other_call_ids_are_hashed(self):
+        call_ids = ['call-0001', '007', '1000000000000000000', str(uuid.uuid4()).upper(), str(uuid.UUID(int=1))]
+        keys = [encode_call_id(call_id) for call_id in call_ids]
+        self.assertTrue(all(map(is_hashed_call_id, keys)))
+        self.assertEqual(len(set(keys)), len(call_ids))
+
+    def test_phone_numbers_keep_their_digits_and_order(self):
+        numbers = ['', '0', '0099', '9998852642', '99988526423', '9998852642', '1234567890123456', '12345']
+        for number in numbers:
+            with self.subTest(number=number):
+                self.assertEqual(decode_phone_number(encode_phone_number(number)), number)
+        self.assertListEqual(sorted(numbers, key=encode_phone_number), sorted(numbers))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Compact storage requires PostgreSQL.')
+@override_settings(RECORDS_COMPACT_STORAGE=True)
+class CompactStorageTestCase(TestCase):
+
+    def setUp(self):
+        with connection.schema_editor() as schema_editor:
+            to_compact_storage(schema_editor)
+        self.start = datetime(2020, 1, 10, 12, tzinfo=timezone.utc)
+        self.call_ids = [str(uuid.uuid4()), '123456', 'call-0001']
+        for call_id in self.call_ids:
+            create_call_start_record(call_id=call_id, timestamp=self.start, source='0998852642',
+                                     destination='9993468278')
+            create_call_end_record(call_id=call_id, timestamp=self.start + timedelta(minutes=5))
+
+    def test_columns_are_converted(self):
+        types = get_column_types(connection, CompletedCall._meta.db_table)
+        self.assertDictEqual({column: types[column] for column in ('call_id', 'source', 'destination')},
+                             {'call_id': 'uuid', 'source': 'bigint', 'destination': 'bigint'})
+
+    def test_records_keep_their_values(self):
+        calls = CompletedCall.objects.get_calls(self.start, self.start + timedelta(days=1), source='0998852642')
+        self.assertCountEqual([call['call_id'] for call in calls], self.call_ids)
+        call_start_record = CallStartRecord.objects.get(call_id='call-0001')
+        self.assertEqual((call_start_record.source, call_start_record.destination), ('0998852642', '9993468278'))
+        self.assertFalse(CompletedCall.objects.filter(source='not a number').exists())
+
+    def test_call_ids_are_read_in_one_query(self):
+        compact._call_id_texts.clear()
+        with self.assertNumQueries(1):
+            self.assertCountEqual(CompletedCall.objects.values_list('call_id', flat=True), self.call_ids)
+        with self.assertNumQueries(1):
+            self.assertCountEqual([record.call_id for record in CallStartRecord.objects.all()], self.call_ids)
+        keys = [encode_call_id(call_id) for call_id in self.call_ids]
+        with self.assertNumQueries(1):
+            self.assertListEqual(decode_call_ids(keys, connection), self.call_ids)
+        with self.assertNumQueries(0):
+            self.assertListEqual(decode_call_ids(keys, connection), self.call_ids)
+
+    def test_text_storage(self):
+        with connection.schema_editor() as schema_editor:
+            to_text_storage(schema_editor)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT call_id, source FROM {CompletedCall._meta.db_table}')
+            self.assertCountEqual(cursor.fetchall(), [(call_id, '0998852642') for call_id in self.call_ids])
@@ -0,0 +1,48 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from records.formatters import format_bill_rows, format_duration
+from records.serializers import CallRecordSerializer
+from records.utils import calculate_call_rate
+
+
+class FormatBillRowsTestCase(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        random.seed(0)
+        cls.rows = []
+        for _ in range(500):
+            start = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(
+                seconds=random.randint(0, 31 * 86400), microseconds=random.choice([0, random.randint(0, 999999)])
+            )
+            end = start + timedelta(seconds=random.randint(0, 3 * 86400), microseconds=random.randint(0, 999999))
+            cls.rows.append({
+                'start': start,
+                'end': end,
+                'call_id': str(uuid.uuid4()),
+                'destination': '9993468278',
+                'duration': end - start,
+                'price': calculate_call_rate(start, end)
+            })
+
+    def test_format_bill_rows_matches_serializer(self):
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(format_bill_rows(self.rows)),
+            renderer.render(CallRecordSerializer(self.rows, many=True).data)
+        )
+
+    def test_format_duration(self):
+        cases = [
+            (timedelta(0), '0h0m0s'),
+            (timedelta(minutes=35, seconds=42), '0h35m42s'),
+            (timedelta(days=1, hours=1, seconds=1, microseconds=999999), '25h0m1s')
+        ]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(format_duration(value), expected)
@@ -0,0 +1,134 @@
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import skipUnless
+from django.db import connection, transaction
+from django.test import TestCase
+from rest_framework.exceptions import ValidationError
+from records.loaders import RowValidator, load_records, parse_csv, parse_ndjson
+from records.models import CallEndRecord, CallStartRecord, CompletedCall, MonthlyUsage
+from records.serializers import CallStartRecordBatchSerializer
+from records.services import create_call_end_record, create_call_start_record
+
+
+class ParsersTestCase(TestCase):
+
+    def test_parse_ndjson(self):
+        lines = list(enumerate(['{"call_id": "1"}\n', '\n', 'not json\n', '[1]\n'], start=1))
+        self.assertListEqual(list(parse_ndjson(lines)), [(1, {'call_id': '1'}), (3, None), (4, None)])
+
+    def test_parse_csv(self):
+        lines = [(2, '1,2020-01-10T12:00:00Z,,\n')]
+        rows = parse_csv(lines, ['call_id', 'timestamp', 'source', 'destination'])
+        self.assertListEqual(list(rows), [(2, {'call_id': '1', 'timestamp': '2020-01-10T12:00:00Z'})])
+
+
+class RowValidatorTestCase(TestCase):
+
+    def setUp(self):
+        self.validator = RowValidator(CallStartRecordBatchSerializer(), cached_fields=('source', 'destination'))
+        self.row = {
+            'call_id': '1', 'timestamp': '2020-01-10T12:00:00.5Z', 'source': '9998852642', 'destination': '9993468278'
+        }
+
+    def test_valid_row(self):
+        attrs = self.validator(self.row)
+        self.assertEqual(attrs['timestamp'], datetime(2020, 1, 10, 12, 0, 0, 500000, tzinfo=timezone.utc))
+        self.assertEqual(attrs['destination'], '9993468278')
+
+    def test_timestamps_are_validated_as_by_the_serializer(self):
+        for timestamp in ('2020-01-10T09:00:00-03:00', '2020-01-10T12:00:00'):
+            with self.subTest(timestamp=timestamp):
+                attrs = self.validator({**self.row, 'timestamp': timestamp})
+                self.assertEqual(attrs['timestamp'], datetime(2020, 1, 10, 12, tzinfo=timezone.utc))
+        with self.assertRaises(ValidationError) as context:
+            self.validator({**self.row, 'timestamp': '2020-13-10T12:00:00Z'})
+        self.assertIn('timestamp', context.exception.detail)
+
+    def test_cached_values_are_rejected_every_time(self):
+        for _ in range(2):
+            with self.assertRaises(ValidationError) as context:
+                self.validator({**self.row, 'destination': '123'})
+            self.assertListEqual(context.exception.detail['destination'],
+                                 ['Ensure this field has at least 10 characters.'])
+
+    def test_required_fields(self):
+        with self.assertRaises(ValidationError) as context:
+            self.validator({'call_id': '1'})
+        self.assertSetEqual(set(context.exception.detail), {'timestamp', 'source', 'destination'})
+
+
+class LoadRecordsTestCase(TestCase):
+
+    def file(self, *rows):
+        return io.StringIO(''.join((json.dumps(row) if row is not None else 'not json') + '\n' for row in rows))
+
+    def test_load_records(self):
+        call_ids = [str(uuid.uuid4()) for _ in range(3)]
+        file = self.file(
+            *({'call_id': call_id, 'timestamp': '2020-01-10T12:00:00Z', 'source': '9998852642',
+               'destination': '9993468278'} for call_id in call_ids),
+            *({'type': 'end', 'call_id': call_id, 'timestamp': '2020-01-10T12:10:00Z'} for call_id in call_ids)
+        )
+        chunks = list(load_records(file, chunk_size=4))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(sum(chunk['starts'] for chunk in chunks), 3)
+        self.assertEqual(sum(chunk['ends'] for chunk in chunks), 3)
+        self.assertEqual(sum(chunk['completed'] for chunk in chunks), 3)
+        self.assertSetEqual(set(CompletedCall.objects.values_list('price', flat=True)), {Decimal('1.26')})
+        usage = MonthlyUsage.objects.get(source='9998852642')
+        self.assertEqual((usage.call_count, usage.total), (3, Decimal('3.78')))
+
+    def test_load_records_in_workers(self):
+        file = self.file(*(
+            {'call_id': str(index), 'timestamp': '2020-01-10T12:00:00Z', 'source': '9998852642',
+             'destination': '9993468278'} for index in range(5)
+        ), {'call_id': '0', 'timestamp': '2020-01-10T12:10:00Z'})
+        chunks = list(load_records(file, chunk_size=2, workers=2))
+        self.assertListEqual([chunk['rows'] for chunk in chunks], [2, 2, 2])
+        self.assertEqual(CallStartRecord.objects.count(), 5)
+        self.assertEqual(CompletedCall.objects.get().price, Decimal('1.26'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Records are only copied into staging tables in PostgreSQL.')
+    def test_load_records_in_outer_transaction(self):
+        file = self.file(*(
+            {'call_id': str(index), 'timestamp': '2020-01-10T12:00:00Z', 'source': '9998852642',
+             'destination': '9993468278'} for index in range(5)
+        ))
+        with transaction.atomic():
+            chunks = list(load_records(file, chunk_size=2))
+        self.assertListEqual([chunk['starts'] for chunk in chunks], [2, 2, 1])
+        self.assertEqual(CallStartRecord.objects.count(), 5)
+
+    def test_load_records_skips_stored_and_invalid_records(self):
+        stored = create_call_start_record(call_id='1', timestamp=datetime(2020, 1, 10, 12, tzinfo=timezone.utc),
+                                          source='9998852642', destination='9993468278')
+        file = self.file(
+            {'call_id': stored.call_id, 'timestamp': '2020-01-10T13:00:00Z', 'source': '9998852642',
+             'destination': '9993468278'},
+            {'call_id': stored.call_id, 'timestamp': '2020-01-10T11:00:00Z'},
+            {'call_id': '2', 'timestamp': '2020-01-10T12:00:00Z'},
+            {'call_id': '2', 'timestamp': '2020-01-10T12:00:00Z'},
+            {'type': 'other', 'call_id': '3'},
+            None
+        )
+        chunk, = load_records(file)
+        self.assertDictEqual({key: chunk[key] for key in ('starts', 'ends', 'skipped', 'completed')},
+                             {'starts': 0, 'ends': 1, 'skipped': 2, 'completed': 0})
+        self.assertListEqual([line_number for line_number, _ in chunk['errors']], [2, 5, 6])
+        self.assertEqual(CallStartRecord.objects.get().timestamp, stored.timestamp)
+        self.assertListEqual(list(CallEndRecord.objects.values_list('call_id', flat=True)), ['2'])
+
+    def test_load_records_rejects_call_start_records_later_than_stored_end(self):
+        create_call_end_record(call_id='1', timestamp=datetime(2020, 1, 10, 12, tzinfo=timezone.utc))
+        file = self.file({'call_id': '1', 'timestamp': '2020-01-10T12:05:00Z', 'source': '9998852642',
+                          'destination': '9993468278'})
+        chunk, = load_records(file)
+        self.assertDictEqual({key: chunk[key] for key in ('starts', 'skipped', 'completed')},
+                             {'starts': 0, 'skipped': 0, 'completed': 0})
+        self.assertListEqual(chunk['errors'], [
+            (1, {'timestamp': ['Call start record timestamp cannot be later than call end record timestamp.']})
+        ])
+        self.assertFalse(CallStartRecord.objects.exists())
@@ -0,0 +1,85 @@
+import re
+import uuid
+from datetime import timedelta
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from freezegun import freeze_time
+from records.metrics import Counter, Histogram, finish_request, render_metrics, start_request, timed
+from records.services import create_call_end_record, create_call_start_record
+
+
+class HistogramTestCase(SimpleTestCase):
+
+    def test_render(self):
+        histogram = Histogram('request_seconds', 'Wall time.', (0.1, 1), ('endpoint',))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value, 'bills-list')
+        self.assertListEqual(histogram.render(), [
+            '# HELP request_seconds Wall time.',
+            '# TYPE request_seconds histogram',
+            'request_seconds_bucket{endpoint="bills-list",le="0.1"} 2',
+            'request_seconds_bucket{endpoint="bills-list",le="1"} 3',
+            'request_seconds_bucket{endpoint="bills-list",le="+Inf"} 4',
+            'request_seconds_sum{endpoint="bills-list"} 2.65',
+            'request_seconds_count{endpoint="bills-list"} 4',
+        ])
+
+    def test_render_counter(self):
+        counter = Counter('requests_total', 'Requests.', ('status',))
+        counter.inc(200)
+        counter.inc(200)
+        self.assertListEqual(counter.render(), [
+            '# HELP requests_total Requests.', '# TYPE requests_total counter', 'requests_total{status="200"} 2'
+        ])
+
+
+class TimedTestCase(SimpleTestCase):
+
+    def test_timed_adds_to_current_request(self):
+        metrics, token = start_request()
+        with timed('pricing'):
+            pass
+        finish_request(token, metrics, 'test', 'GET', 200, 0.01)
+        self.assertGreater(metrics.timings['pricing'], 0)
+        self.assertRegex(metrics.get_server_timing(0.01), r'^pricing;dur=[\d.]+, total;dur=10.00;desc="0 queries"$')
+
+    def test_timed_without_request(self):
+        with timed('pricing'):
+            pass
+
+
+class InstrumentationMiddlewareTestCase(TestCase):
+
+    def test_server_timing(self):
+        response = self.client.get('/v1/call-records/bills/', {'source': '9998852642', 'period': '2020-01'})
+        timings = dict(timing.split(';', 1) for timing in response['Server-Timing'].split(', '))
+        self.assertSetEqual(set(timings), {'db', 'serialize', 'render', 'total'})
+        self.assertRegex(timings['total'], r'^dur=[\d.]+;desc="\d+ queries"$')
+
+    def test_metrics(self):
+        self.client.get('/v1/call-records/bills/', {'source': '9998852642', 'period': '2020-01'})
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        content = response.content.decode()
+        self.assertIn('records_request_seconds_count{endpoint="bills-list",method="GET"}', content)
+        self.assertIn('records_request_queries_bucket{endpoint="bills-list",le="+Inf"}', content)
+        self.assertIn('records_unpaired_call_end_records 0', content)
+        self.assertIn('records_bill_cache{stat="misses"}', content)
+        self.assertIn('Server-Timing', response)
+
+    @freeze_time('2020-02-01')
+    def test_streamed_queries(self):
+        start = timezone.now().replace(month=1, day=10, hour=12)
+        for minutes in (1, 2):
+            call_id = str(uuid.uuid4())
+            create_call_start_record(call_id=call_id, timestamp=start, source='9998852642', destination='9993468278')
+            create_call_end_record(call_id=call_id, timestamp=start + timedelta(minutes=minutes))
+        pattern = re.compile(r'^records_request_queries_sum{endpoint="bills-export"} (\d+)$', re.MULTILINE)
+        match = pattern.search(render_metrics())
+        before = int(match.group(1)) if match else 0
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/v1/call-records/bills/export/', {'source': '9998852642', 'period': '2020-01'})
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+        self.assertEqual(int(pattern.search(render_metrics()).group(1)) - before, len(queries))
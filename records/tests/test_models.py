@@ -4,6 +4,8 @@ from django.db import IntegrityError
 from django.test import TestCase
 from django.utils import timezone
 from records.models import CallEndRecord, CallStartRecord
+from records.services import create_call_end_record
+from records.utils import calculate_call_rate
 
 
 class CallStartRecordTestCase(TestCase):
@@ -69,7 +71,17 @@ class CallEndRecordTestCase(TestCase):
             timestamp=self.call_start_record.timestamp + timedelta(minutes=5)
         )
         self.assertIsNotNone(record.pk)
-        self.assertIsNotNone(record.price)
+        # Records are priced by the ingestion service, not when the model is saved
+        self.assertIsNone(record.price)
+
+    def test_new_call_end_record_is_priced_by_service(self):
+        record = create_call_end_record(
+            call_id=self.call_start_record.call_id,
+            timestamp=self.call_start_record.timestamp + timedelta(minutes=5)
+        )
+        price = calculate_call_rate(self.call_start_record.timestamp, record.timestamp)
+        self.assertEqual(record.price, price)
+        self.assertEqual(CallEndRecord.objects.get().price, price)
 
     def test_new_call_end_record_without_timestamp(self):
         with self.assertRaises(IntegrityError):
@@ -4,7 +4,8 @@ from django.test import TestCase
 from django.utils import timezone
 from freezegun import freeze_time
 from records.exceptions import InvalidDatePeriodException
-from records.models import CallEndRecord, CallStartRecord
+from records.models import CallEndRecord, CompletedCall
+from records.services import create_call_end_record, create_call_start_record
 
 
 @freeze_time('2020-01-01')
@@ -19,23 +20,23 @@ class CallRecordQuerySetTestCase(TestCase):
 
         # Call started and ended yesterday
         call_id = str(uuid.uuid4())
-        CallStartRecord.objects.create(call_id=call_id, timestamp=yesterday, source=cls.source, destination=cls.destination)
-        CallEndRecord.objects.create(call_id=call_id, timestamp=yesterday + timedelta(minutes=5))
+        create_call_start_record(call_id=call_id, timestamp=yesterday, source=cls.source, destination=cls.destination)
+        create_call_end_record(call_id=call_id, timestamp=yesterday + timedelta(minutes=5))
 
         # Call started yesterday and ended today
         call_id = str(uuid.uuid4())
-        CallStartRecord.objects.create(call_id=call_id, timestamp=yesterday, source=cls.source, destination=cls.destination)
-        CallEndRecord.objects.create(call_id=call_id, timestamp=today)
+        create_call_start_record(call_id=call_id, timestamp=yesterday, source=cls.source, destination=cls.destination)
+        create_call_end_record(call_id=call_id, timestamp=today)
 
         # Call started and ended today
         call_id = str(uuid.uuid4())
-        CallStartRecord.objects.create(call_id=call_id, timestamp=today, source=cls.source, destination=cls.destination)
-        CallEndRecord.objects.create(call_id=call_id, timestamp=today + timedelta(minutes=5))
+        create_call_start_record(call_id=call_id, timestamp=today, source=cls.source, destination=cls.destination)
+        create_call_end_record(call_id=call_id, timestamp=today + timedelta(minutes=5))
 
         # Call with different source, not to be retrived by get_calls method.
         call_id = str(uuid.uuid4())
-        CallStartRecord.objects.create(call_id=call_id, timestamp=today, source='1234567890', destination=cls.destination)
-        CallEndRecord.objects.create(call_id=call_id, timestamp=today + timedelta(minutes=5))
+        create_call_start_record(call_id=call_id, timestamp=today, source='1234567890', destination=cls.destination)
+        create_call_end_record(call_id=call_id, timestamp=today + timedelta(minutes=5))
 
     def test_get_calls(self):
         today = timezone.now()
@@ -75,3 +76,33 @@ class CallRecordQuerySetTestCase(TestCase):
             with self.subTest(index=index):
                 with self.assertRaises(TypeError):
                     CallEndRecord.objects.get_calls(*case)
+
+
+@freeze_time('2020-01-01')
+class CompletedCallQuerySetTestCase(TestCase):
+    """
+    Completed calls must give the same results as call records.
+    """
+    setUpTestData = classmethod(CallRecordQuerySetTestCase.setUpTestData.__func__)
+
+    def test_get_calls_matches_call_records(self):
+        today = timezone.now()
+        from_date = today - timedelta(days=1)
+        to_date = today.replace(hour=23, minute=59, second=59, microsecond=59)
+        for source in (None, self.source):
+            with self.subTest(source=source):
+                self.assertListEqual(
+                    list(CompletedCall.objects.get_calls(from_date, to_date, source=source)),
+                    list(CallEndRecord.objects.get_calls(from_date, to_date, source=source))
+                )
+
+    def test_get_calls_excludes_end_of_period(self):
+        today = timezone.now().replace(hour=12)
+        queryset = CompletedCall.objects.get_calls(today - timedelta(days=1), today)
+        self.assertEqual(queryset.count(), 1)
+
+    def test_get_calls_with_invalid_date_inputs(self):
+        from_date = timezone.now()
+        to_date = from_date - timedelta(days=1)
+        with self.assertRaises(InvalidDatePeriodException):
+            CompletedCall.objects.get_calls(from_date, to_date)
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import uuid
+from django.test import TestCase
+from records.models import CallEndRecord, CallStartRecord, CompletedCall
+from records.queue import CALL_END, CALL_START, IngestQueue
+from records.serializers import CallEndRecordBatchSerializer, CallStartRecordBatchSerializer
+from records.services import create_call_end_records, create_call_start_records, drain_queue_batch
+
+
+class IngestQueueTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = IngestQueue(os.path.join(self.directory, 'queue.sqlite3'))
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(self.queue.close)
+
+    def test_get_batch_leases_items(self):
+        for index in range(3):
+            self.queue.put(CALL_START, {'call_id': str(index)})
+        self.queue.put(CALL_END, {'call_id': '0'})
+        batch = self.queue.get_batch(CALL_START, 2)
+        self.assertListEqual([payload for _, payload in batch], [{'call_id': '0'}, {'call_id': '1'}])
+        self.assertListEqual([payload for _, payload in self.queue.get_batch(CALL_START, 2)], [{'call_id': '2'}])
+        self.assertListEqual(self.queue.get_batch(CALL_START, 2), [])
+
+    def test_unacknowledged_items_are_delivered_again(self):
+        self.queue.lease_seconds = 0
+        self.queue.put(CALL_START, {'call_id': '0'})
+        first = self.queue.get_batch(CALL_START, 10)
+        self.assertListEqual(self.queue.get_batch(CALL_START, 10), first)
+        self.queue.ack([item_id for item_id, _ in first])
+        self.assertListEqual(self.queue.get_batch(CALL_START, 10), [])
+
+    def test_ack_keeps_failed_items(self):
+        self.queue.put(CALL_END, {'call_id': '0'})
+        batch = self.queue.get_batch(CALL_END, 10)
+        self.queue.ack([batch[0][0]], [(batch[0][0], CALL_END, batch[0][1], {'timestamp': ['Invalid.']})])
+        stats = self.queue.get_stats()
+        self.assertDictEqual(stats['pending'], {CALL_START: 0, CALL_END: 0})
+        self.assertEqual(stats['failed'], 1)
+
+
+class DrainQueueBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = IngestQueue(os.path.join(self.directory, 'queue.sqlite3'))
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(self.queue.close)
+        self.call_id = str(uuid.uuid4())
+        self.start = {
+            'call_id': self.call_id, 'timestamp': '2020-01-10T12:00:00Z', 'source': '9998852642',
+            'destination': '9993468278'
+        }
+        self.end = {'call_id': self.call_id, 'timestamp': '2020-01-10T12:10:00Z'}
+
+    def drain_starts(self):
+        return drain_queue_batch(self.queue, CALL_START, CallStartRecord, create_call_start_records,
+                                 CallStartRecordBatchSerializer(), 100)
+
+    def drain_ends(self):
+        return drain_queue_batch(self.queue, CALL_END, CallEndRecord, create_call_end_records,
+                                 CallEndRecordBatchSerializer(), 100)
+
+    def test_drain_queue_batch(self):
+        self.queue.put(CALL_START, self.start)
+        self.queue.put(CALL_END, self.end)
+        self.assertEqual(self.drain_starts(), (1, 0))
+        self.assertEqual(self.drain_ends(), (1, 0))
+        self.assertIsNone(self.drain_ends())
+        self.assertTrue(CompletedCall.objects.filter(call_id=self.call_id).exists())
+
+    def test_records_delivered_again_are_acknowledged(self):
+        self.queue.put(CALL_START, self.start)
+        self.queue.put(CALL_START, self.start)
+        self.assertEqual(self.drain_starts(), (1, 0))
+        self.queue.put(CALL_START, self.start)
+        self.assertEqual(self.drain_starts(), (0, 0))
+        self.assertEqual(CallStartRecord.objects.count(), 1)
+        self.assertEqual(self.queue.get_stats()['failed'], 0)
+
+    def test_invalid_records_are_kept_apart(self):
+        self.queue.put(CALL_START, self.start)
+        self.queue.put(CALL_END, {**self.end, 'timestamp': '2020-01-10T11:00:00Z'})
+        self.drain_starts()
+        self.assertEqual(self.drain_ends(), (0, 1))
+        self.assertEqual(self.queue.get_stats()['failed'], 1)
+        self.assertFalse(CallEndRecord.objects.exists())
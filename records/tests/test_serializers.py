@@ -1,9 +1,9 @@
 import uuid
 from datetime import timedelta
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from freezegun import freeze_time
-from rest_framework.exceptions import ErrorDetail
+from rest_framework.exceptions import ErrorDetail, ValidationError
 from records.serializers import CallEndRecordCreateSerializer, CallRecordSerializer, CallStartRecordSerializer
 from records.utils import calculate_call_rate
 
@@ -46,6 +46,20 @@ class CallStartRecordSerializerTestCase(TestCase):
             [ErrorDetail(string='Ensure this field has at least 10 characters.', code='min_length')]
         )
 
+    def test_sources_accepted_by_storage(self):
+        # The compact storage only takes sources of up to 16 digits, which keep their leading zeros
+        sources = {'0099885264': True, '1234567890123456': True, '12345678901234567': False, '99988-52642': False}
+        field = CallStartRecordSerializer().fields['source']
+        for source, is_compact in sources.items():
+            with self.subTest(source=source):
+                self.assertEqual(field.run_validation(source), source)
+                with override_settings(RECORDS_COMPACT_STORAGE=True):
+                    if is_compact:
+                        self.assertEqual(field.run_validation(source), source)
+                    else:
+                        with self.assertRaises(ValidationError):
+                            field.run_validation(source)
+
     def test_serializer_without_required_fields(self):
         required_field_error = [ErrorDetail(string='This field is required.', code='required')]
         expected_serializer_errors = {
@@ -125,11 +139,9 @@ class CallEndRecordCreateSerializerTestCase(TestCase):
         data = self.data.copy()
         data['call_id'] = '123'
         serializer = CallEndRecordCreateSerializer(data=data)
-        self.assertFalse(serializer.is_valid())
-        self.assertListEqual(
-            serializer.errors['call_id'],
-            [ErrorDetail(string='Given call_id does not exist.', code='invalid')]
-        )
+        self.assertTrue(serializer.is_valid())
+        record = serializer.save()
+        self.assertIsNone(record.price)
 
 
 @freeze_time('2020-01-01')
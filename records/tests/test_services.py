@@ -0,0 +1,182 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.status import HTTP_400_BAD_REQUEST
+from records.models import CallEndRecord, CallStartRecord, CompletedCall
+from records.serializers import CallStartRecordBatchSerializer
+from records.services import (
+    create_call_end_record, create_call_start_record, create_call_start_records, get_or_create_call_end_record,
+    get_misordered_call_end_records, get_or_create_call_start_record, get_unpaired_backlog, is_same_record,
+    reconcile_calls
+)
+
+
+class CompletedCallTestCase(TestCase):
+
+    def setUp(self):
+        self.start = timezone.now().replace(hour=12)
+        self.call_start_data = {
+            'timestamp': self.start,
+            'call_id': str(uuid.uuid4()),
+            'source': '99988526423',
+            'destination': '9993468278'
+        }
+        self.call_end_data = {
+            'timestamp': self.start + timedelta(minutes=5),
+            'call_id': self.call_start_data['call_id']
+        }
+
+    def assertCompletedCall(self):
+        completed_call = CompletedCall.objects.get(call_id=self.call_start_data['call_id'])
+        call_end_record = CallEndRecord.objects.get(call_id=self.call_end_data['call_id'])
+        self.assertEqual(completed_call.source, self.call_start_data['source'])
+        self.assertEqual(completed_call.destination, self.call_start_data['destination'])
+        self.assertEqual(completed_call.start, self.start)
+        self.assertEqual(completed_call.end, self.call_end_data['timestamp'])
+        self.assertEqual(completed_call.duration, timedelta(minutes=5))
+        self.assertIsNotNone(completed_call.price)
+        self.assertEqual(completed_call.price, call_end_record.price)
+
+    def test_completed_call_when_end_record_arrives_last(self):
+        create_call_start_record(**self.call_start_data)
+        self.assertFalse(CompletedCall.objects.exists())
+        create_call_end_record(**self.call_end_data)
+        self.assertCompletedCall()
+
+    def test_completed_call_when_start_record_arrives_last(self):
+        create_call_end_record(**self.call_end_data)
+        self.assertFalse(CompletedCall.objects.exists())
+        create_call_start_record(**self.call_start_data)
+        self.assertCompletedCall()
+
+    def test_call_start_record_later_than_stored_end_is_rejected(self):
+        self.call_end_data['timestamp'] = self.start - timedelta(minutes=5)
+        create_call_end_record(**self.call_end_data)
+        result, = create_call_start_records([self.call_start_data], CallStartRecordBatchSerializer())
+        self.assertEqual(result['status'], HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(result['errors'], {
+            'timestamp': ['Call start record timestamp cannot be later than call end record timestamp.']
+        })
+        self.assertFalse(CallStartRecord.objects.exists())
+        self.assertFalse(CompletedCall.objects.exists())
+
+
+class CreateCallEndRecordTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.call_start_record = create_call_start_record(
+            timestamp=timezone.now().replace(hour=12),
+            call_id=str(uuid.uuid4()),
+            source='99988526423',
+            destination='9993468278'
+        )
+
+    def test_create_call_end_record_with_given_call_start_record(self):
+        with CaptureQueriesContext(connection) as context:
+            record = create_call_end_record(
+                call_start_record=self.call_start_record,
+                call_id=self.call_start_record.call_id,
+                timestamp=self.call_start_record.timestamp + timedelta(minutes=5)
+            )
+        # The call start record is not looked up, only the usage of the source is created and locked
+        statements = [query['sql'] for query in context.captured_queries]
+        self.assertEqual([statement.split()[0] for statement in statements].count('INSERT'), 3)
+        self.assertFalse([statement for statement in statements if 'records_callstartrecord' in statement])
+        self.assertIsNotNone(record.pk)
+        self.assertEqual(str(record.price), '0.81')
+        self.assertTrue(CompletedCall.objects.filter(call_id=record.call_id).exists())
+
+    def test_create_call_end_record_looks_up_call_start_record(self):
+        record = create_call_end_record(
+            call_id=self.call_start_record.call_id,
+            timestamp=self.call_start_record.timestamp + timedelta(minutes=5)
+        )
+        self.assertEqual(str(record.price), '0.81')
+        self.assertTrue(CompletedCall.objects.filter(call_id=record.call_id).exists())
+
+    def test_create_call_end_record_without_call_start_record(self):
+        record = create_call_end_record(call_id=str(uuid.uuid4()), timestamp=timezone.now())
+        self.assertIsNotNone(record.pk)
+        self.assertIsNone(record.price)
+        self.assertFalse(CompletedCall.objects.exists())
+
+
+class GetOrCreateCallRecordTestCase(TestCase):
+
+    def setUp(self):
+        self.data = {
+            'timestamp': timezone.now().replace(hour=12),
+            'call_id': str(uuid.uuid4()),
+            'source': '99988526423',
+            'destination': '9993468278'
+        }
+
+    def test_get_or_create_call_start_record(self):
+        record, created = get_or_create_call_start_record(**self.data)
+        self.assertTrue(created)
+        with self.assertNumQueries(1):
+            stored, created = get_or_create_call_start_record(**{**self.data, 'source': '1234567890'})
+        self.assertFalse(created)
+        self.assertEqual(stored.pk, record.pk)
+        self.assertEqual(stored.source, self.data['source'])
+
+    def test_get_or_create_call_end_record(self):
+        create_call_start_record(**self.data)
+        end_data = {'call_id': self.data['call_id'], 'timestamp': self.data['timestamp'] + timedelta(minutes=5)}
+        record, created = get_or_create_call_end_record(**end_data)
+        self.assertTrue(created)
+        stored, created = get_or_create_call_end_record(**end_data)
+        self.assertFalse(created)
+        self.assertEqual((stored.pk, stored.price), (record.pk, Decimal('0.81')))
+        self.assertEqual(CompletedCall.objects.count(), 1)
+
+    def test_is_same_record(self):
+        record, _ = get_or_create_call_start_record(**self.data)
+        self.assertTrue(is_same_record(record, self.data))
+        self.assertFalse(is_same_record(record, {**self.data, 'timestamp': self.data['timestamp'] + timedelta(1)}))
+
+
+class ReconcileCallsTestCase(TestCase):
+
+    def setUp(self):
+        self.start = timezone.now().replace(hour=12)
+        self.call_ids = [str(uuid.uuid4()) for _ in range(5)]
+        for call_id in self.call_ids:
+            create_call_end_record(call_id=call_id, timestamp=self.start + timedelta(minutes=5))
+
+    def test_unpaired_backlog(self):
+        backlog = get_unpaired_backlog()
+        self.assertEqual(backlog['size'], 5)
+        self.assertEqual(backlog['oldest'], self.start + timedelta(minutes=5))
+
+    def test_reconcile_calls(self):
+        # Call start records stored without pairing, as when both records of a call arrive at the same time
+        CallStartRecord.objects.bulk_create([
+            CallStartRecord(call_id=call_id, timestamp=self.start, source='99988526423', destination='9993468278')
+            for call_id in self.call_ids[:3]
+        ])
+        self.assertEqual(reconcile_calls(chunk_size=2), 3)
+        self.assertEqual(CompletedCall.objects.count(), 3)
+        self.assertEqual(get_unpaired_backlog()['size'], 2)
+        self.assertSetEqual(
+            set(CallEndRecord.objects.filter(call_id__in=self.call_ids[:3]).values_list('price', flat=True)),
+            {Decimal('0.81')}
+        )
+        self.assertEqual(reconcile_calls(), 0)
+
+    def test_reconcile_calls_leaves_misordered_pairs_out(self):
+        # Call start record later than its call end record, stored before such records were rejected
+        CallStartRecord.objects.create(call_id=self.call_ids[0], timestamp=self.start + timedelta(minutes=10),
+                                       source='99988526423', destination='9993468278')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(reconcile_calls(), 0)
+        # Only the query of the unpaired call end records, which finds none
+        self.assertEqual(len(queries), 1)
+        self.assertListEqual(
+            list(get_misordered_call_end_records().values_list('call_id', flat=True)), self.call_ids[:1]
+        )
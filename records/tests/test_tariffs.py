@@ -0,0 +1,72 @@
+import random
+from datetime import datetime, time, timedelta, timezone
+from decimal import Decimal
+from django.test import TestCase, override_settings
+from records.models import Tariff
+from records.tariffs import compile_tariff, create_tariff, get_tariff_table, reload_tariffs, to_microseconds
+from records.utils import calculate_call_rate, price_calls, to_datetime64
+
+
+class CompileTariffTestCase(TestCase):
+
+    def test_compile_tariff(self):
+        tariff = compile_tariff(None, Decimal('0.36'), [(time(22), time(0), Decimal('0.045')),
+                                                        (time(6), time(22), Decimal('0.09'))])
+        self.assertEqual(tariff.exponent, -3)
+        self.assertEqual(tariff.scaled_connection_fee, 360)
+        self.assertListEqual([(band.start, band.length, band.scaled_minute_rate) for band in tariff.bands], [
+            (6 * 3600 * 1000000, 16 * 3600 * 1000000, 90),
+            (22 * 3600 * 1000000, 2 * 3600 * 1000000, 45),
+        ])
+
+    def test_compile_tariff_with_invalid_bands(self):
+        for bands in ([(time(22), time(6), Decimal('0.09'))],
+                      [(time(6), time(22), Decimal('0.09')), (time(21), time(23), Decimal('0.09'))]):
+            with self.subTest(bands=bands):
+                with self.assertRaises(ValueError):
+                    compile_tariff(None, Decimal('0.36'), bands)
+
+
+class TariffTestCase(TestCase):
+
+    def setUp(self):
+        self.effective_from = datetime(2020, 3, 1, tzinfo=timezone.utc)
+        # Reduced rate at night, instead of free calls
+        create_tariff(self.effective_from, Decimal('0.50'), [
+            (time(0), time(6), Decimal('0.02')),
+            (time(6), time(22), Decimal('0.10')),
+            (time(22), time(0), Decimal('0.02'))
+        ])
+        self.addCleanup(reload_tariffs)
+
+    def test_get_tariff(self):
+        table = get_tariff_table()
+        self.assertEqual(table.get_tariff(to_microseconds(self.effective_from - timedelta(microseconds=1))),
+                         table.tariffs[0])
+        self.assertEqual(table.get_tariff(to_microseconds(self.effective_from)).connection_fee, Decimal('0.50'))
+
+    def test_calculate_call_rate_uses_tariff_in_effect_at_call_start(self):
+        start = self.effective_from - timedelta(minutes=5)
+        self.assertEqual(calculate_call_rate(start, start + timedelta(minutes=10)), Decimal('0.36'))
+        self.assertEqual(calculate_call_rate(self.effective_from, self.effective_from + timedelta(minutes=10)),
+                         Decimal('0.70'))
+        start = self.effective_from.replace(hour=21, minute=50)
+        self.assertEqual(calculate_call_rate(start, start + timedelta(minutes=20)), Decimal('1.70'))
+
+    def test_price_calls_matches_calculate_call_rate(self):
+        random.seed(0)
+        starts, ends = [], []
+        for _ in range(1000):
+            start = self.effective_from + timedelta(seconds=random.randint(-30 * 86400, 30 * 86400))
+            starts.append(start)
+            ends.append(start + timedelta(seconds=random.randint(0, 2 * 86400), microseconds=random.randint(0, 999999)))
+        expected = [calculate_call_rate(start, end) for start, end in zip(starts, ends)]
+        self.assertListEqual(price_calls(to_datetime64(starts), to_datetime64(ends)), expected)
+
+    @override_settings(RECORDS_TARIFF_RELOAD_INTERVAL=0)
+    def test_tariffs_are_reloaded_on_change(self):
+        start = self.effective_from + timedelta(days=10, hours=12)
+        self.assertEqual(calculate_call_rate(start, start + timedelta(minutes=1)), Decimal('0.60'))
+        # Tariffs changed by another process
+        Tariff.objects.create(effective_from=start, connection_fee=Decimal('0.40'))
+        self.assertEqual(calculate_call_rate(start, start + timedelta(minutes=1)), Decimal('0.40'))
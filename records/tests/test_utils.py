@@ -1,9 +1,13 @@
+import random
 from datetime import datetime, timedelta
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
 from django.test import TestCase
 from django.utils import timezone
 
 from records.exceptions import InvalidDatePeriodException
-from records.utils import CONNECTION_FEE, MINUTE_RATE, calculate_call_rate
+from records.utils import calculate_call_rate, price_calls, to_datetime64
 
 
 class CalculateCallRateTestCase(TestCase):
@@ -51,9 +55,42 @@ class CalculateCallRateTestCase(TestCase):
             with self.subTest(index=index):
                 self.assertEqual(
                     float(calculate_call_rate(case['start'], case['end'])),
-                    round((CONNECTION_FEE + MINUTE_RATE * case['billable_minutes']), 2)
+                    round((settings.CONNECTION_FEE + settings.MINUTE_RATE * case['billable_minutes']), 2)
                 )
 
+    def test_calculate_call_rate_with_sample_calls(self):
+        cases = [
+            (datetime(2016, 2, 29, 12, 0, 0), datetime(2016, 2, 29, 14, 0, 0), 120),
+            (datetime(2017, 12, 11, 15, 7, 13), datetime(2017, 12, 11, 15, 14, 56), 7),
+            (datetime(2017, 12, 12, 22, 47, 56), datetime(2017, 12, 12, 22, 50, 56), 0),
+            (datetime(2017, 12, 12, 21, 57, 13), datetime(2017, 12, 12, 22, 10, 56), 2),
+            (datetime(2017, 12, 12, 4, 57, 13), datetime(2017, 12, 12, 6, 10, 56), 10),
+            (datetime(2017, 12, 13, 21, 57, 13), datetime(2017, 12, 14, 22, 10, 56), 962),
+            (datetime(2017, 12, 12, 15, 7, 58), datetime(2017, 12, 12, 15, 12, 56), 4),
+            (datetime(2018, 2, 28, 21, 57, 13), datetime(2018, 3, 1, 22, 10, 56), 962),
+            (datetime(2019, 12, 31, 21, 0, 0), datetime(2020, 1, 2, 7, 0, 0), 1080),
+        ]
+        for index, (start, end, billable_minutes) in enumerate(cases):
+            with self.subTest(index=index):
+                expected = Decimal(str(settings.CONNECTION_FEE)) + Decimal(str(settings.MINUTE_RATE)) * billable_minutes
+                self.assertEqual(calculate_call_rate(start, end), expected.quantize(Decimal('0.01')))
+
+    def test_calculate_call_rate_charges_only_completed_minutes(self):
+        start = datetime(2020, 3, 9, 12, 0, 0, 500000)
+        self.assertEqual(
+            calculate_call_rate(start, start + timedelta(seconds=59, microseconds=499999)),
+            calculate_call_rate(start, start)
+        )
+        self.assertEqual(
+            calculate_call_rate(start, start + timedelta(seconds=60)),
+            calculate_call_rate(start, start) + Decimal(str(settings.MINUTE_RATE))
+        )
+
+    def test_calculate_call_rate_returns_exact_decimal(self):
+        price = calculate_call_rate(datetime(2020, 3, 9, 12, 0, 0), datetime(2020, 3, 9, 12, 7, 0))
+        self.assertIsInstance(price, Decimal)
+        self.assertEqual(price.as_tuple().exponent, -2)
+
     def test_calculate_call_rate_with_incorrect_input_type(self):
         cases = [
             (str('1'), str('1')),
@@ -71,3 +108,35 @@ class CalculateCallRateTestCase(TestCase):
         call_end = today
         with self.assertRaises(InvalidDatePeriodException):
             calculate_call_rate(call_start, call_end)
+
+
+class PriceCallsTestCase(TestCase):
+
+    def test_price_calls_matches_calculate_call_rate(self):
+        random.seed(0)
+        starts, ends = [], []
+        for _ in range(1000):
+            start = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=random.randint(0, 60 * 86400))
+            starts.append(start)
+            ends.append(start + timedelta(seconds=random.randint(0, 3 * 86400), microseconds=random.randint(0, 999999)))
+        expected = [calculate_call_rate(start, end) for start, end in zip(starts, ends)]
+        self.assertListEqual(price_calls(to_datetime64(starts), to_datetime64(ends)), expected)
+
+    def test_price_calls_with_epoch_seconds(self):
+        start = datetime(2017, 12, 13, 21, 57, 13, tzinfo=timezone.utc)
+        end = datetime(2017, 12, 14, 22, 10, 56, tzinfo=timezone.utc)
+        prices = price_calls([int(start.timestamp())], [end.timestamp()])
+        self.assertListEqual(prices, [calculate_call_rate(start, end)])
+
+    def test_price_calls_with_datetime64(self):
+        starts = np.array(['2020-03-09T21:50:00', '2020-03-09T05:00:00'], dtype='datetime64[s]')
+        ends = np.array(['2020-03-09T22:10:00', '2020-03-09T05:30:00'], dtype='datetime64[s]')
+        self.assertListEqual(price_calls(starts, ends), [Decimal('1.26'), Decimal('0.36')])
+
+    def test_price_calls_with_invalid_period(self):
+        with self.assertRaises(InvalidDatePeriodException):
+            price_calls([10], [5])
+
+    def test_price_calls_with_incorrect_input_type(self):
+        with self.assertRaises(TypeError):
+            price_calls(['a'], ['b'])
@@ -1,12 +1,29 @@
+import csv
+import io
+import json
+import os
 import random
+import shutil
+import tempfile
 import uuid
 from datetime import timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
 from django.urls import reverse
 from django.utils import timezone
 from freezegun import freeze_time
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_422_UNPROCESSABLE_ENTITY
+from rest_framework.status import (
+    HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_207_MULTI_STATUS, HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT, HTTP_422_UNPROCESSABLE_ENTITY
+)
 from rest_framework.test import APIClient, APITestCase
-from records.models import CallEndRecord, CallStartRecord
+from records.cache import get_bill_cache
+from records.models import CallEndRecord, CallStartRecord, CompletedCall, MonthlyBill
+from records.queue import get_ingest_queue
+from records.services import create_call_end_record, create_call_start_record
 
 
 @freeze_time('2020-02-01')
@@ -47,15 +64,32 @@ class CallStartRecordAPITestCase(APITestCase):
                 self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
                 self.assertListEqual(response.data[field], expected_errors[field])
 
-    def test_new_call_start_record_with_duplicated_call_id(self):
-        CallStartRecord.objects.create(**self.data)
+    def test_new_call_start_record_received_again(self):
+        call_start_record = create_call_start_record(**self.data)
         response = self.client.post(self.post_url, self.data, format='json')
-        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['id'], call_start_record.pk)
+        self.assertEqual(CallStartRecord.objects.count(), 1)
+
+    def test_call_end_record_is_looked_up_once(self):
+        # Call end record and upsert, which other databases do with a lookup and an insert in a savepoint
+        with self.assertNumQueries(5 if connection.vendor != 'postgresql' else 2):
+            response = self.client.post(self.post_url, self.data, format='json')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        with self.assertNumQueries(2):
+            response = self.client.post(self.post_url, self.data, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_new_call_start_record_with_duplicated_call_id(self):
+        create_call_start_record(**self.data)
+        response = self.client.post(self.post_url, {**self.data, 'source': '1234567890'}, format='json')
+        self.assertEqual(response.status_code, HTTP_409_CONFLICT)
         content = response.json()
         self.assertDictEqual(
             content,
-            {'call_id': ['call start record with this Call Unique ID already exists.']}
+            {'call_id': ['Call start record with this Call Unique ID was already received with different data.']}
         )
+        self.assertEqual(CallStartRecord.objects.get().source, self.data['source'])
 
     def test_new_call_start_record_with_invalid_destination(self):
         data = self.data.copy()
@@ -76,6 +110,23 @@ class CallStartRecordAPITestCase(APITestCase):
         content = response.json()
         self.assertDictEqual(content, {'destination': ['Ensure this field has no more than 11 characters.']})
 
+    def test_new_call_start_record_later_than_call_end_record(self):
+        create_call_end_record(call_id=self.data['call_id'], timestamp=self.data['timestamp'] - timedelta(minutes=5))
+        response = self.client.post(self.post_url, self.data, format='json')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(
+            response.json(),
+            {'timestamp': ['Call start record timestamp cannot be later than call end record timestamp.']}
+        )
+        self.assertFalse(CallStartRecord.objects.exists())
+
+    def test_new_call_start_record_with_invalid_source_in_compact_storage(self):
+        data = dict(self.data, source='99988-52642')
+        with override_settings(RECORDS_COMPACT_STORAGE=True):
+            response = self.client.post(self.post_url, data, format='json')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(response.json(), {'source': ['Phone numbers must contain only numbers, up to 16.']})
+
 
 @freeze_time('2020-02-01')
 class CallEndRecordAPITestCase(APITestCase):
@@ -85,7 +136,7 @@ class CallEndRecordAPITestCase(APITestCase):
         super().setUpClass()
         cls.client = APIClient()
         cls.post_url = reverse('call_end_record_create')
-        cls.call_start_record = CallStartRecord.objects.create(**{
+        cls.call_start_record = create_call_start_record(**{
             'source': '9998852642',
             'destination': '9993468278',
             'call_id': str(uuid.uuid4()),
@@ -128,9 +179,36 @@ class CallEndRecordAPITestCase(APITestCase):
             'timestamp': self.call_start_record.timestamp + timedelta(minutes=5)
         }
         response = self.client.post(self.post_url, data, format='json')
-        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
         content = response.json()
-        self.assertDictEqual(content, {'call_id': ['Given call_id does not exist.']})
+        self.assertIsNone(content['price'])
+        self.assertFalse(CompletedCall.objects.filter(call_id=inexistent_call_id).exists())
+
+        # The call is priced and completed when its call start record arrives
+        start_url = reverse('call_start_record_create')
+        response = self.client.post(start_url, {
+            'source': '9998852642',
+            'destination': '9993468278',
+            'call_id': inexistent_call_id,
+            'timestamp': self.call_start_record.timestamp
+        }, format='json')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(CallEndRecord.objects.get(call_id=inexistent_call_id).price, Decimal('0.36'))
+        self.assertTrue(CompletedCall.objects.filter(call_id=inexistent_call_id).exists())
+
+    def test_create_call_end_record_received_again(self):
+        data = {
+            'call_id': self.call_start_record.call_id,
+            'timestamp': self.call_start_record.timestamp + timedelta(minutes=5)
+        }
+        created = self.client.post(self.post_url, data, format='json').json()
+        response = self.client.post(self.post_url, data, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertDictEqual(response.json(), created)
+        self.assertEqual(CompletedCall.objects.count(), 1)
+        response = self.client.post(self.post_url, {**data, 'timestamp': data['timestamp'] + timedelta(minutes=1)},
+                                    format='json')
+        self.assertEqual(response.status_code, HTTP_409_CONFLICT)
 
     def test_create_call_end_record_with_invalid_timestamp(self):
         invalid_timestamp = self.call_start_record.timestamp - timedelta(minutes=5)
@@ -147,6 +225,44 @@ class CallEndRecordAPITestCase(APITestCase):
         )
 
 
+@freeze_time('2020-02-01')
+class QueuedIngestionAPITestCase(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(
+            RECORDS_INGEST_MODE='queue', RECORDS_INGEST_QUEUE_PATH=os.path.join(directory, 'queue.sqlite3')
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(lambda: get_ingest_queue().close())
+        self.call_id = str(uuid.uuid4())
+        self.start = {
+            'source': '9998852642',
+            'destination': '9993468278',
+            'call_id': self.call_id,
+            'timestamp': timezone.now()
+        }
+
+    def test_records_are_queued(self):
+        response = self.client.post(reverse('call_start_record_create'), self.start, format='json')
+        self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+        end = {'call_id': self.call_id, 'timestamp': timezone.now() + timedelta(minutes=5)}
+        response = self.client.post(reverse('call_end_record_create'), end, format='json')
+        self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+        self.assertSetEqual(set(response.json().keys()), {'call_id', 'timestamp'})
+        self.assertFalse(CallStartRecord.objects.exists())
+        self.assertDictEqual(get_ingest_queue().get_stats()['pending'], {'start': 1, 'end': 1})
+
+    def test_invalid_records_are_not_queued(self):
+        data = self.start.copy()
+        del data['source']
+        response = self.client.post(reverse('call_start_record_create'), data, format='json')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(get_ingest_queue().get_stats()['pending'], {'start': 0, 'end': 0})
+
+
 @freeze_time('2020-02-01')
 class TelephonyBillAPITestCase(APITestCase):
 
@@ -160,48 +276,48 @@ class TelephonyBillAPITestCase(APITestCase):
         # Record that started in the last day of month and ended in the first day of next month
         call_id = str(uuid.uuid4())
         cls.intermonths_billable_record = (
-            CallStartRecord.objects.create(call_id=call_id, source=cls.source, destination=destination,
+            create_call_start_record(call_id=call_id, source=cls.source, destination=destination,
                                            timestamp=today.replace(hour=5) - timedelta(days=1)),
-            CallEndRecord.objects.create(call_id=call_id, timestamp=today.replace(hour=5, minute=5))
+            create_call_end_record(call_id=call_id, timestamp=today.replace(hour=5, minute=5))
         )
 
         # Record that has price of 0
         call_id = str(uuid.uuid4())
         cls.free_of_charge_record = (
-            CallStartRecord.objects.create(call_id=call_id, source=cls.source, destination=destination,
+            create_call_start_record(call_id=call_id, source=cls.source, destination=destination,
                                            timestamp=last_month.replace(hour=5)),
-            CallEndRecord.objects.create(call_id=call_id, timestamp=last_month.replace(hour=5, minute=5))
+            create_call_end_record(call_id=call_id, timestamp=last_month.replace(hour=5, minute=5))
         )
 
         # Record that is priced
         call_id = str(uuid.uuid4())
         cls.billable_record = (
-            CallStartRecord.objects.create(call_id=call_id, source=cls.source, destination=destination,
+            create_call_start_record(call_id=call_id, source=cls.source, destination=destination,
                                            timestamp=last_month.replace(hour=6)),
-            CallEndRecord.objects.create(call_id=call_id, timestamp=last_month.replace(hour=6, minute=5))
+            create_call_end_record(call_id=call_id, timestamp=last_month.replace(hour=6, minute=5))
         )
 
         # Record whose call started one day and ended the other, but it has price of 0
         call_id = str(uuid.uuid4())
         cls.interdays_unbillable_record = (
-            CallStartRecord.objects.create(call_id=call_id, source=cls.source, destination=destination,
+            create_call_start_record(call_id=call_id, source=cls.source, destination=destination,
                                            timestamp=last_month.replace(hour=22)),
-            CallEndRecord.objects.create(call_id=call_id,
+            create_call_end_record(call_id=call_id,
                                          timestamp=(last_month + timedelta(days=1)).replace(hour=5, minute=55))
         )
 
         # Record whose call started one day and ended another day, but it is priced
         call_id = str(uuid.uuid4())
         cls.interdays_billable_record = (
-            CallStartRecord.objects.create(call_id=call_id, source=cls.source, destination=destination,
+            create_call_start_record(call_id=call_id, source=cls.source, destination=destination,
                                            timestamp=last_month.replace(hour=6)),
-            CallEndRecord.objects.create(call_id=call_id, timestamp=(last_month + timedelta(days=2)).replace(hour=22))
+            create_call_end_record(call_id=call_id, timestamp=(last_month + timedelta(days=2)).replace(hour=22))
         )
 
         # Random record of same source from current month
         call_id = str(uuid.uuid4())
-        CallStartRecord.objects.create(call_id=call_id, timestamp=today, source=cls.source, destination=destination)
-        CallEndRecord.objects.create(call_id=call_id, timestamp=today + timedelta(seconds=60))
+        create_call_start_record(call_id=call_id, timestamp=today, source=cls.source, destination=destination)
+        create_call_end_record(call_id=call_id, timestamp=today + timedelta(seconds=60))
 
         # Random records to populate database and make it possible to check for correct bill results
         for _ in range(10):
@@ -210,8 +326,8 @@ class TelephonyBillAPITestCase(APITestCase):
                                           minutes=random.randint(0, 59))
             source = '123'
             destination = ''.join([str(random.randint(1, 9)) for i in range(random.randint(10, 11))])
-            CallStartRecord.objects.create(call_id=call_id, timestamp=timestamp, source=source, destination=destination)
-            CallEndRecord.objects.create(call_id=call_id, timestamp=timestamp + timedelta(seconds=random.randint(0, 9000)))
+            create_call_start_record(call_id=call_id, timestamp=timestamp, source=source, destination=destination)
+            create_call_end_record(call_id=call_id, timestamp=timestamp + timedelta(seconds=random.randint(0, 9000)))
 
     @classmethod
     def setUpClass(cls):
@@ -219,6 +335,9 @@ class TelephonyBillAPITestCase(APITestCase):
         cls.client = APIClient()
         cls.url = '/v1/call-records/bills/'
 
+    def setUp(self):
+        get_bill_cache().clear()
+
     def test_retrieve_telephony_bill(self):
         response = self.client.get(self.url, {'source': self.source})
         self.assertEqual(response.status_code, HTTP_200_OK)
@@ -229,6 +348,9 @@ class TelephonyBillAPITestCase(APITestCase):
         end_period = '2020-02-01T00:00:00Z'
         self.assertEqual(content['start_period'], start_period)
         self.assertEqual(content['end_period'], end_period)
+        self.assertEqual(content['summary']['call_count'], 4)
+        self.assertEqual(content['summary']['total'],
+                         str(sum(Decimal(result['price']) for result in content['results'])))
 
     def test_retrieve_telephony_bill_of_this_month(self):
         today = timezone.now().date().strftime('%Y-%m')
@@ -250,8 +372,231 @@ class TelephonyBillAPITestCase(APITestCase):
             {'period': "You can't get bills from next months."}
         )
 
+    def test_retrieve_telephony_bill_of_next_year(self):
+        response = self.client.get(self.url, {'period': '2021-01', 'source': self.source})
+        self.assertEqual(response.status_code, HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertDictEqual(response.json(), {'period': "You can't get bills from next months."})
+
+    def test_retrieve_telephony_bill_is_served_from_snapshot(self):
+        first = self.client.get(self.url, {'source': self.source, 'page_size': 2}).json()
+        self.assertEqual(MonthlyBill.objects.filter(source=self.source).count(), 1)
+        second = self.client.get(self.url, {'source': self.source, 'page_size': 2}).json()
+        self.assertDictEqual(first, second)
+        self.assertEqual(second['count'], 4)
+
+    def test_retrieve_telephony_bill_with_cursor_pagination(self):
+        expected = self.client.get(self.url, {'source': self.source}).json()['results']
+        response = self.client.get(self.url, {'source': self.source, 'pagination': 'cursor', 'page_size': 3})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        first_page = response.json()
+        self.assertEqual(first_page['count'], 4)
+        self.assertIsNone(first_page['links']['previous'])
+        self.assertListEqual(first_page['results'], expected[:3])
+
+        second_page = self.client.get(first_page['links']['next']).json()
+        self.assertIsNone(second_page['links']['next'])
+        self.assertListEqual(second_page['results'], expected[3:])
+
+        previous_page = self.client.get(second_page['links']['previous']).json()
+        self.assertListEqual(previous_page['results'], expected[:3])
+        self.assertIsNone(previous_page['links']['previous'])
+        self.assertEqual(previous_page['links']['next'], first_page['links']['next'])
+
+    def test_retrieve_telephony_bill_with_etag(self):
+        response = self.client.get(self.url, {'source': self.source, 'page_size': 2})
+        etag = response['ETag']
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        self.assertNotEqual(self.client.get(self.url, {'source': self.source, 'page_size': 3})['ETag'], etag)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'source': self.source, 'page_size': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_retrieve_telephony_bill_of_source_without_calls(self):
+        response = self.client.get(self.url, {'source': '1111111111'})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 0)
+        self.assertFalse(MonthlyBill.objects.exists())
+        # A late call makes a bill whose responses differ from the empty ones
+        call_id = str(uuid.uuid4())
+        last_month = timezone.now().replace(month=1, day=20, hour=12)
+        create_call_start_record(call_id=call_id, source='1111111111', destination='9993468278', timestamp=last_month)
+        create_call_end_record(call_id=call_id, timestamp=last_month + timedelta(minutes=1))
+        etag = response['ETag']
+        response = self.client.get(self.url, {'source': '1111111111'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_retrieve_telephony_bill_with_etag_of_previous_version(self):
+        etag = self.client.get(self.url, {'source': self.source})['ETag']
+        MonthlyBill.objects.filter(source=self.source).update(is_stale=True, version=F('version') + 1)
+        response = self.client.get(self.url, {'source': self.source}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_retrieve_telephony_bill_is_cached(self):
+        expected = self.client.get(self.url, {'source': self.source, 'page_size': 2}).json()
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'source': self.source, 'page_size': 2})
+        self.assertDictEqual(response.json(), expected)
+        self.assertEqual(get_bill_cache().get_stats()['local_hits'], 1)
+
+    def test_late_call_invalidates_cached_bill(self):
+        self.client.get(self.url, {'source': self.source})
+        call_id = str(uuid.uuid4())
+        last_month = timezone.now().replace(month=1, day=20, hour=12)
+        create_call_start_record(call_id=call_id, source=self.source, destination='9993468278', timestamp=last_month)
+        create_call_end_record(call_id=call_id, timestamp=last_month + timedelta(minutes=1))
+        self.assertEqual(get_bill_cache().get_stats()['entries'], 0)
+        content = self.client.get(self.url, {'source': self.source}).json()
+        self.assertEqual(content['count'], 5)
+
+    def test_rebuild_usage_invalidates_cached_bill(self):
+        self.client.get(self.url, {'source': self.source})
+        call_command('rebuild_usage', period='2020-01', stdout=io.StringIO())
+        self.assertEqual(get_bill_cache().get_stats()['entries'], 0)
+
+    def test_retrieve_telephony_bill_with_invalid_cursor(self):
+        response = self.client.get(self.url, {'source': self.source, 'pagination': 'cursor', 'cursor': 'invalid'})
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+        self.assertDictEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_export_telephony_bill_as_ndjson(self):
+        expected = self.client.get(self.url, {'source': self.source, 'page_size': 100}).json()['results']
+        response = self.client.get(self.url + 'export/', {'source': self.source})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="bill-{self.source}-2020-01.ndjson"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertListEqual([json.loads(line) for line in lines], expected)
+
+    def test_export_telephony_bill_as_csv(self):
+        expected = self.client.get(self.url, {'source': self.source, 'page_size': 100}).json()['results']
+        response = self.client.get(self.url + 'export/', {'source': self.source, 'output': 'csv'})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        content = b''.join(response.streaming_content).decode()
+        self.assertListEqual(list(csv.DictReader(io.StringIO(content))), expected)
+
+    def test_export_telephony_bill_with_invalid_output(self):
+        response = self.client.get(self.url + 'export/', {'source': self.source, 'output': 'xml'})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(response.json(), {'output': 'Output must be one of: ndjson, csv.'})
+
     def test_retrieve_telephony_bill_without_source(self):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
         content = response.json()
         self.assertDictEqual(content, {'source': 'This field is required.'})
+
+
+@freeze_time('2020-02-01')
+class CallStartRecordBatchAPITestCase(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = APIClient()
+        cls.post_url = reverse('call_start_record_batch_create')
+
+    def _build_record(self, **kwargs):
+        record = {
+            'source': '9998852642',
+            'destination': '9993468278',
+            'call_id': str(uuid.uuid4()),
+            'timestamp': timezone.now()
+        }
+        record.update(kwargs)
+        return record
+
+    def test_create_call_start_records(self):
+        data = [self._build_record() for _ in range(5)]
+        response = self.client.post(self.post_url, data, format='json')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(CallStartRecord.objects.count(), 5)
+        content = response.json()
+        self.assertEqual(content['created'], 5)
+        self.assertEqual(content['failed'], 0)
+        self.assertListEqual([result['data']['call_id'] for result in content['results']],
+                             [record['call_id'] for record in data])
+
+    def test_create_call_start_records_with_invalid_items(self):
+        existing = self._build_record()
+        create_call_start_record(**existing)
+        duplicated = self._build_record()
+        data = [
+            self._build_record(destination='123'),
+            existing,
+            duplicated,
+            duplicated,
+            self._build_record()
+        ]
+        response = self.client.post(self.post_url, data, format='json')
+        self.assertEqual(response.status_code, HTTP_207_MULTI_STATUS)
+        self.assertEqual(CallStartRecord.objects.count(), 3)
+        content = response.json()
+        self.assertEqual(content['created'], 2)
+        self.assertEqual(content['failed'], 3)
+        statuses = [result['status'] for result in content['results']]
+        self.assertListEqual(statuses, [400, 400, 201, 400, 201])
+        duplicated_error = {'call_id': ['call start record with this Call Unique ID already exists.']}
+        self.assertDictEqual(content['results'][1]['errors'], duplicated_error)
+        self.assertDictEqual(content['results'][3]['errors'], duplicated_error)
+
+    def test_create_call_start_records_requires_list(self):
+        response = self.client.post(self.post_url, self._build_record(), format='json')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertDictEqual(response.json(), {'non_field_errors': ['Expected a list of items but got type "dict".']})
+
+
+@freeze_time('2020-02-01')
+class CallEndRecordBatchAPITestCase(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.client = APIClient()
+        cls.post_url = reverse('call_end_record_batch_create')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.call_start_records = [
+            create_call_start_record(source='9998852642', destination='9993468278', call_id=str(uuid.uuid4()),
+                                           timestamp=timezone.now().replace(hour=12))
+            for _ in range(3)
+        ]
+
+    def test_create_call_end_records(self):
+        data = [
+            {'call_id': record.call_id, 'timestamp': record.timestamp + timedelta(minutes=5)}
+            for record in self.call_start_records
+        ]
+        response = self.client.post(self.post_url, data, format='json')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(CallEndRecord.objects.count(), 3)
+        content = response.json()
+        self.assertSetEqual({result['data']['price'] for result in content['results']}, {'0.81'})
+        self.assertSetEqual(set(CallEndRecord.objects.values_list('price', flat=True)), {Decimal('0.81')})
+
+    def test_create_call_end_records_with_invalid_items(self):
+        first, second, third = self.call_start_records
+        data = [
+            {'call_id': str(uuid.uuid4()), 'timestamp': first.timestamp},
+            {'call_id': first.call_id, 'timestamp': first.timestamp - timedelta(minutes=5)},
+            {'call_id': second.call_id, 'timestamp': second.timestamp + timedelta(minutes=5)},
+            {'call_id': second.call_id, 'timestamp': second.timestamp + timedelta(minutes=5)},
+            {'call_id': third.call_id}
+        ]
+        response = self.client.post(self.post_url, data, format='json')
+        self.assertEqual(response.status_code, HTTP_207_MULTI_STATUS)
+        self.assertEqual(CallEndRecord.objects.count(), 2)
+        results = response.json()['results']
+        self.assertListEqual([result['status'] for result in results], [201, 400, 201, 400, 400])
+        self.assertIsNone(results[0]['data']['price'])
+        self.assertEqual(results[2]['data']['price'], '0.81')
+        self.assertDictEqual(
+            results[1]['errors'],
+            {'timestamp': ['Call end record timestamp cannot be earlier than call start record timestamp.']}
+        )
+        self.assertDictEqual(results[4]['errors'], {'timestamp': ['This field is required.']})
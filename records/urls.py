@@ -1,6 +1,9 @@
 from django.urls import path
 from rest_framework.routers import SimpleRouter
-from .views import CallEndRecordAPIView, CallStartRecordAPIView, TelephonyBillViewSet
+from .views import (
+    CallEndRecordAPIView, CallEndRecordBatchAPIView, CallStartRecordAPIView, CallStartRecordBatchAPIView,
+    TelephonyBillViewSet
+)
 
 router = SimpleRouter()
 
@@ -8,5 +11,7 @@ router.register('bills', TelephonyBillViewSet, basename='bills')
 
 urlpatterns = [
     path('started/', CallStartRecordAPIView.as_view(), name='call_start_record_create'),
+    path('started/batch/', CallStartRecordBatchAPIView.as_view(), name='call_start_record_batch_create'),
     path('finished/', CallEndRecordAPIView.as_view(), name='call_end_record_create'),
+    path('finished/batch/', CallEndRecordBatchAPIView.as_view(), name='call_end_record_batch_create'),
 ] + router.urls
@@ -1,57 +1,150 @@
 from datetime import datetime, timedelta
-from decimal import Decimal
-from django.conf import settings
+from decimal import ROUND_HALF_UP, Decimal
+import numpy as np
 from .exceptions import InvalidDatePeriodException
+from .tariffs import (
+    EPOCH, MICROSECONDS_PER_DAY, MICROSECONDS_PER_SECOND, STANDARD_TIME, CompiledTariff, get_tariff_table,
+    split_moment, time_to_microseconds
+)
 
-MINUTE_RATE = settings.MINUTE_RATE
-CONNECTION_FEE = settings.CONNECTION_FEE
+PRICE_QUANTUM = Decimal('0.01')
+MICROSECONDS_PER_MINUTE = 60 * MICROSECONDS_PER_SECOND
 
 
 def calculate_call_rate(call_start: datetime, call_end: datetime) -> Decimal:
+    """
+    Price a call with the tariff in effect at its start. Every completed minute of the call in a band of the tariff is
+    charged with the rate of the band.
+    """
     if not isinstance(call_start, datetime) or not isinstance(call_end, datetime):
         raise TypeError('Params call_start and call_end must be a datetime object.')
     if call_start > call_end:
         raise InvalidDatePeriodException('Starting date cannot be higher than ending date.')
-    minute_rate = 0
-    billable_minutes = 0
-    call_seconds = 0
-    # Check if call started one day and ended the other
-    if call_start.date() != call_end.date():
-        # Check how many full days between call started and ended
-        full_days = 0
-        while (call_start.date() + timedelta(days=full_days)) != (call_end.date() - timedelta(days=1)):
-            full_days += 1
-        if full_days:
-            call_seconds += full_days * 16 * 60 * 60  # Consider one full day of talk
-
-        # Calculate how many seconds were talked on call starting day
-        start_date = call_start.replace(hour=6, minute=0, second=0, microsecond=0)
-        end_date = call_start.replace(hour=22, minute=0, second=0, microsecond=0)
-        if call_start < start_date:
-            call_start = start_date
-        if call_start < end_date:
-            call_seconds += int((end_date - call_start).total_seconds())
-
-        # Calculate how many seconds were talked on call ending day
-        start_date = call_end.replace(hour=6, minute=0, second=0, microsecond=0)
-        end_date = call_end.replace(hour=22, minute=0, second=0, microsecond=0)
-        if call_end > end_date:
-            call_end = end_date
-        if call_end >= start_date:
-            call_seconds += int((call_end - start_date).total_seconds())
-    else:
-        start_date = call_end.replace(hour=6, minute=0, second=0, microsecond=0)
-        end_date = call_end.replace(hour=22, minute=0, second=0, microsecond=0)
-        if call_start < start_date:
-            call_start = call_start.replace(hour=6, minute=0, second=0, microsecond=0)
-        if call_end > end_date:
-            call_end = call_end.replace(hour=22, minute=0, second=0, microsecond=0)
-        call_seconds += int((call_end - call_start).total_seconds())
-
-    billable_minutes += call_seconds // 60
-    if billable_minutes > 0:
-        minute_rate = MINUTE_RATE
-    cost = CONNECTION_FEE + (minute_rate * billable_minutes)
-    # Round cost to 2 decimal places
-    cost = str(round(cost, 2))
-    return Decimal(cost)
+    start_day, start_time = split_moment(call_start)
+    end_day, end_time = split_moment(call_end)
+    tariff = get_tariff_table().get_tariff(start_day * MICROSECONDS_PER_DAY + start_time)
+    cost = tariff.connection_fee
+    for band in tariff.bands:
+        # Band time from the first day of the call until its end, minus the band time of that day before its start
+        time_in_band = (
+            (end_day - start_day) * band.length
+            + min(max(end_time - band.start, 0), band.length)
+            - min(max(start_time - band.start, 0), band.length)
+        )
+        # There is no fractioned charge, only completed minutes are billed
+        cost += band.minute_rate * (time_in_band // MICROSECONDS_PER_MINUTE)
+    return cost.quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def to_datetime64(moments) -> np.ndarray:
+    """
+    Convert a sequence of aware datetimes to a datetime64 array in UTC.
+    """
+    microseconds = [(moment - EPOCH) // timedelta(microseconds=1) for moment in moments]
+    return np.array(microseconds, dtype=np.int64).astype('datetime64[us]')
+
+
+def _to_epoch_microseconds(values) -> np.ndarray:
+    """
+    Convert an array of datetime64 or a sequence of epoch seconds to an int64 array of epoch microseconds (UTC).
+    """
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[us]').astype(np.int64)
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64) * MICROSECONDS_PER_SECOND
+    if np.issubdtype(values.dtype, np.floating):
+        return np.round(values * MICROSECONDS_PER_SECOND).astype(np.int64)
+    raise TypeError('Params starts and ends must be datetime64 arrays or sequences of epoch seconds.')
+
+
+def _get_band_time(days, start_times, end_times, band_start: int, band_length: int) -> np.ndarray:
+    # Band time from the first day of each call until its end, minus the band time of that day before its start
+    return (
+        days * band_length
+        + np.clip(end_times - band_start, 0, band_length)
+        - np.clip(start_times - band_start, 0, band_length)
+    )
+
+
+def _price_calls_in_cents(tariff: CompiledTariff, days, start_times, end_times) -> np.ndarray:
+    # Rates are scaled to integers, so the cost is exact and rounded half up to cents like calculate_call_rate
+    cost = np.full(days.shape, tariff.scaled_connection_fee, dtype=np.int64)
+    for band in tariff.bands:
+        time_in_band = _get_band_time(days, start_times, end_times, band.start, band.length)
+        cost += band.scaled_minute_rate * (time_in_band // MICROSECONDS_PER_MINUTE)
+    cents_divisor = 10 ** (-2 - tariff.exponent)
+    return (cost + cents_divisor // 2) // cents_divisor
+
+
+def _count_billable_minutes(tariff: CompiledTariff, days, start_times, end_times) -> np.ndarray:
+    minutes = np.zeros(days.shape, dtype=np.int64)
+    for band in tariff.bands:
+        minutes += _get_band_time(days, start_times, end_times, band.start, band.length) // MICROSECONDS_PER_MINUTE
+    return minutes
+
+
+def _apply_tariffs(function, starts, ends) -> np.ndarray:
+    """
+    Call function with the tariff in effect at the start of the calls and their days and times of the day, for each
+    group of calls under the same tariff, and return the results in the order of the calls.
+    """
+    starts = _to_epoch_microseconds(starts)
+    ends = _to_epoch_microseconds(ends)
+    if starts.shape != ends.shape:
+        raise ValueError('Params starts and ends must have the same length.')
+    if np.any(starts > ends):
+        raise InvalidDatePeriodException('Starting date cannot be higher than ending date.')
+    start_days, start_times = np.divmod(starts, MICROSECONDS_PER_DAY)
+    end_days, end_times = np.divmod(ends, MICROSECONDS_PER_DAY)
+    days = end_days - start_days
+
+    table = get_tariff_table()
+    indexes = table.get_tariff_indexes(starts)
+    tariff_indexes = np.unique(indexes)
+    if len(tariff_indexes) <= 1:
+        # Calls of a batch are usually under the same tariff
+        tariff = table.tariffs[tariff_indexes[0] if len(tariff_indexes) else 0]
+        return function(tariff, days, start_times, end_times)
+    results = np.empty(starts.shape, dtype=np.int64)
+    for index in tariff_indexes:
+        calls = indexes == index
+        results[calls] = function(table.tariffs[index], days[calls], start_times[calls], end_times[calls])
+    return results
+
+
+def price_calls_in_cents(starts, ends) -> np.ndarray:
+    """
+    Vectorized version of calculate_call_rate. Returns an int64 array with the price of each call in cents.
+    Timestamps are taken as UTC, which is the time zone calls are stored in.
+    """
+    return _apply_tariffs(_price_calls_in_cents, starts, ends)
+
+
+def count_billable_minutes(starts, ends) -> np.ndarray:
+    """
+    Return an int64 array with the number of minutes charged by the rates of the tariff bands of each call.
+    """
+    return _apply_tariffs(_count_billable_minutes, starts, ends)
+
+
+def measure_standard_time(starts, ends) -> np.ndarray:
+    """
+    Return an int64 array with the microseconds of each call in standard time, from 06:00 to 22:00, regardless of the
+    tariff it was priced with. The rest of the call is in reduced time.
+    """
+    starts = _to_epoch_microseconds(starts)
+    ends = _to_epoch_microseconds(ends)
+    start_days, start_times = np.divmod(starts, MICROSECONDS_PER_DAY)
+    end_days, end_times = np.divmod(ends, MICROSECONDS_PER_DAY)
+    standard_time_start, standard_time_end = (time_to_microseconds(moment) for moment in STANDARD_TIME)
+    return _get_band_time(end_days - start_days, start_times, end_times, standard_time_start,
+                          standard_time_end - standard_time_start)
+
+
+def price_calls(starts, ends) -> list:
+    """
+    Price many calls at once. Accepts datetime64 arrays or sequences of epoch seconds and returns a list of Decimal
+    prices equal to the ones calculate_call_rate gives for each pair.
+    """
+    return [Decimal(cents).scaleb(-2) for cents in price_calls_in_cents(starts, ends).tolist()]
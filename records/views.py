@@ -1,34 +1,177 @@
-import calendar
+import hashlib
 from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import parse_etags, patch_cache_control, quote_etag
+from django.utils.text import capfirst
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
-from rest_framework.generics import CreateAPIView
+from rest_framework.generics import CreateAPIView, GenericAPIView
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.status import (
+    HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_207_MULTI_STATUS, HTTP_304_NOT_MODIFIED
+)
 from rest_framework.viewsets import GenericViewSet
-from .exceptions import UnprocessableEntityError
-from .models import CallEndRecord
-from .pagination import TelephonyBillPagination
-from .serializers import CallEndRecordCreateSerializer, CallRecordSerializer, CallStartRecordSerializer
+from .billing import BILL_LINE_FIELDS, get_bill, get_bill_version, get_period_range, get_usage
+from .cache import get_bill_cache
+from .exceptions import ConflictError, UnprocessableEntityError
+from .formatters import format_bill_rows, format_usage, stream_csv, stream_ndjson
+from .metrics import Gauge, register, render_metrics, timed
+from .models import BillLine
+from .pagination import TelephonyBillCursorPagination, TelephonyBillPagination
+from .queue import CALL_END, CALL_START, get_ingest_queue, is_queue_mode
+from .serializers import (
+    CallEndRecordBatchSerializer, CallEndRecordCreateSerializer, CallRecordSerializer, CallStartRecordBatchSerializer,
+    CallStartRecordSerializer
+)
+from .services import create_call_end_records, create_call_start_records, get_unpaired_backlog, is_same_record
 
 
-class CallStartRecordAPIView(CreateAPIView):
+def collect_bill_cache_stats():
+    stats = get_bill_cache().get_stats()
+    return [(('entries',), stats['entries']), (('local_hits',), stats['local_hits']),
+            (('shared_hits',), stats['shared_hits']), (('misses',), stats['misses'])]
+
+
+def collect_ingest_queue_stats():
+    if not is_queue_mode():
+        return []
+    stats = get_ingest_queue().get_stats()
+    return [((kind,), pending) for kind, pending in stats['pending'].items()] + [(('failed',), stats['failed'])]
+
+
+def collect_unpaired_backlog():
+    return [((), get_unpaired_backlog()['size'])]
+
+
+register(Gauge('records_bill_cache', 'Entries and lookups of the bill cache of this process.', collect_bill_cache_stats,
+               ('stat',)))
+register(Gauge('records_ingest_queue_items', 'Items pending in the ingest queue by kind, and failed items.',
+               collect_ingest_queue_stats, ('kind',)))
+register(Gauge('records_unpaired_call_end_records', 'Call end records waiting for their call start record.',
+               collect_unpaired_backlog))
+
+
+def metrics(request):
+    """
+    Metrics of this process in the Prometheus text format.
+    """
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class QueuedCreateAPIView(CreateAPIView):
+    """
+    Create view that, in queue ingestion mode, only validates the shape of the record and appends it to the ingest
+    queue, answering 202 without waiting for the database. Queued records are stored by the drain_ingest_queue command.
+    Otherwise records received again, e.g. retried by a switch, are answered with the stored record and 200, and
+    records with the call id of a different stored record with 409.
+    """
+    queued_serializer_class = None
+    queue_kind = None
+
+    def create(self, request, *args, **kwargs):
+        if not is_queue_mode():
+            return self.create_idempotent(request)
+        serializer = self.queued_serializer_class(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        get_ingest_queue().put(self.queue_kind, serializer.data)
+        return Response(serializer.data, status=HTTP_202_ACCEPTED)
+
+    def create_idempotent(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        record = serializer.save()
+        if serializer.created:
+            return Response(serializer.data, status=HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
+        if not is_same_record(record, serializer.validated_data):
+            raise ConflictError({'call_id': [
+                f'{capfirst(record._meta.verbose_name)} with this {record._meta.get_field("call_id").verbose_name} '
+                'was already received with different data.'
+            ]})
+        return Response(serializer.data, status=HTTP_200_OK)
+
+
+class CallStartRecordAPIView(QueuedCreateAPIView):
     serializer_class = CallStartRecordSerializer
+    queued_serializer_class = CallStartRecordBatchSerializer
+    queue_kind = CALL_START
 
 
-class CallEndRecordAPIView(CreateAPIView):
+class CallEndRecordAPIView(QueuedCreateAPIView):
     serializer_class = CallEndRecordCreateSerializer
+    queued_serializer_class = CallEndRecordBatchSerializer
+    queue_kind = CALL_END
+
+
+class BatchCreateAPIView(GenericAPIView):
+    """
+    Base view that receives a list of records and stores the valid ones in bulk, returning one result per item.
+    """
+    max_batch_size = 10000
+    create_records = None
+
+    def get_items(self, data) -> list:
+        if not isinstance(data, list):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [f'Expected a list of items but got type "{type(data).__name__}".']
+            })
+        if not data:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ['This list may not be empty.']})
+        if len(data) > self.max_batch_size:
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [f'Ensure this list has no more than {self.max_batch_size} items.']
+            })
+        return data
+
+    def post(self, request, *args, **kwargs):
+        items = self.get_items(request.data)
+        results = self.create_records(items, self.get_serializer())
+        created = sum(1 for result in results if result['status'] == HTTP_201_CREATED)
+        status = HTTP_201_CREATED if created == len(results) else HTTP_207_MULTI_STATUS
+        return Response({'created': created, 'failed': len(results) - created, 'results': results}, status=status)
+
+
+class CallStartRecordBatchAPIView(BatchCreateAPIView):
+    serializer_class = CallStartRecordBatchSerializer
+    create_records = staticmethod(create_call_start_records)
+
+
+class CallEndRecordBatchAPIView(BatchCreateAPIView):
+    serializer_class = CallEndRecordBatchSerializer
+    create_records = staticmethod(create_call_end_records)
 
 
 class TelephonyBillViewSet(GenericViewSet):
-    pagination_class = TelephonyBillPagination
     serializer_class = CallRecordSerializer
+    pagination_query_param = 'pagination'
+    export_formats = {
+        'ndjson': (stream_ndjson, 'application/x-ndjson'),
+        'csv': (stream_csv, 'text/csv')
+    }
+    export_chunk_size = 2000
+
+    @property
+    def pagination_class(self):
+        request = getattr(self, 'request', None)
+        if request is not None and request.query_params.get(self.pagination_query_param) == 'cursor':
+            return TelephonyBillCursorPagination
+        return TelephonyBillPagination
 
     def get_queryset(self):
         source = self.request.query_params.get('source')
         period = self.request.query_params.get('period', None)
         period = self._clean_period(period)
         from_date, to_date = self._get_search_period(period)
-        queryset = CallEndRecord.objects.get_calls(from_date, to_date, source=source)
+        # Periods are closed, so bills are served from a snapshot that already knows its number of calls
+        bill = get_bill(source, from_date, to_date)
+        self.result_count = bill.call_count
+        self.bill_version = bill.version
+        # Empty bills of sources without calls are not stored
+        lines = bill.lines.all() if bill.pk is not None else BillLine.objects.none()
+        queryset = lines.order_by('end', 'call_id').values(*BILL_LINE_FIELDS)
         return queryset
 
     def _clean_period(self, period=None):
@@ -43,38 +186,102 @@ class TelephonyBillViewSet(GenericViewSet):
             same_month = today.month == period.month
             if same_year and same_month:
                 raise UnprocessableEntityError({'period': "You can't get bills from current month."})
-            elif same_year and today.month < period.month:
+            elif (today.year, today.month) < (period.year, period.month):
                 raise UnprocessableEntityError({'period': "You can't get bills from next months."})
         else:
             period = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
         return period
 
     def _get_search_period(self, period: datetime) -> tuple:
-        start = period
-        _, last_day_of_month = calendar.monthrange(period.year, period.month)
-        end = start.replace(day=last_day_of_month) + timedelta(days=1)
-        return start, end
+        return get_period_range(period)
 
-    def list(self, request, *args, **kwargs):
+    def _get_source(self) -> str:
         source = self.request.query_params.get('source', None)
         if not source:
             raise ValidationError({'source': 'This field is required.'})
+        return source
+
+    def _get_params(self) -> str:
+        return urlencode(sorted(self.request.query_params.lists()), doseq=True)
+
+    def get_etag(self, source: str, period: datetime, version: int) -> str:
+        """
+        Strong ETag of a bill response, derived from the bill, its data version and the query params that shape the
+        response, like page and page_size.
+        """
+        key = f'{self.action}:{source}:{period:%Y-%m}:{version}:{self._get_params()}'
+        return quote_etag(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get_cache_key(self, source: str, period: datetime, version: int) -> tuple:
+        # Pagination links are absolute, so responses are cached per host
+        return source, period.date(), version, f'{self.request.get_host()}?{self._get_params()}'
+
+    def is_not_modified(self, etag: str) -> bool:
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if not if_none_match:
+            return False
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags or f'W/{etag}' in etags
+
+    def set_cache_headers(self, response, etag: str):
+        # Only closed periods are served, so bills can be cached for long and revalidated with their ETag
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=settings.RECORDS_BILL_CACHE_MAX_AGE)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        source = self._get_source()
         period = self.request.query_params.get('period', None)
         period = self._clean_period(period)
         from_date, to_date = self._get_search_period(period)
+        # The version of an up to date bill is enough to answer conditional and cached requests
+        version = get_bill_version(source, from_date)
+        if version is not None:
+            etag = self.get_etag(source, from_date, version)
+            if self.is_not_modified(etag):
+                return self.set_cache_headers(Response(status=HTTP_304_NOT_MODIFIED), etag)
+            data = get_bill_cache().get(self.get_cache_key(source, from_date, version))
+            if data is not None:
+                return self.set_cache_headers(Response(data), etag)
         queryset = self.get_queryset()
         page = self.paginate_queryset(queryset)
         data = None
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            r = self.get_paginated_response(serializer.data)
-            data = r.data
-        else:
-            serializer = self.get_serializer(queryset, many=True)
-            data = serializer.data
-        return Response({
+        # Rows are formatted without the serializer, which gives the same output at a fraction of the cost
+        with timed('serialize'):
+            if page is not None:
+                r = self.get_paginated_response(format_bill_rows(page))
+                data = r.data
+            else:
+                data = format_bill_rows(queryset)
+        data = {
             'source': source,
             'start_period': from_date,
             'end_period': to_date,
+            # Totals of the period are kept up to date as calls are completed, instead of being summed here
+            'summary': format_usage(get_usage(source, from_date)),
             **data
-        })
+        }
+        get_bill_cache().set(self.get_cache_key(source, from_date, self.bill_version), data)
+        return self.set_cache_headers(Response(data), self.get_etag(source, from_date, self.bill_version))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        """
+        Stream the whole bill, without pagination, as NDJSON or CSV according to the output query param.
+        """
+        source = self._get_source()
+        output = request.query_params.get('output', 'ndjson')
+        if output not in self.export_formats:
+            raise ValidationError({'output': f'Output must be one of: {", ".join(self.export_formats)}.'})
+        stream, content_type = self.export_formats[output]
+        period = self._clean_period(request.query_params.get('period', None))
+        from_date, _ = self._get_search_period(period)
+        version = get_bill_version(source, from_date)
+        if version is not None:
+            etag = self.get_etag(source, from_date, version)
+            if self.is_not_modified(etag):
+                return self.set_cache_headers(Response(status=HTTP_304_NOT_MODIFIED), etag)
+        rows = self.get_queryset().iterator(chunk_size=self.export_chunk_size)
+        response = StreamingHttpResponse(stream(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="bill-{source}-{period:%Y-%m}.{output}"'
+        return self.set_cache_headers(response, self.get_etag(source, from_date, self.bill_version))
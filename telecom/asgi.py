@@ -0,0 +1,10 @@
+import os
+from django.conf import settings
+from records.asgi import ThreadedASGIHandler
+from .wsgi import application as wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telecom.settings')
+
+application = ThreadedASGIHandler(
+    wsgi_application, max_concurrency=settings.ASGI_MAX_CONCURRENCY, queue_timeout=settings.ASGI_QUEUE_TIMEOUT
+)
@@ -25,6 +25,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'records.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,8 +55,40 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'telecom.wsgi.application'
 
+# Requests run at once by each ASGI worker, each in a thread with its own database connection, and seconds requests
+# wait for their turn before being answered with 503
+ASGI_MAX_CONCURRENCY = config('ASGI_MAX_CONCURRENCY', default=32, cast=int)
+ASGI_QUEUE_TIMEOUT = config('ASGI_QUEUE_TIMEOUT', default=30, cast=float)
+
+# Seconds connections are kept open between requests, 0 closes them at the end of each request
+DATABASE_CONN_MAX_AGE = config('DATABASE_CONN_MAX_AGE', default=60, cast=int)
+# Check persistent PostgreSQL connections before their first query in each request
+DATABASE_HEALTH_CHECKS = config('DATABASE_HEALTH_CHECKS', default=True, cast=bool)
+# Connections shared by the threads of each process, 0 disables the pool
+DATABASE_POOL_SIZE = config('DATABASE_POOL_SIZE', default=0, cast=int)
+DATABASE_POOL_TIMEOUT = config('DATABASE_POOL_TIMEOUT', default=30, cast=float)
+DATABASE_REPLICA_URL = config('DATABASE_REPLICA_URL', default='', cast=str)
+
+
+def get_database(url: str) -> dict:
+    database = db_url(url, conn_max_age=DATABASE_CONN_MAX_AGE)
+    if database['ENGINE'] in ('django.db.backends.postgresql', 'django.db.backends.postgresql_psycopg2'):
+        database['ENGINE'] = 'records.backends.postgresql'
+        database['CONN_HEALTH_CHECKS'] = DATABASE_HEALTH_CHECKS
+        if DATABASE_POOL_SIZE:
+            # Pooled connections are released at the end of each request
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS'] = {'pool': {'max_size': DATABASE_POOL_SIZE, 'timeout': DATABASE_POOL_TIMEOUT}}
+    return database
+
+
 DATABASES = {
-    'default': config('DATABASE_URL', cast=db_url)
+    'default': get_database(config('DATABASE_URL', cast=str))
+}
+# Without a replica, the alias is a second connection to the default database, which tests read bills through
+DATABASES['replica'] = {
+    **(get_database(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else DATABASES['default']),
+    'TEST': {'MIRROR': 'default'}
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -86,9 +119,16 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = 'staticfiles'
 
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'records.renderers.JSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
@@ -99,3 +139,24 @@ REST_FRAMEWORK = {
 
 MINUTE_RATE = config('MINUTE_RATE', cast=float)
 CONNECTION_FEE = config('CONNECTION_FEE', cast=float)
+# Rates of the calls started before the first tariff. Processes check for tariff changes with this interval, in seconds
+RECORDS_TARIFF_RELOAD_INTERVAL = config('RECORDS_TARIFF_RELOAD_INTERVAL', default=30, cast=float)
+
+# 'sync' stores records within the request, 'queue' appends them to a local spool drained by drain_ingest_queue
+RECORDS_INGEST_MODE = config('RECORDS_INGEST_MODE', default='sync', cast=str)
+RECORDS_INGEST_QUEUE_PATH = config('RECORDS_INGEST_QUEUE_PATH', default=os.path.join(BASE_DIR, 'ingest_queue.sqlite3'))
+
+# Bills of closed periods only change when a late call is completed, which changes their ETag
+RECORDS_BILL_CACHE_MAX_AGE = config('RECORDS_BILL_CACHE_MAX_AGE', default=86400, cast=int)
+# Bill responses kept in each process, and the alias of a cache shared between processes, if any
+RECORDS_BILL_CACHE_SIZE = config('RECORDS_BILL_CACHE_SIZE', default=1024, cast=int)
+RECORDS_BILL_CACHE_ALIAS = config('RECORDS_BILL_CACHE_ALIAS', default='', cast=str)
+# Bills are read from the replica, if any. Records are always stored and checked in the default database
+RECORDS_BILL_DATABASE = 'replica' if DATABASE_REPLICA_URL else 'default'
+
+# Call ids as uuid and phone numbers as bigint in the record tables of PostgreSQL, converted by migrate or
+# compact_storage
+RECORDS_COMPACT_STORAGE = config('RECORDS_COMPACT_STORAGE', default=False, cast=bool)
+
+# Request timings, queries and rows by endpoint, exposed at /metrics and in Server-Timing headers
+RECORDS_METRICS_ENABLED = config('RECORDS_METRICS_ENABLED', default=True, cast=bool)
@@ -1,8 +1,10 @@
 from django.urls import include, path
 from rest_framework.documentation import include_docs_urls
+from records.views import metrics
 
 
 urlpatterns = [
     path('v1/call-records/', include('records.urls')),
-    path('v1/docs/', include_docs_urls(title='Library API Project'))
+    path('v1/docs/', include_docs_urls(title='Library API Project')),
+    path('metrics', metrics, name='metrics')
 ]